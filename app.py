@@ -1,58 +1,142 @@
+import importlib.util
+import multiprocessing
 import os
-from io import BytesIO
+import queue
+import shutil
+import tempfile
 
-import pandas as pd
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from nicegui import events, ui, run, app
 
-from insta_scrap.app import process_input_dataframe
+from insta_scrap import downloads, metrics
+from insta_scrap.app import process_input
+from insta_scrap.decoding import parse_date
+from insta_scrap.sink import sink_format
 from dotenv import load_dotenv
-from dateparser import parse
 from config import config
 from datetime import datetime
 
 load_dotenv()
 
+# outputs of the jobs in progress, kept by the cleanup and served partially
+RUNNING_OUTPUTS = set()
+
+OUTPUT_FORMATS = ["csv", "jsonl"]
+if importlib.util.find_spec("pyarrow"):
+    OUTPUT_FORMATS.append("parquet")
+
+
+def is_logged_in() -> bool:
+    api_key = app.storage.user.get("api_key")
+    if not api_key:
+        return False
+    diff = abs(parse_date(api_key["exp"]) - datetime.now())
+    return api_key["value"] == config.APP_KEY and diff.days <= 0
+
 
 class InstaApp:
     def __init__(self):
-        self.input_df = None
+        self.input_path = None
         self.password = None
         self.total_results = 10
-        self.file_name = f"{str(int(datetime.now().timestamp()))}.csv"
+        self.output_format = "csv"
+        self.file_name = None
         self.token = None
+        # latest snapshot published by the engine, see insta_scrap.progress
+        self.progress = None
+        self.channel = None
 
     async def start_bot(self):
-        self.spinner.visible = True
-        file_name = await run.cpu_bound(
-            process_input_dataframe,
-            self.input_df,
-            self.file_name,
-            self.total_results,
-            self.token,
+        if not self.input_path:
+            ui.notify("Upload a seed file first", position="top", type="warning")
+            return
+        os.makedirs(config.OUTPUT_DIR, exist_ok=True)
+        self.file_name = os.path.join(
+            config.OUTPUT_DIR,
+            f"{str(int(datetime.now().timestamp()))}.{self.output_format}",
         )
+        RUNNING_OUTPUTS.add(os.path.abspath(self.file_name))
+        self.spinner.visible = True
+        self.downloads.clear()
+        # rows flushed so far, the file keeps growing; the queue engine only
+        # writes it from the broker once the job is finished
+        if self.output_format != "parquet" and config.SCRAPER_ENGINE != "queue":
+            with self.downloads:
+                self.download_button("Download partial results")
+        # the async and queue engines only wait on I/O (or on the workers),
+        # a thread avoids the pickling hop of a separate process
+        in_thread = config.SCRAPER_ENGINE in ("async", "queue")
+        runner = run.io_bound if in_thread else run.cpu_bound
+        # progress channel, a Manager queue can be passed to the process
+        manager = None
+        if in_thread:
+            self.channel = queue.Queue()
+        else:
+            manager = multiprocessing.Manager()
+            self.channel = manager.Queue()
+        try:
+            file_name = await runner(
+                process_input,
+                self.input_path,
+                self.file_name,
+                self.total_results,
+                self.token,
+                None,
+                None,
+                self.channel,
+            )
+        finally:
+            RUNNING_OUTPUTS.discard(os.path.abspath(self.file_name))
+            self.poll_progress()
+            self.channel = None
+            if manager:
+                manager.shutdown()
+            # the seeds were read, a new job needs a new upload
+            self.remove_input()
         self.spinner.visible = False
 
-        output_df = pd.read_csv(file_name)
-        buffer = BytesIO()
-        output_df.to_csv(buffer, index=False)
-        os.remove(file_name)
-        ui.button(
-            "Download output",
-            on_click=lambda: ui.download.content(
-                buffer.getvalue(), filename="output.csv"
-            ),
-        ).classes("full-width m-5")
+        self.downloads.clear()
+        if file_name and os.path.exists(file_name):
+            # streamed by /download from the sink's file, deleted by the
+            # retention cleanup
+            with self.downloads:
+                self.download_button("Download output")
+                self.download_button("Download compressed (.gz)", compress=True)
+
+    def download_button(self, label: str, compress: bool = False):
+        url = f"/download/{os.path.basename(self.file_name)}"
+        if compress:
+            url += "?compress=true"
+        ui.button(label, on_click=lambda: ui.download(url)).classes("full-width m-5")
 
     def handle_upload(self, e: events.UploadEventArguments):
-        byte_content = e.content.read()
-        self.input_df = pd.read_csv(BytesIO(byte_content))
+        # spooled to disk, the engine streams the seeds from the file
+        with tempfile.NamedTemporaryFile("wb", suffix=".csv", delete=False) as file:
+            shutil.copyfileobj(e.content, file)
+        self.remove_input()
+        self.input_path = file.name
+
+    def remove_input(self):
+        if self.input_path:
+            try:
+                os.remove(self.input_path)
+            except FileNotFoundError:
+                pass
+        self.input_path = None
+
+    def on_client_delete(self):
+        # session gone: the upload of a job still running is removed when
+        # the job ends
+        if self.channel is None:
+            self.remove_input()
 
     def handle_login(self):
         if self.password == config.APP_KEY:
             ui.notify("Logged IN", position="top", type="positive")
             app.storage.user["api_key"] = {
                 "value": self.password,
-                "exp": parse("now").isoformat(),
+                "exp": datetime.now().isoformat(),
             }
             ui.navigate.reload()
         else:
@@ -65,17 +149,45 @@ class InstaApp:
             ).classes("w-1/2 text-center m-5 flat").bind_value(self, "password")
             ui.button("Login").classes("flat").on_click(lambda: self.handle_login())
 
+    def poll_progress(self):
+        # keep the latest snapshot, the engine may have sent several
+        if self.channel is None:
+            return
+        latest = None
+        while True:
+            try:
+                latest = self.channel.get_nowait()
+            except queue.Empty:
+                break
+            except (EOFError, OSError):
+                # manager already shut down
+                break
+        if latest:
+            self.progress = latest
+            self.reload_output.refresh()
+
     @ui.refreshable
     def reload_output(self):
-        total_users = 0
-        try:
-            users_df = pd.read_csv(self.file_name)
-            total_users = len(users_df)
-        except Exception:
-            total_users = 0
-        ui.label(f"Total users extracted - {total_users}").classes(
+        progress = self.progress or {}
+        ui.label(f"Total users extracted - {progress.get('accepted', 0)}").classes(
             "text-h5 text-blue text-center"
         )
+        if not progress:
+            return
+        ui.label(
+            f"Seeds done - {progress['seeds_done']} | "
+            f"Followers seen - {progress['followers_seen']} | "
+            f"API calls - {progress['api_calls']} | "
+            f"LLM calls - {progress['llm_calls']}"
+        ).classes("text-center")
+        if progress["rejected"]:
+            rejected = ", ".join(
+                f"{reason} {count}" for reason, count in progress["rejected"].items()
+            )
+            ui.label(f"Rejected - {rejected}").classes("text-center")
+        if progress["eta"] is not None:
+            minutes, seconds = divmod(int(progress["eta"]), 60)
+            ui.label(f"ETA - {minutes}m {seconds:02d}s").classes("text-center")
 
     def main(self):
         with ui.header().classes("flex justify-center"):
@@ -86,32 +198,85 @@ class InstaApp:
                 "accept=.csv flat"
             ).classes("w-full")
             ui.number(label="Total to scrape").bind_value(self, "total_results")
+            ui.select(OUTPUT_FORMATS, label="Output format").bind_value(
+                self, "output_format"
+            )
             ui.input(label="Token").bind_value(self, "token")
             ui.button("Start Extracting").classes("full-width m-5").on_click(
                 self.start_bot
             )
             self.spinner = ui.spinner(size="lg", type="box").classes("w-full")
             self.spinner.visible = False
+            self.downloads = ui.element("div").classes("w-full")
             self.reload_output()
-            ui.timer(2, callback=lambda: self.reload_output.refresh())
+            # reads the in-memory channel only, the output file is not touched
+            ui.timer(config.PROGRESS_INTERVAL, callback=self.poll_progress)
+        ui.context.client.on_delete(self.on_client_delete)
 
 
 @ui.page("/")
 def start_app():
     ui.colors(primary="black")
     insta_app = InstaApp()
-    api_key = app.storage.user.get("api_key")
-    if api_key:
-        diff = abs(parse(api_key["exp"]) - parse("now"))
-        if (api_key["value"] != config.APP_KEY) or (diff.days > 0):
-            insta_app.login()
-        else:
-            insta_app.main()
+    if is_logged_in():
+        insta_app.main()
     else:
         insta_app.login()
 
 
-ui.run(host="0.0.0.0", storage_secret=config.SECRET_KEY, port=9999)
+@app.get("/download/{name}")
+def download_output(name: str, compress: bool = False):
+    # streamed from the output file, partial while its job is running
+    if not is_logged_in():
+        raise HTTPException(status_code=401)
+    try:
+        path = downloads.output_path(name)
+    except ValueError:
+        raise HTTPException(status_code=404)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404)
+    running = os.path.abspath(path) in RUNNING_OUTPUTS
+    if running and sink_format(path) == "parquet":
+        # the footer is only written when the job ends
+        raise HTTPException(status_code=409, detail="Parquet output not ready")
+    if compress:
+        limit = downloads.flushed_size(path) if running else None
+        return StreamingResponse(
+            downloads.iter_gzip(downloads.iter_file(path, limit)),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{name}.gz"'},
+        )
+    if running:
+        return StreamingResponse(
+            downloads.iter_file(path, downloads.flushed_size(path)),
+            media_type=downloads.media_type(path),
+            headers={"Content-Disposition": f'attachment; filename="{name}"'},
+        )
+    return FileResponse(path, media_type=downloads.media_type(path), filename=name)
+
+
+def cleanup_outputs():
+    downloads.cleanup_outputs(RUNNING_OUTPUTS)
+
+
+app.timer(config.OUTPUT_CLEANUP_INTERVAL, cleanup_outputs)
+
+
+if metrics.ENABLED:
+
+    # merged view of this server and of the engine and worker processes
+    @app.get("/metrics")
+    def metrics_endpoint():
+        return PlainTextResponse(
+            metrics.render(metrics.collect()),
+            media_type="text/plain; version=0.0.4",
+        )
+
+
+# guarded so importing this module (or a NiceGUI worker process) does not
+# start a server, use python -m insta_scrap for headless runs
+if __name__ in {"__main__", "__mp_main__"}:
+    ui.run(host="0.0.0.0", storage_secret=config.SECRET_KEY, port=9999)
 
 # if __name__ == "__main__":
 #     from insta_scrap.get_gender import get_username_last_post_date
@@ -0,0 +1,141 @@
+import sys
+
+sys.path.append(".")
+
+import json
+import time
+import tracemalloc
+from datetime import datetime
+
+from insta_scrap.decoding import decode_followers, loads
+from insta_scrap.get_gender import parse_last_post_date
+from insta_scrap.log_client import logger
+from insta_scrap.user_info import validate_user_data
+
+# Per-profile decoding cost: the /v1/info and /v1/posts payloads of a profile
+# decoded the previous way (json module, .get() chains, dateparser for the
+# join date and the last post timestamp) and through insta_scrap.decoding.
+# Also compares the memory held by a page of follower records.
+# Run with: python benchmarks/bench_decoding.py [profiles]
+
+
+def info_payload(i: int) -> bytes:
+    return json.dumps(
+        {
+            "data": {
+                "id": str(1000 + i),
+                "username": f"user_{i}",
+                "full_name": f"User {i}",
+                "biography": "coffee, mountains and film photography",
+                "media_count": 40 + i % 50,
+                "follower_count": 300 + i,
+                "following_count": 200 + i,
+                "is_private": False,
+                "about": {"date_joined": "March 2015", "country": "United States"},
+                "profile_pic_url_hd": f"https://cdn.example/{i}.jpg",
+            }
+        }
+    ).encode()
+
+
+def posts_payload(i: int) -> bytes:
+    items = [
+        {
+            "id": f"{i}_{n}",
+            "comment_count": n,
+            "caption": {"created_at_utc": 1_700_000_000 - i * 3600 - n * 86400},
+        }
+        for n in range(12)
+    ]
+    return json.dumps({"data": {"items": items}, "pagination_token": None}).encode()
+
+
+def followers_payload(count: int) -> bytes:
+    items = [
+        {"username": f"follower_{n}", "is_private": n % 10 == 9} for n in range(count)
+    ]
+    return json.dumps({"data": {"items": items}, "pagination_token": "next"}).encode()
+
+
+def legacy_profile(info: bytes, posts: bytes):
+    # the decoding done before insta_scrap.decoding, kept here as reference
+    import dateparser
+
+    data = json.loads(info).get("data", None)
+    if not data or not data.get("id"):
+        return None
+    post_count = data.get("post_count", data.get("media_count"))
+    if not post_count or post_count < 3 or data.get("is_private"):
+        return None
+    joined = dateparser.parse(data.get("about", {}).get("date_joined"))
+    today = datetime.today()
+    if (today.year - joined.year) * 12 + (today.month - joined.month) < 6:
+        return None
+    user = {
+        "user_id": data["id"],
+        "username": data.get("username", ""),
+        "full_name": data.get("full_name", ""),
+        "bio": data.get("biography", ""),
+        "follower_count": data.get("follower_count", ""),
+        "following_count": data.get("following_count", ""),
+        "post_count": data.get("media_count"),
+        "country": data.get("about", {}).get("country"),
+    }
+    post_data = json.loads(posts).get("data", {})
+    items = post_data.get("items") if post_data else []
+    created = items[0]["caption"]["created_at_utc"] if items else None
+    last_post = dateparser.parse(str(created)) if created else None
+    user["last_post_date"] = last_post.isoformat() if last_post else None
+    return user
+
+
+def typed_profile(info: bytes, posts: bytes):
+    user = validate_user_data("bench", loads(info).get("data"))
+    if user:
+        user["user_infos"]["last_post_date"] = parse_last_post_date(loads(posts))
+    return user
+
+
+def measure(decode, payloads) -> dict:
+    # warm up: imports and caches are not part of the per-profile cost
+    decode(*payloads[0])
+    started = time.process_time()
+    results = [decode(info, posts) for info, posts in payloads]
+    cpu = time.process_time() - started
+    assert all(results), "a profile was rejected"
+    # allocations on a second pass, tracemalloc slows the timing down
+    tracemalloc.start()
+    for info, posts in payloads:
+        decode(info, posts)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_us": cpu / len(payloads) * 1e6, "peak_kb": peak / 1024}
+
+
+def follower_memory(payload: bytes, decode) -> float:
+    tracemalloc.start()
+    records = decode(payload)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current / 1024
+
+
+if __name__ == "__main__":
+    profiles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    logger.disable("insta_scrap")
+    payloads = [(info_payload(i), posts_payload(i)) for i in range(profiles)]
+    legacy = measure(legacy_profile, payloads)
+    typed = measure(typed_profile, payloads)
+    for label, result in (("legacy", legacy), ("typed", typed)):
+        print(
+            f"{label:<8} cpu/profile={result['cpu_us']:8.1f}us "
+            f"peak={result['peak_kb']:9.1f}KB"
+        )
+    print(f"speedup  {legacy['cpu_us'] / typed['cpu_us']:.1f}x")
+
+    page = followers_payload(1000)
+    dicts = follower_memory(page, lambda raw: json.loads(raw)["data"]["items"])
+    records = follower_memory(page, lambda raw: decode_followers(loads(raw))[0])
+    print(f"1000 followers: dicts={dicts:.1f}KB records={records:.1f}KB")
+    assert typed["cpu_us"] < legacy["cpu_us"], "typed decoding is not faster"
@@ -0,0 +1,36 @@
+import sys
+
+sys.path.append(".")
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.stub_server import start_stub_server
+from insta_scrap import http_client
+
+# Compare bare requests.get against the shared pooled session on the local
+# stub: same number of calls, count the TCP connections the server accepted.
+# Run with: python benchmarks/bench_http_pool.py
+
+
+def run(label, get, url, calls=500, workers=10):
+    server, base_url = start_stub_server()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as worker:
+        list(worker.map(lambda _: get(f"{base_url}{url}").json(), range(calls)))
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    print(
+        f"{label:<10} calls={server.stats['requests']:<5} "
+        f"connections={server.stats['connections']:<5} "
+        f"elapsed={elapsed:.2f}s rps={calls / elapsed:.0f}"
+    )
+    return server.stats
+
+
+if __name__ == "__main__":
+    bare = run("bare", lambda url: requests.get(url, timeout=10), "/v1/info")
+    pooled = run("pooled", lambda url: http_client.http_get(url), "/v1/info")
+    assert pooled["connections"] < bare["connections"], "connections not reused"
@@ -0,0 +1,54 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Import cost of the library and CLI entry points, without any API key set.
+# Fails when a heavy dependency is imported eagerly again or when the median
+# import time goes over the budget.
+# Run with: python benchmarks/bench_import_time.py [budget_seconds]
+
+MODULES = ("insta_scrap.app", "insta_scrap.__main__", "insta_scrap.worker")
+
+# imported on first use only
+LAZY = ("pandas", "google.genai", "dateparser", "supabase", "nicegui", "httpx")
+
+KEYS = ("GEMINI_API_KEY", "RAPID_API_KEY", "SUPABASE_KEY", "SUPABASE_URL")
+
+CHECK = """
+import sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(elapsed, ",".join(m for m in {lazy!r} if m in sys.modules))
+"""
+
+
+def measure(module: str, runs: int = 5) -> tuple[float, list[str]]:
+    env = {key: value for key, value in os.environ.items() if key not in KEYS}
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", CHECK.format(module=module, lazy=LAZY)],
+            capture_output=True,
+            text=True,
+            env=env,
+            check=True,
+        ).stdout.split()
+        timings.append(float(output[0]))
+        loaded = output[1].split(",") if len(output) > 1 else []
+    return statistics.median(timings), loaded
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 1.5
+    started = time.perf_counter()
+    failed = False
+    for module in MODULES:
+        elapsed, loaded = measure(module)
+        print(f"{module:<22} median={elapsed:.3f}s eager={loaded or '-'}")
+        failed |= elapsed > budget or bool(loaded)
+    print(f"total {time.perf_counter() - started:.1f}s, budget {budget}s per module")
+    assert not failed, "import time regression"
@@ -0,0 +1,216 @@
+import sys
+
+sys.path.append(".")
+
+import argparse
+import csv
+import dataclasses
+import json
+import os
+import resource
+import tempfile
+import time
+
+from benchmarks.stub_server import ScraperStubHandler, StubSettings, start_stub_server
+
+# End to end run of the real pipeline against the local stub: RapidAPI
+# endpoints, profile images and Gemini generateContent all answer from
+# 127.0.0.1, no quota is used. Reports profiles/sec, p50/p99 per stage, peak
+# RSS and API calls per accepted user, and compares with a saved baseline.
+#
+#     python benchmarks/bench_pipeline.py --engine threads --total 50 --save base.json
+#     python benchmarks/bench_pipeline.py --engine async --total 50 --baseline base.json
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark")
+    parser.add_argument("--engine", choices=("threads", "async", "queue"), default="threads")
+    parser.add_argument("--source", choices=("followers", "commenters"), default="followers")
+    parser.add_argument("--total", type=int, default=50, help="accepted users to collect")
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, help="analysis workers")
+    parser.add_argument("--batch-size", type=int, help="profiles per Gemini request")
+    parser.add_argument(
+        "--supabase", action="store_true", help="also upsert rows into the stub PostgREST"
+    )
+    parser.add_argument("--hedge", action="store_true", help="hedge slow RapidAPI GETs")
+    parser.add_argument("--deadline", type=float, help="seconds per profile")
+    # stub behaviour, see StubSettings; typed from the annotations, not the
+    # defaults (a float field may default to an int)
+    for field in dataclasses.fields(StubSettings):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}", type=field.type, default=field.default
+        )
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    return parser.parse_args(argv)
+
+
+def configure(args: argparse.Namespace, base_url: str, workdir: str):
+    # before any insta_scrap import, config/config.py reads the environment
+    os.environ.update(
+        RAPID_API_BASE_URL=base_url,
+        RAPID_API_HOST="stub",
+        RAPID_API_KEY="stub",
+        GEMINI_API_KEY="stub",
+        GEMINI_BASE_URL=base_url,
+        # every run starts cold and measures the same work
+        CACHE_ENABLED="false",
+        CHECKPOINT_ENABLED="false",
+        METRICS_ENABLED="true",
+        METRICS_DIR=os.path.join(workdir, "metrics"),
+        METRICS_SNAPSHOT_INTERVAL="0.5",
+        QUEUE_PATH=os.path.join(workdir, "queue.sqlite3"),
+        QUEUE_POLL_INTERVAL="0.2",
+        SOURCE_MODE=args.source,
+    )
+    if args.engine:
+        os.environ["SCRAPER_ENGINE"] = args.engine
+    if args.concurrency:
+        for name in (
+            "INFO_WORKERS",
+            "IMAGE_WORKERS",
+            "LLM_WORKERS",
+            "ASYNC_WORKERS",
+            "QUEUE_WORKER_THREADS",
+        ):
+            os.environ[name] = str(args.concurrency)
+    if args.batch_size:
+        os.environ["GEMINI_BATCH_SIZE"] = str(args.batch_size)
+    if args.hedge:
+        os.environ["HEDGE_ENABLED"] = "true"
+    if args.deadline is not None:
+        os.environ["PROFILE_DEADLINE"] = str(args.deadline)
+    if args.supabase:
+        os.environ.update(
+            SINK_TARGETS="file,supabase",
+            SUPABASE_URL=base_url,
+            SUPABASE_KEY="stub",
+            SUPABASE_TABLE="scraped_users",
+        )
+
+
+def count_rows(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, newline="") as file:
+        return sum(1 for _ in csv.DictReader(file))
+
+
+def api_calls(stats: dict) -> dict:
+    calls = {}
+    for key, count in stats["endpoints"].items():
+        endpoint = key.split()[0]
+        calls[endpoint] = calls.get(endpoint, 0) + count
+    return calls
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux, workers of the queue engine are children
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def run(args: argparse.Namespace) -> dict:
+    settings = StubSettings(
+        **{name: getattr(args, name) for name in vars(StubSettings())}
+    )
+    server, base_url = start_stub_server(ScraperStubHandler, settings=settings)
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    configure(args, base_url, workdir)
+
+    from insta_scrap import metrics
+    from insta_scrap.app import process_input
+
+    output = os.path.join(workdir, "output.csv")
+    seeds = [f"seed_{chr(97 + i % 26)}{i // 26 or ''}" for i in range(args.seeds)]
+    started = time.perf_counter()
+    process_input(seeds, output, args.total, None, job_id="bench")
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    accepted = count_rows(output)
+    calls = api_calls(server.stats)
+    # this process plus the snapshots left by the queue workers
+    report = metrics.summary(metrics.collect())
+    analysed = calls.get("/v1/info", 0)
+    return {
+        "engine": args.engine,
+        "source": args.source,
+        "settings": vars(settings),
+        "elapsed": elapsed,
+        "accepted": accepted,
+        "upserted": len(server.tables.get("scraped_users", {})) if args.supabase else None,
+        "accepted_per_sec": accepted / elapsed,
+        "profiles_per_sec": analysed / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "api_calls": calls,
+        "calls_per_accepted": {
+            endpoint: count / accepted for endpoint, count in calls.items()
+        }
+        if accepted
+        else {},
+        "spikes": server.stats["spikes"],
+        "counters": {
+            name: value
+            for name, value in report.get("counters", {}).items()
+            if name.startswith(("hedge", "deadline", "abandoned"))
+        },
+        "errors": {
+            key: count
+            for key, count in server.stats["endpoints"].items()
+            if not key.endswith(" 200")
+        },
+        "stages": report["stages"],
+    }
+
+
+def print_report(result: dict, baseline: dict | None = None):
+    def delta(value, old):
+        if old in (None, 0) or value is None:
+            return ""
+        return f" ({(value - old) / old:+.0%})"
+
+    base = baseline or {}
+    print(
+        f"engine {result['engine']}, source {result['source']}, "
+        f"{result['accepted']} accepted in {result['elapsed']:.1f}s"
+    )
+    if result.get("upserted") is not None:
+        print(f"  upserted rows      {result['upserted']:>9}")
+    for name in ("profiles_per_sec", "accepted_per_sec", "peak_rss_mb"):
+        print(f"  {name:<18} {result[name]:>9.2f}{delta(result[name], base.get(name))}")
+    print("  calls per accepted user")
+    old_calls = base.get("calls_per_accepted", {})
+    for endpoint, value in sorted(result["calls_per_accepted"].items()):
+        print(f"    {endpoint:<16} {value:>7.2f}{delta(value, old_calls.get(endpoint))}")
+    if result["errors"]:
+        print(f"  injected errors  {result['errors']}")
+    if result.get("spikes"):
+        print(f"  latency spikes   {result['spikes']} {result['counters']}")
+    print(f"  {'stage':<14} {'calls':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    old_stages = base.get("stages", {})
+    for stage, values in sorted(result["stages"].items()):
+        p50 = values["p50"] * 1000 if values["p50"] is not None else None
+        p99 = values["p99"] * 1000 if values["p99"] is not None else None
+        old = old_stages.get(stage, {})
+        old_p50 = old["p50"] * 1000 if old.get("p50") is not None else None
+        print(
+            f"  {stage:<14} {values['calls']:>6} {p50 or 0:>9.1f} {p99 or 0:>9.1f}"
+            f"{delta(p50, old_p50)}"
+        )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    result = run(args)
+    print_report(result, baseline)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(result, file, indent=2)
+    assert result["accepted"] >= args.total, "fewer accepted users than requested"
@@ -0,0 +1,72 @@
+import sys
+
+sys.path.append(".")
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_server import StubHandler, start_stub_server
+
+# Fire /v1/info calls at a stub that only allows SERVER_RPS requests per
+# second and answers 429 + Retry-After above it. Every call should end up
+# succeeding, with the limiter pausing instead of hammering the stub.
+# Run with: python benchmarks/bench_rate_limit.py
+
+SERVER_RPS = 20
+CALLS = 200
+
+
+class ThrottlingHandler(StubHandler):
+    def do_GET(self):
+        server = self.server
+        with server.stats_lock:
+            now = time.monotonic()
+            server.tokens = min(
+                SERVER_RPS, server.tokens + (now - server.updated) * SERVER_RPS
+            )
+            server.updated = now
+            allowed = server.tokens >= 1
+            if allowed:
+                server.tokens -= 1
+            else:
+                server.stats["throttled"] = server.stats.get("throttled", 0) + 1
+        if allowed:
+            return super().do_GET()
+        self.send_response(429)
+        self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+if __name__ == "__main__":
+    server, base_url = start_stub_server(ThrottlingHandler)
+    server.tokens, server.updated = SERVER_RPS, time.monotonic()
+    os.environ["RAPID_API_BASE_URL"] = base_url
+    # a client budget well above what the stub accepts, AIMD has to adapt
+    os.environ.setdefault("RATE_LIMIT_INFO_RPS", "100")
+
+    from insta_scrap.http_client import rapidapi_get
+    from insta_scrap.rate_limit import get_limiter
+
+    statuses = []
+    lock = threading.Lock()
+
+    def call(_):
+        status = rapidapi_get("/v1/info", {"username_or_id_or_url": "x"}).status_code
+        with lock:
+            statuses.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=32) as worker:
+        list(worker.map(call, range(CALLS)))
+    elapsed = time.perf_counter() - started
+    limiter = get_limiter("/v1/info")
+    server.shutdown()
+    print(
+        f"ok={statuses.count(200)}/{CALLS} served_429={server.stats.get('throttled', 0)} "
+        f"limiter_throttled={limiter.throttled} concurrency={limiter.limit:.1f} "
+        f"elapsed={elapsed:.1f}s (floor {CALLS / SERVER_RPS:.0f}s)"
+    )
+    assert statuses.count(200) == CALLS, "throttled calls were not retried"
@@ -0,0 +1,308 @@
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Minimal local stand-in for the RapidAPI endpoints, it counts requests and
+# distinct TCP connections so the benchmarks can check keep-alive reuse.
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+        body = json.dumps({"data": {"items": []}, "pagination_token": None})
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@dataclass
+class StubSettings:
+    # seconds added to every answer, per endpoint family
+    latency: float = 0.02
+    image_latency: float = 0.01
+    gemini_latency: float = 0.3
+    # share of requests answered 500, or 429 with Retry-After
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: float = 1.0
+    # share of GET requests held spike_latency seconds longer (tail latency)
+    spike_rate: float = 0.0
+    spike_latency: float = 2.0
+    # follower pages per seed and followers per page
+    page_size: int = 25
+    pages: int = 4
+    # comment pages per post, commenters per page
+    comment_pages: int = 3
+    comments: int = 15
+    image_size: int = 20_000
+    # share of profiles the fake classifier accepts
+    accept_rate: float = 0.5
+    seed: int = 0
+
+
+BIOS = (
+    "coffee, mountains and film photography",
+    "founder | runner | dad",
+    "she/her, books and plants",
+    "living my best life",
+    "",
+)
+
+GEMINI_PATH = re.compile(r"^/v1(beta)?/models/[^/:]+:generateContent$")
+REST_PATH = re.compile(r"^/rest/v1/(\w+)$")
+
+
+def verdict(text: str, accept_rate: float) -> bool:
+    # stable per profile, so repeated runs accept the same users
+    return zlib.crc32(text.encode()) % 1000 < accept_rate * 1000
+
+
+# Stand-in for the whole scrape: /v1/followers, /v1/info, /v1/posts, the
+# profile images, Gemini generateContent (point GEMINI_BASE_URL at it) and
+# PostgREST upserts under /rest/v1 (SUPABASE_URL), kept in server.tables.
+# Requests are counted per endpoint in server.stats["endpoints"].
+class ScraperStubHandler(StubHandler):
+    def handle(self):
+        # requests cancelled once the quota is met hang up mid-answer
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def endpoint(self, path: str) -> str:
+        if path.startswith("/img/"):
+            return "image"
+        if GEMINI_PATH.match(path):
+            return "gemini"
+        if REST_PATH.match(path):
+            return "rest"
+        return path
+
+    def count(self, endpoint: str, status: int):
+        with self.server.stats_lock:
+            stats = self.server.stats
+            stats["requests"] += 1
+            key = f"{endpoint} {status}"
+            stats["endpoints"][key] = stats["endpoints"].get(key, 0) + 1
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status: int = 200, headers=()):
+        self.send_body(json.dumps(data).encode(), "application/json", status, headers)
+
+    def spike(self, endpoint: str):
+        settings = self.server.settings
+        with self.server.stats_lock:
+            draw = self.server.random.random()
+            if draw < settings.spike_rate:
+                self.server.stats["spikes"] += 1
+        if draw < settings.spike_rate:
+            time.sleep(settings.spike_latency)
+
+    def fail(self, endpoint: str) -> bool:
+        # injected 429 / 500, drawn from the server's seeded generator
+        settings = self.server.settings
+        with self.server.stats_lock:
+            draw = self.server.random.random()
+        if draw < settings.throttle_rate:
+            self.count(endpoint, 429)
+            self.send_json(
+                {"message": "Too many requests"},
+                429,
+                [("Retry-After", f"{settings.retry_after:g}")],
+            )
+            return True
+        if draw < settings.throttle_rate + settings.error_rate:
+            self.count(endpoint, 500)
+            self.send_json({"message": "Internal error"}, 500)
+            return True
+        return False
+
+    def do_GET(self):
+        settings = self.server.settings
+        url = urlparse(self.path)
+        query = {key: value[0] for key, value in parse_qs(url.query).items()}
+        endpoint = self.endpoint(url.path)
+        time.sleep(settings.image_latency if endpoint == "image" else settings.latency)
+        self.spike(endpoint)
+        if self.fail(endpoint):
+            return
+        self.count(endpoint, 200)
+        if endpoint == "/v1/followers":
+            self.send_json(self.followers(query))
+        elif endpoint == "/v1/info":
+            self.send_json(self.info(query["username_or_id_or_url"]))
+        elif endpoint == "/v1/posts":
+            self.send_json(self.posts(query["username_or_id_or_url"]))
+        elif endpoint == "/v1/comments":
+            self.send_json(self.comments(query))
+        elif endpoint == "image":
+            self.send_body(self.image(url.path), "image/jpeg")
+        else:
+            self.send_json({"data": None})
+
+    def do_POST(self):
+        settings = self.server.settings
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        url = urlparse(self.path)
+        endpoint = self.endpoint(url.path)
+        if endpoint == "rest":
+            time.sleep(settings.latency)
+            if self.fail(endpoint):
+                return
+            self.count(endpoint, 200)
+            self.upsert(REST_PATH.match(url.path).group(1), url.query, request)
+            self.send_body(b"", "application/json", 201)
+            return
+        time.sleep(settings.gemini_latency)
+        if endpoint != "gemini":
+            self.count(endpoint, 404)
+            self.send_json({"error": "not found"}, 404)
+            return
+        if self.fail(endpoint):
+            return
+        self.count(endpoint, 200)
+        self.send_json(self.generate_content(request))
+
+    def followers(self, query: dict) -> dict:
+        settings = self.server.settings
+        seed = query["username_or_id_or_url"]
+        page = int(query.get("pagination_token") or 0)
+        items = [
+            {"username": f"{seed}_{page}_{i}", "is_private": i % 10 == 9}
+            for i in range(settings.page_size)
+        ]
+        next_token = str(page + 1) if page + 1 < settings.pages else None
+        return {"data": {"items": items}, "pagination_token": next_token}
+
+    def info(self, username: str) -> dict:
+        number = zlib.crc32(username.encode())
+        return {
+            "data": {
+                "id": str(number),
+                "username": username,
+                "full_name": username.replace("_", " ").title(),
+                "biography": BIOS[number % len(BIOS)],
+                "media_count": number % 200,
+                "follower_count": number % 5000,
+                "following_count": number % 900,
+                "about": {"date_joined": "March 2015", "country": "United States"},
+                "profile_pic_url_hd": f"http://{self.headers['Host']}/img/{username}.jpg",
+            }
+        }
+
+    def posts(self, username: str) -> dict:
+        created = 1_700_000_000 - zlib.crc32(username.encode()) % 10_000_000
+        items = [
+            {
+                "id": f"{username}_{i}",
+                "code": f"{username}_{i}",
+                "comment_count": 12,
+                "caption": {"created_at_utc": created - i * 86400},
+            }
+            for i in range(12)
+        ]
+        return {"data": {"items": items}, "pagination_token": None}
+
+    def comments(self, query: dict) -> dict:
+        settings = self.server.settings
+        post = query["code_or_id_or_url"]
+        page = int(query.get("pagination_token") or 0)
+        items = [
+            {"user": {"username": f"{post}_c{page}_{i}"}}
+            for i in range(settings.comments)
+        ]
+        next_token = str(page + 1) if page + 1 < settings.comment_pages else None
+        return {"data": {"items": items}, "pagination_token": next_token}
+
+    def upsert(self, table: str, query: str, rows):
+        key = parse_qs(query).get("on_conflict", ["id"])[0]
+        with self.server.stats_lock:
+            stored = self.server.tables.setdefault(table, {})
+            for row in rows if isinstance(rows, list) else [rows]:
+                stored[row[key]] = row
+
+    def image(self, path: str) -> bytes:
+        # a JPEG header and unique filler, so the image dedupe sees distinct
+        # pictures
+        size = self.server.settings.image_size
+        return (b"\xff\xd8\xff\xe0" + path.encode() * size)[:size]
+
+    def generate_content(self, request: dict) -> dict:
+        settings = self.server.settings
+        texts = [
+            part["text"]
+            for content in request.get("contents", [])
+            for part in content.get("parts", [])
+            if "text" in part
+        ]
+        profiles = [
+            match
+            for text in texts
+            for match in re.findall(r"Profile: (\S+)", text)
+        ]
+        if profiles:
+            answer = [
+                {"username": name, "is_male": verdict(name, settings.accept_rate)}
+                for name in profiles
+            ]
+        else:
+            answer = {"is_male": verdict("".join(texts), settings.accept_rate)}
+        images = sum(
+            "inlineData" in part or "inline_data" in part
+            for content in request.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        return {
+            "candidates": [
+                {
+                    "content": {"role": "model", "parts": [{"text": json.dumps(answer)}]},
+                    "finishReason": "STOP",
+                }
+            ],
+            "usageMetadata": {
+                "promptTokenCount": 258 * images + sum(len(t) // 4 for t in texts),
+                "candidatesTokenCount": 8 * max(len(profiles), 1),
+            },
+        }
+
+
+def start_stub_server(handler=StubHandler, host="127.0.0.1", port=0, settings=None):
+    # Start the stub in a daemon thread and return (server, base_url)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.stats = {"connections": 0, "requests": 0, "spikes": 0, "endpoints": {}}
+    server.stats_lock = threading.Lock()
+    server.tables = {}
+    server.settings = settings or StubSettings()
+    server.random = random.Random(server.settings.seed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -5,9 +5,199 @@ load_dotenv()
 
 RAPID_API_HOST = os.getenv("RAPID_API_HOST")
 RAPID_API_KEY = os.getenv("RAPID_API_KEY")
+# Override to point the fetchers at a local stub (benchmarks)
+RAPID_API_BASE_URL = os.getenv("RAPID_API_BASE_URL") or f"https://{RAPID_API_HOST}"
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Same for the Gemini API, unset means the Google endpoint
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
 APP_KEY = os.getenv("APP_KEY")
 
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
+
+# HTTP client (shared pooled session)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# Read timeout per stage (images use IMAGE_TIMEOUT), and the budget of one
+# profile from its user info to the sink, 0 disables it
+FOLLOWERS_TIMEOUT = float(os.getenv("FOLLOWERS_TIMEOUT", "20"))
+INFO_TIMEOUT = float(os.getenv("INFO_TIMEOUT", "15"))
+POSTS_TIMEOUT = float(os.getenv("POSTS_TIMEOUT", "15"))
+COMMENTS_TIMEOUT = float(os.getenv("COMMENTS_TIMEOUT", "15"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+PROFILE_DEADLINE = float(os.getenv("PROFILE_DEADLINE", "90"))
+# Hedged requests: a RapidAPI GET still running after the HEDGE_QUANTILE
+# latency of its endpoint (over the last HEDGE_WINDOW answers) is sent again
+# and the first answer wins. HEDGE_BUDGET caps the share of hedged requests
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_ENDPOINTS = [
+    path.strip()
+    for path in os.getenv(
+        "HEDGE_ENDPOINTS", "/v1/followers,/v1/info,/v1/posts,/v1/comments"
+    ).split(",")
+    if path.strip()
+]
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "500"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "64"))
+
+# Scraping engine: "threads", "async" or "queue" (worker processes)
+SCRAPER_ENGINE = os.getenv("SCRAPER_ENGINE", "threads")
+# asyncio engine: profiles in flight, requests on the wire, queued usernames
+ASYNC_WORKERS = int(os.getenv("ASYNC_WORKERS", "200"))
+ASYNC_MAX_REQUESTS = int(os.getenv("ASYNC_MAX_REQUESTS", "64"))
+ASYNC_QUEUE_SIZE = int(os.getenv("ASYNC_QUEUE_SIZE", "500"))
+
+# Seed accounts crawled at once, followers of one seed waiting for analysis
+# before its next page is fetched (0: no cap), accepted users per seed (0: no
+# quota), and page scheduling: "fair" (fewest accepted first) or "round_robin"
+SEED_CONCURRENCY = int(os.getenv("SEED_CONCURRENCY", "4"))
+SEED_MAX_QUEUED = int(os.getenv("SEED_MAX_QUEUED", "50"))
+SEED_QUOTA = int(os.getenv("SEED_QUOTA", "0"))
+SEED_SCHEDULING = os.getenv("SEED_SCHEDULING", "fair")
+
+# Usernames to analyse: "followers" of the seeds, or "commenters" of their
+# posts (posts with more than COMMENT_MIN_COMMENTS comments, comment pages of
+# COMMENT_POSTS_AT_ONCE posts fetched together, COMMENT_MAX_PAGES per post)
+SOURCE_MODE = os.getenv("SOURCE_MODE", "followers")
+COMMENT_MIN_COMMENTS = int(os.getenv("COMMENT_MIN_COMMENTS", "10"))
+COMMENT_POSTS_AT_ONCE = int(os.getenv("COMMENT_POSTS_AT_ONCE", "4"))
+COMMENT_MAX_PAGES = int(os.getenv("COMMENT_MAX_PAGES", "5"))
+
+# Threaded pipeline: workers per stage and bounded queue size between stages,
+# one follower worker per concurrent seed by default
+FOLLOWER_WORKERS = int(os.getenv("FOLLOWER_WORKERS", str(SEED_CONCURRENCY)))
+INFO_WORKERS = int(os.getenv("INFO_WORKERS", "10"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "10"))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "10"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+
+# Persistent profile cache (SQLite), TTLs in seconds
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_PATH = os.getenv("CACHE_PATH", "cache.sqlite3")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+CACHE_TTL_USER_INFO = int(os.getenv("CACHE_TTL_USER_INFO", str(7 * 24 * 3600)))
+CACHE_TTL_IMAGE = int(os.getenv("CACHE_TTL_IMAGE", str(7 * 24 * 3600)))
+CACHE_TTL_GENDER = int(os.getenv("CACHE_TTL_GENDER", str(30 * 24 * 3600)))
+CACHE_TTL_LAST_POST = int(os.getenv("CACHE_TTL_LAST_POST", str(24 * 3600)))
+
+# In-run username dedup: "set" (exact) or "bloom" (fixed memory)
+DEDUP_MODE = os.getenv("DEDUP_MODE", "set")
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "5000000"))
+DEDUP_ERROR_RATE = float(os.getenv("DEDUP_ERROR_RATE", "0.001"))
+
+# Output sink: rows per write, seconds between flushes, queued rows
+SINK_BATCH_SIZE = int(os.getenv("SINK_BATCH_SIZE", "50"))
+SINK_FLUSH_INTERVAL = float(os.getenv("SINK_FLUSH_INTERVAL", "1"))
+SINK_QUEUE_SIZE = int(os.getenv("SINK_QUEUE_SIZE", "10000"))
+# Where accepted rows go: "file", "supabase" or both ("file,supabase")
+SINK_TARGETS = [
+    target.strip()
+    for target in os.getenv("SINK_TARGETS", "file").split(",")
+    if target.strip()
+]
+# Supabase target: bulk upserts on user_id, rows per upsert, seconds between
+# upserts, queued rows before writers block, attempts per batch. A
+# SUPABASE_URL of sqlite:///path upserts into a local SQLite table instead
+SUPABASE_TABLE = os.getenv("SUPABASE_TABLE", "scraped_users")
+SUPABASE_BATCH_SIZE = int(os.getenv("SUPABASE_BATCH_SIZE", "500"))
+SUPABASE_FLUSH_INTERVAL = float(os.getenv("SUPABASE_FLUSH_INTERVAL", "5"))
+SUPABASE_QUEUE_SIZE = int(os.getenv("SUPABASE_QUEUE_SIZE", "5000"))
+SUPABASE_RETRIES = int(os.getenv("SUPABASE_RETRIES", "4"))
+
+# Resumable crawl checkpoints (SQLite), keyed by job id
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "checkpoints.sqlite3")
+
+# Batched Gemini classification, 1 disables batching
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "1"))
+GEMINI_BATCH_WAIT = float(os.getenv("GEMINI_BATCH_WAIT", "0.5"))
+
+# Text-only prefilter run before the image download and the LLM call,
+# an empty PREFILTER_RULES disables it
+PREFILTER_RULES = [
+    rule.strip()
+    for rule in os.getenv("PREFILTER_RULES", "spam,digits,pronouns,foreign").split(",")
+    if rule.strip()
+]
+PREFILTER_SPAM_WORDS = os.getenv(
+    "PREFILTER_SPAM_WORDS", "promo,crypto,bot,giveaway,follow for"
+).split(",")
+PREFILTER_MAX_DIGITS = int(os.getenv("PREFILTER_MAX_DIGITS", "4"))
+
+# RapidAPI rate limiting: requests per second per endpoint, max concurrent
+# requests per endpoint (AIMD), retries and pause on 429/5xx
+RATE_LIMIT_FOLLOWERS_RPS = float(os.getenv("RATE_LIMIT_FOLLOWERS_RPS", "5"))
+RATE_LIMIT_INFO_RPS = float(os.getenv("RATE_LIMIT_INFO_RPS", "20"))
+RATE_LIMIT_POSTS_RPS = float(os.getenv("RATE_LIMIT_POSTS_RPS", "10"))
+RATE_LIMIT_DEFAULT_RPS = float(os.getenv("RATE_LIMIT_DEFAULT_RPS", "10"))
+RATE_LIMIT_MAX_CONCURRENCY = int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", "32"))
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "5"))
+RATE_LIMIT_BACKOFF = float(os.getenv("RATE_LIMIT_BACKOFF", "1"))
+
+# /v1/posts pages kept in memory, shared by get_posts and the last post date
+POSTS_MEMO_SIZE = int(os.getenv("POSTS_MEMO_SIZE", "256"))
+# fetch the last post date while the LLM call runs (one more /v1/posts call
+# for rejected users, one less serial round trip for accepted ones). Off by
+# default: the lookup then happens only for accepted users, on a paid API
+POSTS_PREFETCH = os.getenv("POSTS_PREFETCH", "false").lower() == "true"
+
+# Profile images: download cap and timeout, longest side sent to the LLM
+# (Gemini bills an image up to 384px as a single 258 token tile), processed
+# images kept in memory by content hash
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+IMAGE_TIMEOUT = float(os.getenv("IMAGE_TIMEOUT", "15"))
+IMAGE_CHUNK_SIZE = int(os.getenv("IMAGE_CHUNK_SIZE", str(64 * 1024)))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "384"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_MEMO_SIZE = int(os.getenv("IMAGE_MEMO_SIZE", "512"))
+# Default avatars skip the LLM: known URL parts, known sha1 of the image, or
+# the same image found at this many distinct URLs (accounts) of a job (0 disables)
+IMAGE_DEFAULT_AVATAR_URLS = [
+    part
+    for part in os.getenv(
+        "IMAGE_DEFAULT_AVATAR_URLS", "44884218_345707102882519_2446069589734326272_n"
+    ).split(",")
+    if part
+]
+IMAGE_DEFAULT_AVATAR_HASHES = [
+    digest for digest in os.getenv("IMAGE_DEFAULT_AVATAR_HASHES", "").split(",") if digest
+]
+IMAGE_SHARED_AVATAR_COUNT = int(os.getenv("IMAGE_SHARED_AVATAR_COUNT", "3"))
+
+# Queue engine: SQLite broker shared by the worker processes, local workers
+# started by the app, threads per worker, seconds before the task of a dead
+# worker is handed out again, attempts before a task is given up
+QUEUE_PATH = os.getenv("QUEUE_PATH", "queue.sqlite3")
+QUEUE_LOCAL_WORKERS = int(os.getenv("QUEUE_LOCAL_WORKERS", "2"))
+QUEUE_WORKER_THREADS = int(os.getenv("QUEUE_WORKER_THREADS", "8"))
+QUEUE_LEASE = float(os.getenv("QUEUE_LEASE", "300"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "1"))
+# seed usernames inserted per broker transaction
+QUEUE_SEED_BATCH = int(os.getenv("QUEUE_SEED_BATCH", "1000"))
+
+# Metrics: per-stage counters and latency histograms, snapshots written to
+# METRICS_DIR by every process while a job runs, served on /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "5"))
+# a snapshot not rewritten for this many intervals is from a process that
+# exited (or a finished job) and is dropped from /metrics
+METRICS_STALE_INTERVALS = int(os.getenv("METRICS_STALE_INTERVALS", "3"))
+
+# Seconds between progress snapshots sent to the UI
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "1"))
+
+# Job outputs of the UI, served from disk and deleted after the retention
+# (0 keeps them)
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "outputs")
+OUTPUT_RETENTION_HOURS = float(os.getenv("OUTPUT_RETENTION_HOURS", "24"))
+OUTPUT_CLEANUP_INTERVAL = float(os.getenv("OUTPUT_CLEANUP_INTERVAL", "3600"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+
+# Headless entry point, no NiceGUI:
+#
+#     python -m insta_scrap seeds.csv -o output.csv --total 100
+#
+# The input CSV (or stdin with "-") needs a username_or_url column, it is read
+# lazily so any size runs in constant memory. The output format follows the
+# extension (.csv, .jsonl, .parquet). Flags are turned into the environment
+# variables read by config/config.py, so they are set before any import.
+
+# flag -> config variables it sets, --concurrency covers every engine
+FLAG_SETTINGS = {
+    "engine": ("SCRAPER_ENGINE",),
+    "source": ("SOURCE_MODE",),
+    "concurrency": (
+        "INFO_WORKERS",
+        "IMAGE_WORKERS",
+        "LLM_WORKERS",
+        "ASYNC_WORKERS",
+        "QUEUE_WORKER_THREADS",
+    ),
+    "max_requests": ("ASYNC_MAX_REQUESTS",),
+    "batch_size": ("GEMINI_BATCH_SIZE",),
+    "queue_workers": ("QUEUE_LOCAL_WORKERS",),
+}
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m insta_scrap",
+        description="Scrape the followers of seed accounts and keep the ones the classifier accepts.",
+    )
+    parser.add_argument(
+        "input", help='CSV file with a username_or_url column, "-" for stdin'
+    )
+    parser.add_argument("-o", "--output", required=True, help="output file")
+    parser.add_argument(
+        "-n", "--total", type=int, required=True, help="accepted users to collect"
+    )
+    parser.add_argument("--token", default=None, help="follower pagination token")
+    parser.add_argument(
+        "--job-id", default=None, help="checkpoint id of the job to resume"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="use the output as job id: resumes its checkpoint if there is one",
+    )
+    parser.add_argument("--engine", choices=("threads", "async", "queue"))
+    parser.add_argument(
+        "--source", choices=("followers", "commenters"), help="usernames to analyse"
+    )
+    parser.add_argument("--concurrency", type=int, help="analysis workers")
+    parser.add_argument("--max-requests", type=int, help="async engine requests in flight")
+    parser.add_argument("--batch-size", type=int, help="profiles per Gemini request")
+    parser.add_argument("--queue-workers", type=int, help="local worker processes")
+    return parser.parse_args(argv)
+
+
+def apply_settings(args: argparse.Namespace):
+    for flag, settings in FLAG_SETTINGS.items():
+        value = getattr(args, flag)
+        if value is not None:
+            for name in settings:
+                os.environ[name] = str(value)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    apply_settings(args)
+
+    from insta_scrap.app import process_input
+    from insta_scrap.seeds import open_seeds
+
+    try:
+        # the seeds are streamed from the file, never loaded at once
+        seeds = open_seeds(args.input)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read {args.input}: {e}", file=sys.stderr)
+        return 2
+    # a fresh job unless asked to resume one
+    job_id = args.job_id or (args.output if args.resume else None)
+    result = process_input(seeds, args.output, args.total, args.token, job_id=job_id)
+    return 0 if result else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,135 +2,123 @@ import sys
 
 sys.path.append(".")
 
-import pandas as pd
+import asyncio
+import contextvars
+import os
+import uuid
 from concurrent.futures import ThreadPoolExecutor
-from insta_scrap.get_gender import start_gender_service
+from functools import partial
+from typing import TYPE_CHECKING
+from insta_scrap.get_gender import (
+    generate_gender,
+    get_username_last_post_date,
+    save_user,
+)
 from config import config
-import requests
-from insta_scrap.user_info import get_user_infos
-from the_retry import retry
-from insta_scrap.exceptions_client import exceptions
+from insta_scrap.batch_classifier import BatchClassifier
+from insta_scrap.cache import log_cache_stats
+from insta_scrap.checkpoint import open_checkpoint
+from insta_scrap.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    check as check_deadline,
+    current as current_deadline,
+    wait_result,
+    within,
+)
+from insta_scrap.dedup import SeenSet
+from insta_scrap import metrics
+from insta_scrap.pipeline import Pipeline, Stage
+from insta_scrap.prefilter import Prefilter
+from insta_scrap.progress import Progress, Reporter
+from insta_scrap.quota import Quota
+from insta_scrap.scheduler import Seed, SeedScheduler
+from insta_scrap.seeds import open_seeds
+from insta_scrap.sink import close_sink, open_sink
+# the fetchers stay importable from insta_scrap.app
+from insta_scrap.sources import (
+    get_com_usernames,
+    get_followers,
+    get_posts,
+    open_source,
+)
+from insta_scrap.images import DEFAULT_AVATAR, log_image_stats, open_image_store
+from insta_scrap.user_info import get_image_bytes, get_user_data
 from insta_scrap.log_client import logger
 
-
-@retry(attempts=5, expected_exception=exceptions)
-def get_com_usernames(post_id, token):
-    # Get the usernames of the comments, use token in available
-    try:
-        usernames_list = []
-        url = f"https://{config.RAPID_API_HOST}/v1/comments"
-        querystring = {"code_or_id_or_url": post_id, "sort_by": "popular"}
-        if token:
-            querystring["pagination_token"] = token
-        headers = {
-            "x-rapidapi-key": config.RAPID_API_KEY,
-            "x-rapidapi-host": f"{config.RAPID_API_HOST}",
-        }
-
-        # Analyse and parse the comments to get the usernames
-        response = requests.get(url, headers=headers, params=querystring)
-        response.raise_for_status()
-        json_data = response.json()
-        data = json_data.get("data", {})
-        new_token = json_data.get("pagination_token", None)
-        # count = data.get("count", 0) if data else 0
-        # total = data.get("total", 0) if data else 0
-        comments = data.get("items", []) if data else []
-        for c in comments:
-            user = c.get("user", {}) if c else {}
-            username = user.get("username", None) if user else None
-            if username:
-                usernames_list.append(username)
-        return usernames_list, new_token
-    except Exception as e:
-        logger.info(f"Error while getting comments: {e}")
-        return None, None
+if TYPE_CHECKING:
+    import pandas as pd
 
 
-@retry(attempts=5, expected_exception=exceptions)
-def get_posts(username, token, min_comments=10):
-    # get the post ids and use token in available
-    try:
-        # Initialise the parameters needed to send the requests
-        id_list = []
-        url = f"https://{config.RAPID_API_HOST}/v1/posts"
-        querystring = {"username_or_id_or_url": username}
-        if token:
-            querystring["pagination_token"] = token
-        headers = {
-            "x-rapidapi-key": config.RAPID_API_KEY,
-            "x-rapidapi-host": f"{config.RAPID_API_HOST}",
-        }
-
-        # Analyse and parse the response
-        response = requests.get(url, headers=headers, params=querystring)
-        response.raise_for_status()
-        json_data = response.json()
-        data = json_data.get("data", {})
-        new_token = json_data.get("pagination_token", None)
-        user = data.get("user", {}) if data else {}
-        is_private = user.get("is_private", False) if user else False
-        if is_private:
+def analyse_profile(
+    username: str,
+    token: str,
+    prefilter: Prefilter | None = None,
+    progress: Progress | None = None,
+) -> tuple[dict, str | None] | None:
+    # the analysis steps of one follower in a single call, as run by the
+    # stages of ScrapeJob: (user_infos, last post date) if accepted, None
+    # otherwise with the rejection reason counted in progress
+    progress = progress or Progress()
+    if prefilter:
+        reason = prefilter.check_username(username)
+        if reason:
+            progress.reject(reason)
             return None
-        posts = data.get("items", []) if data else []
-        for p in posts:
-            comment_count = p.get("comment_count", 0) if p else 0
-            post_id = p.get("id", None) if p else None
-            if comment_count > min_comments and post_id:
-                id_list.append(post_id)
-
-        return id_list, new_token
-    except Exception as e:
-        logger.info(f"Error while getting posts: {e}")
-        return None, None
-
-
-@retry(attempts=5, expected_exception=exceptions)
-def get_followers(username: str, token):
-    # get the followers username and use token if available
+    progress.add("api_calls")
+    user = get_user_data(username)
+    if not user:
+        progress.reject("profile")
+        return None
+    user_info = user["user_infos"]
+    if prefilter:
+        reason = prefilter.check_profile(user_info)
+        if reason:
+            progress.reject(reason)
+            return None
+    progress.add("api_calls")
+    img_bytes = get_image_bytes(user["image_url"])
+    if not img_bytes:
+        # default avatar, or a failed download
+        if img_bytes == DEFAULT_AVATAR:
+            logger.info("Default avatar, skipping the LLM")
+            progress.reject("default_avatar")
+        return None
+    logger.info("Starting Gender service")
+    progress.add("llm_calls")
+    gender = generate_gender(
+        img_bytes, user_info["full_name"], user_info["bio"], user_info["country"]
+    )
+    logger.info(f"Gender - {gender}")
+    if gender is None:
+        # the retries gave up, maybe on the deadline, not a verdict
+        check_deadline("gemini")
+    if not gender:
+        progress.reject("classifier")
+        return None
+    progress.add("api_calls")
     try:
-        # Initialise the parameters needed to send the requests
-        id_list = []
-        url = f"https://{config.RAPID_API_HOST}/v1/followers"
-        querystring = {"username_or_id_or_url": username}
-
-        if token:
-            querystring["pagination_token"] = token
-        headers = {
-            "x-rapidapi-key": config.RAPID_API_KEY,
-            "x-rapidapi-host": f"{config.RAPID_API_HOST}",
-        }
-
-        # Analyse and parse the response
-        response = requests.get(url, headers=headers, params=querystring)
-        response.raise_for_status()
-        json_data = response.json()
-        data = json_data.get("data", {})
-        new_token = json_data.get("pagination_token", None)
-        followers = data.get("items", []) if data else []
-        for follower in followers:
-            if not follower.get("is_private"):
-                id_list.append(follower["username"])
-
-        return id_list, new_token
+        last_post_date = get_username_last_post_date(user_info["username"])
     except Exception as e:
-        logger.info(f"Error while getting posts: {e}")
-        return None, None
+        # only metadata, keep the accepted user
+        logger.info(f"Error while getting last post date: {e}")
+        last_post_date = None
+    logger.info(f"Last post date: {last_post_date}")
+    return user_info, last_post_date
 
 
 def analyse_username(username: str, file_name: str, token: str) -> int:
-    # start the user analysis (step 2)
+    # start the user analysis (step 2), every request within the deadline of
+    # the profile (see insta_scrap.deadline)
     gender_output = 0
     try:
         logger.info("Starting ------------------------------------ Analysis")
-        user_info = get_user_infos(username)
-        if user_info:
-            gender_output = start_gender_service(
-                user_info["user_infos"],
-                user_info["image_bytes"],
-                file_name=file_name,
-                token=token,
-            )
+        with within(Deadline()):
+            accepted = analyse_profile(username, token)
+        if accepted:
+            user_info, last_post_date = accepted
+            save_user(file_name, user_info, token, last_post_date)
+            gender_output = 1
         logger.info(f"Gender - {gender_output}")
         logger.info("Ending ------------------------------------ Analysis")
         return gender_output
@@ -138,69 +126,381 @@ def analyse_username(username: str, file_name: str, token: str) -> int:
         return 0
 
 
-def anaylse_usernames(
-    usernames: list[str], file_name: str, token_next_for_follower: str | None
-):
-    results = []
-    file_names = [file_name for username in usernames]
-    tokens = [token_next_for_follower for username in usernames]
-    with ThreadPoolExecutor(max_workers=10) as worker:
-        results = worker.map(analyse_username, usernames, file_names, tokens)
+class ScrapeJob:
+    # Threaded engine: follower pages -> user info -> image -> LLM -> sink,
+    # every stage connected by a bounded queue (see insta_scrap.pipeline)
+    def __init__(
+        self,
+        file_name: str,
+        total_results: int,
+        token: str,
+        job_id: str,
+        progress: Progress | None = None,
+    ):
+        self.file_name = file_name
+        self.total_results = total_results
+        self.token = token
+        self.checkpoint = open_checkpoint(job_id)
+        self.quota = Quota(total_results, self.checkpoint.accepted)
+        self.seen = SeenSet()
+        self.seen.preload(self.checkpoint.processed)
+        self.prefilter = Prefilter()
+        self.progress = progress or Progress(total_results)
+        self.progress.set("accepted", self.quota.count)
+        self.scheduler = None
+        # followers or commenters of the seeds, see insta_scrap.sources
+        self.source = open_source(progress=self.progress)
+        self.posts_executor = ThreadPoolExecutor(max_workers=config.LLM_WORKERS)
+        # batched Gemini requests, classify workers mostly wait on a batch
+        self.classifier = None
+        llm_workers = config.LLM_WORKERS
+        if config.GEMINI_BATCH_SIZE > 1:
+            self.classifier = BatchClassifier()
+            llm_workers *= config.GEMINI_BATCH_SIZE
+        self.pipeline = Pipeline(
+            [
+                Stage(
+                    "followers",
+                    self.fetch_followers,
+                    config.FOLLOWER_WORKERS,
+                    config.PIPELINE_QUEUE_SIZE,
+                ),
+                Stage(
+                    "user_info",
+                    self.budgeted(self.fetch_user_info),
+                    config.INFO_WORKERS,
+                    config.PIPELINE_QUEUE_SIZE,
+                ),
+                Stage(
+                    "image",
+                    self.budgeted(self.fetch_image),
+                    config.IMAGE_WORKERS,
+                    config.PIPELINE_QUEUE_SIZE,
+                ),
+                Stage(
+                    "classify",
+                    self.budgeted(self.classify),
+                    llm_workers,
+                    config.PIPELINE_QUEUE_SIZE,
+                ),
+                Stage("sink", self.save, 1, config.PIPELINE_QUEUE_SIZE),
+            ]
+        )
 
-    return sum(results)
+    def done(self) -> bool:
+        return self.quota.reached()
 
+    def count_call(self, kind: str):
+        self.progress.add(f"{kind}_calls")
 
-def process_input_dataframe(
-    df_source: pd.DataFrame | None,
+    def budgeted(self, func):
+        # run a stage of a profile within its deadline, started at user info
+        # and carried by the user dict. A profile out of budget is abandoned,
+        # not marked processed, so a resumed job tries it again
+        def run(item, emit):
+            deadline = item["deadline"] if isinstance(item, dict) else Deadline()
+            try:
+                with within(deadline):
+                    deadline.check(func.__name__)
+                    func(item, emit)
+            except DeadlineExceeded as e:
+                self.progress.reject("deadline")
+                logger.info(f"Profile abandoned: {e}")
+
+        return run
+
+    def fetch_followers(self, seed: Seed, emit):
+        # one page of usernames of a seed (followers or commenters), the
+        # scheduler hands out the pages of the concurrent seeds in turn (see
+        # insta_scrap.scheduler)
+        if self.done():
+            # quota met, stop handing out seeds instead of spinning on them
+            self.scheduler.release(seed)
+            self.scheduler.close()
+            self.pipeline.cancel()
+            return
+        page_token = seed.token
+        fetched = None
+        try:
+            follower_list, token_next_for_follower = self.source.fetch(
+                seed.username, page_token
+            )
+            if follower_list is None:
+                # failed page, keep the cursor so a resumed run retries it
+                return
+            self.progress.add("followers_seen", len(follower_list))
+            # skip followers already met under another seed or page
+            new_followers = [f for f in follower_list if self.seen.add(f)]
+            page = self.checkpoint.start_page(
+                seed.index,
+                seed.username,
+                page_token,
+                token_next_for_follower,
+                len(new_followers),
+            )
+            fetched = (len(new_followers), token_next_for_follower)
+        finally:
+            if fetched is None:
+                self.scheduler.page_fetched(seed, None, None)
+            else:
+                self.scheduler.page_fetched(seed, *fetched)
+        for follower in new_followers:
+            if not emit((follower, token_next_for_follower, page)):
+                return
+
+    def fetch_user_info(self, item: tuple, emit):
+        username, token, page = item
+        self.scheduler.dequeued(page.seed_index)
+        # the seed may have reached its own quota meanwhile
+        if self.done() or self.scheduler.seed_full(page.seed_index):
+            return
+        logger.info("Starting ------------------------------------ Analysis")
+        # local rules first, a rejected account costs no API call
+        reason = self.prefilter.check_username(username)
+        if reason:
+            self.progress.reject(reason)
+            self.checkpoint.mark_processed(username, page)
+            return
+        self.count_call("api")
+        user = get_user_data(username)
+        if not user:
+            self.progress.reject("profile")
+            self.checkpoint.mark_processed(username, page)
+            return
+        reason = self.prefilter.check_profile(user["user_infos"])
+        if reason:
+            self.progress.reject(reason)
+            self.checkpoint.mark_processed(username, page)
+            return
+        user["follower"] = username
+        user["token"] = token
+        user["page"] = page
+        user["deadline"] = current_deadline()
+        emit(user)
+
+    def fetch_image(self, user: dict, emit):
+        if self.done():
+            return
+        self.count_call("api")
+        user["image_bytes"] = get_image_bytes(user.pop("image_url"))
+        if not user["image_bytes"]:
+            # default avatar, or a failed download retried on resume
+            if user["image_bytes"] == DEFAULT_AVATAR:
+                logger.info("Default avatar, skipping the LLM")
+                self.progress.reject("default_avatar")
+                self.checkpoint.mark_processed(user["follower"], user["page"])
+            return
+        emit(user)
+
+    def classify(self, user: dict, emit):
+        if self.done() or self.scheduler.seed_full(user["page"].seed_index):
+            return
+        user_info = user["user_infos"]
+        logger.info("Starting Gender service")
+        posts = None
+        if config.POSTS_PREFETCH:
+            # last post date fetched while the LLM call runs
+            self.count_call("api")
+            # in the context of the profile, for its deadline
+            posts = self.posts_executor.submit(
+                contextvars.copy_context().run,
+                get_username_last_post_date,
+                user_info["username"],
+            )
+        self.count_call("llm")
+        profile = (
+            user.pop("image_bytes"),
+            user_info["full_name"],
+            user_info["bio"],
+            user_info["country"],
+        )
+        if self.classifier:
+            gender = wait_result(
+                self.classifier.submit(user["follower"], *profile), "gemini"
+            )
+        else:
+            gender = generate_gender(*profile)
+            if gender is None:
+                # the retries gave up, maybe on the deadline, not a verdict
+                check_deadline("gemini")
+        logger.info(f"Gender - {gender}")
+        if not gender or self.done():
+            if posts:
+                posts.cancel()
+            if not gender:
+                self.progress.reject("classifier")
+                self.checkpoint.mark_processed(user["follower"], user["page"])
+            return
+        user["last_post_date"] = self.last_post_date(user_info, posts)
+        logger.info(f"Last post date: {user['last_post_date']}")
+        emit(user)
+
+    def last_post_date(self, user_info: dict, posts) -> str | None:
+        try:
+            if posts is None:
+                self.count_call("api")
+                return get_username_last_post_date(user_info["username"])
+            return wait_result(posts, "/v1/posts")
+        except Exception as e:
+            # only metadata, keep the accepted user
+            logger.info(f"Error while getting last post date: {e}")
+            return None
+
+    def save(self, user: dict, emit):
+        if not self.quota.acquire():
+            return
+        if not self.scheduler.accept(user["page"].seed_index):
+            # the seed met its own quota while this user was classified
+            self.quota.release()
+            return
+        try:
+            save_user(
+                self.file_name,
+                user["user_infos"],
+                user["token"],
+                user["last_post_date"],
+                on_written=partial(
+                    self.checkpoint.mark_accepted, user["follower"], user["page"]
+                ),
+            )
+        except Exception:
+            # the sink failed, rows already counted were lost: stop the job
+            self.quota.release()
+            self.scheduler.close()
+            self.pipeline.cancel()
+            raise
+        self.progress.set("accepted", self.quota.count)
+        logger.info(
+            f"** Ok - Username added | Total: {self.quota.count}/{self.total_results}"
+        )
+        if self.done():
+            # quota met, drop the queued work instead of paying for it
+            self.scheduler.close()
+            self.pipeline.cancel()
+
+    def run(self, usernames):
+        self.scheduler = SeedScheduler(
+            usernames, self.checkpoint, self.token, self.progress
+        )
+        try:
+            if self.done():
+                # rerun or resume of a finished job
+                logger.info(
+                    f"Quota already met by the checkpoint of job "
+                    f"{self.checkpoint.job_id} "
+                    f"({self.quota.count}/{self.total_results}), nothing to do"
+                )
+            else:
+                # blocks until a seed is due for its next page
+                self.pipeline.run(self.scheduler)
+        finally:
+            self.scheduler.report()
+            if self.classifier:
+                self.classifier.close()
+            self.posts_executor.shutdown(cancel_futures=True)
+            self.source.close()
+            try:
+                # the rows still in the sink commit their checkpoint entries first
+                close_sink(self.file_name)
+            finally:
+                self.checkpoint.close()
+        self.seen.report(
+            self.progress.counts["api_calls"], self.progress.counts["llm_calls"]
+        )
+        self.prefilter.report()
+        self.source.report(self.quota.count, self.progress.counts["api_calls"])
+        return self.quota.count
+
+
+def new_job_id(file_name: str) -> str:
+    # unique per run, readable in the checkpoint and broker files
+    return f"{os.path.basename(file_name)}-{uuid.uuid4().hex[:8]}"
+
+
+def process_input(
+    source,
     file_name: str,
     total_results: int,
     token: str,
+    engine: str | None = None,
+    job_id: str | None = None,
+    channel=None,
 ):
-    # Initialise the variable to use
-    already_got = 0
-    if df_source is None:
-        return None
-    # file_name = f"{str(int(datetime.now().timestamp()))}.csv"
-    if df_source.empty:
+    # source is anything insta_scrap.seeds reads lazily (CSV path, "-",
+    # file object, DataFrame, iterable of usernames).
+    # job_id names the checkpoint: pass the id of an earlier run to resume
+    # it, a new job gets a fresh id so the same output name starts over.
+    # channel receives progress snapshots (see insta_scrap.progress)
+    if job_id is None:
+        job_id = new_job_id(file_name)
+        logger.info(f"New job {job_id}")
+    else:
+        logger.info(f"Job {job_id}, resumed from its checkpoint if any")
+    seeds = open_seeds(source)
+    if seeds is None:
         return None
+    engine = engine or config.SCRAPER_ENGINE
+    # per-job summary written to <file_name>.metrics.json
+    job_metrics = metrics.JobMetrics(file_name)
+    progress = Progress(total_results)
+    reporter = Reporter(progress, channel).start() if channel is not None else None
+    try:
+        return run_engine(
+            engine, seeds, file_name, total_results, token, job_id, progress
+        )
+    finally:
+        if reporter:
+            reporter.stop()
+        job_metrics.close(engine=engine, job_id=job_id)
 
-    # starting the iteration of the input usernames
-    for index, row in df_source.iterrows():
-        if already_got >= total_results:
-            break
-        username = row["username_or_url"]
-        logger.info(
-            f"*** Processing Username n* {index} : {username} | total_results_to_get: {total_results} | already_got: {already_got}"
+
+def run_engine(engine, seeds, file_name, total_results, token, job_id, progress):
+    open_image_store()
+    if engine == "queue":
+        from insta_scrap.worker import process_input_queue
+
+        return process_input_queue(
+            seeds, file_name, total_results, token, job_id, progress=progress
         )
-        try:
-            next_for_follower = True
-            token_next_for_follower = token
-            while next_for_follower:
-                follower_list, token_next_for_follower = get_followers(
-                    username, token_next_for_follower
-                )
-                if not follower_list:
-                    break
-                added = anaylse_usernames(
-                    follower_list, file_name, token_next_for_follower
-                )
-                logger.info(f"Total added: {added}")
-                already_got += added
-                logger.info(
-                    f"** Ok - Username added | Total: {already_got}/{total_results}"
-                )
-                if already_got >= total_results:
-                    next_for_follower = False
-                    break
+    if engine == "async":
+        from insta_scrap.async_engine import process_input_async
 
-        except Exception as e:
-            logger.info(f"Error processing username {username}: {e}")
+        return asyncio.run(
+            process_input_async(
+                seeds, file_name, total_results, token, job_id, progress=progress
+            )
+        )
+    # file_name = f"{str(int(datetime.now().timestamp()))}.csv"
+
+    # a misconfigured sink target fails the job before any API call
+    open_sink(file_name)
+    job = ScrapeJob(file_name, total_results, token, job_id, progress)
+    try:
+        job.run(seeds)
+    finally:
+        close_sink(file_name)
 
+    log_cache_stats()
+    log_image_stats()
     logger.info("DONE!")
     return file_name
 
 
+def process_input_dataframe(
+    df_source: "pd.DataFrame | None",
+    file_name: str,
+    total_results: int,
+    token: str,
+    engine: str | None = None,
+    job_id: str | None = None,
+):
+    # pandas adapter kept for existing callers
+    return process_input(df_source, file_name, total_results, token, engine, job_id)
+
+
 if __name__ == "__main__":
+    import pandas as pd
+
     # analyse_username("weetravelmonkeys", "weetravelmonkeys.csv")
     df = pd.read_csv("/home/khaliq/Downloads/output.csv")
     logger.info(
@@ -0,0 +1,544 @@
+import asyncio
+from functools import partial
+
+import httpx
+from the_retry import retry
+
+from config import config
+from insta_scrap import hedging, metrics
+from insta_scrap.batch_classifier import BatchClassifier
+from insta_scrap.cache import cached, content_key, log_cache_stats
+from insta_scrap.checkpoint import open_checkpoint
+from insta_scrap.dedup import SeenSet
+from insta_scrap.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    aretry_guard,
+    check_backoff,
+    stage_timeout,
+    within,
+)
+from insta_scrap.decoding import decode_followers, loads
+from insta_scrap.get_gender import (
+    GENDER_MODEL,
+    gender_config,
+    gender_content,
+    get_client,
+    parse_last_post_date,
+    save_user,
+)
+from insta_scrap.http_client import rapidapi_headers, rapidapi_url
+from insta_scrap.images import (
+    DEFAULT_AVATAR,
+    ImageDownloadError,
+    check_download,
+    download_deadline,
+    is_default_avatar_url,
+    log_image_stats,
+    process_image,
+)
+from insta_scrap.log_client import logger
+from insta_scrap.prefilter import Prefilter
+from insta_scrap.progress import Progress
+from insta_scrap.quota import Quota
+from insta_scrap.scheduler import POLL_INTERVAL, Seed, SeedScheduler
+from insta_scrap.rate_limit import get_limiter, is_throttled
+from insta_scrap.sink import close_sink, open_sink
+from insta_scrap.sources import open_source
+from insta_scrap.user_info import user_info_querystring, validate_user_data
+
+# asyncio engine: one event loop keeps hundreds of profiles in flight, a
+# global semaphore caps the requests actually on the wire and a bounded queue
+# keeps follower pagination from running ahead of the analysis.
+
+async_exceptions = (
+    httpx.TimeoutException,
+    httpx.ConnectError,
+    httpx.RemoteProtocolError,
+)
+
+_STOP = object()
+
+
+def build_async_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=config.HTTP_POOL_SIZE,
+        max_keepalive_connections=config.HTTP_POOL_SIZE,
+    )
+    timeout = httpx.Timeout(
+        config.HTTP_READ_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+class AsyncScraper:
+    def __init__(
+        self,
+        http: httpx.AsyncClient,
+        file_name: str,
+        total_results: int,
+        job_id: str,
+        max_requests: int = config.ASYNC_MAX_REQUESTS,
+        progress: Progress | None = None,
+    ):
+        self.http = http
+        self.file_name = file_name
+        self.total_results = total_results
+        self.checkpoint = open_checkpoint(job_id)
+        self.quota = Quota(total_results, self.checkpoint.accepted)
+        self.seen = SeenSet()
+        self.seen.preload(self.checkpoint.processed)
+        self.prefilter = Prefilter()
+        self.progress = progress or Progress(total_results)
+        self.progress.set("accepted", self.quota.count)
+        self.classifier = (
+            BatchClassifier() if config.GEMINI_BATCH_SIZE > 1 else None
+        )
+        self.limit = asyncio.Semaphore(max_requests)
+        self.scheduler = None
+        self.source = open_source(progress=self.progress)
+        self.tasks = []
+        self.error = None
+
+    def done(self) -> bool:
+        return self.quota.reached()
+
+    def cancel(self):
+        # quota met or sink failed: cancel the producer and the other profiles
+        self.scheduler.close()
+        current = asyncio.current_task()
+        for task in self.tasks:
+            if task is not current:
+                task.cancel()
+
+    async def rapidapi_get(self, path: str, params: dict) -> dict:
+        # stage timeout bounded by the profile deadline, hedged if enabled,
+        # like the sync client
+        timeout = httpx.Timeout(
+            stage_timeout(path), connect=config.HTTP_CONNECT_TIMEOUT
+        )
+        if hedging.enabled(path):
+            return await hedging.hedged_acall(
+                path, lambda: self._rapidapi_get(path, params, timeout)
+            )
+        return await self._rapidapi_get(path, params, timeout)
+
+    async def _rapidapi_get(self, path: str, params: dict, timeout) -> dict:
+        # same endpoint limiters and 429/5xx retries as the sync client
+        limiter = get_limiter(path)
+        for attempt in range(config.RATE_LIMIT_RETRIES + 1):
+            await limiter.acquire_async()
+            try:
+                async with self.limit:
+                    response = await self.http.get(
+                        rapidapi_url(path),
+                        params=params,
+                        headers=rapidapi_headers(),
+                        timeout=timeout,
+                    )
+            except BaseException:
+                limiter.release()
+                raise
+            limiter.release(response.status_code, response.headers)
+            metrics.inc(
+                "http_requests_total", endpoint=path, status=response.status_code
+            )
+            metrics.inc("http_bytes_total", len(response.content), endpoint=path)
+            if not is_throttled(response.status_code):
+                break
+            metrics.inc("http_retries_total", endpoint=path)
+            logger.info(
+                f"{path} answered {response.status_code}, attempt {attempt + 1}"
+            )
+            if attempt == config.RATE_LIMIT_RETRIES:
+                break
+            # no retry past the profile deadline, nor a pause running into it
+            backoff = (
+                0
+                if response.status_code == 429
+                else config.RATE_LIMIT_BACKOFF * 2**attempt
+            )
+            check_backoff(path, backoff)
+            await asyncio.sleep(backoff)
+        response.raise_for_status()
+        return loads(response.content)
+
+    @retry(attempts=5, expected_exception=async_exceptions)
+    @metrics.timed("followers")
+    async def get_followers(self, username: str, token):
+        # get the followers username and use token if available
+        try:
+            querystring = {"username_or_id_or_url": username}
+            if token:
+                querystring["pagination_token"] = token
+            followers, new_token = decode_followers(
+                await self.rapidapi_get("/v1/followers", querystring)
+            )
+            id_list = [
+                follower.username for follower in followers if not follower.is_private
+            ]
+            return id_list, new_token
+        except async_exceptions:
+            raise
+        except Exception as e:
+            metrics.inc("stage_errors_total", stage="followers")
+            logger.info(f"Error while getting followers: {e}")
+            return None, None
+
+    @cached("user_info", key=lambda self, username: username)
+    @retry(attempts=2, expected_exception=async_exceptions)
+    @metrics.timed("user_info")
+    async def get_user_infos(self, username: str):
+        logger.info(f"Getting user - {username} info")
+        json_data = await self.rapidapi_get(
+            "/v1/info", user_info_querystring(username)
+        )
+        return validate_user_data(username, json_data.get("data", None))
+
+    @cached("image", key=lambda self, image_url: image_url, cache_none=False)
+    @metrics.timed("image")
+    async def get_image_bytes(self, image_url) -> bytes | None:
+        # streamed with the same caps as the threaded get_image_bytes
+        logger.info("Getting Image bytes")
+        if not image_url:
+            return None
+        if is_default_avatar_url(image_url):
+            return DEFAULT_AVATAR
+        try:
+            deadline = download_deadline()
+            image_bytes = bytearray()
+            async with self.limit:
+                async with self.http.stream(
+                    "GET",
+                    image_url,
+                    timeout=httpx.Timeout(
+                        stage_timeout("image"), connect=config.HTTP_CONNECT_TIMEOUT
+                    ),
+                ) as response:
+                    response.raise_for_status()
+                    check_download(
+                        int(response.headers.get("Content-Length") or 0), deadline
+                    )
+                    async for chunk in response.aiter_bytes(config.IMAGE_CHUNK_SIZE):
+                        image_bytes += chunk
+                        check_download(len(image_bytes), deadline)
+        except (httpx.HTTPError, ImageDownloadError) as e:
+            metrics.inc("stage_errors_total", stage="image")
+            logger.info(f"Erreur lors du téléchargement de l'image : {e}")
+            return None
+        # decoding and resizing off the event loop
+        return await asyncio.to_thread(process_image, bytes(image_bytes), image_url)
+
+    # Exception, not the default BaseException, so a cancelled task is
+    # not retried, nor a call past the profile deadline (see retry_guard)
+    @cached("gender", key=lambda self, *args: content_key(*args), cache_none=False)
+    @retry(
+        attempts=2,
+        backoff=5,
+        expected_exception=Exception,
+        on_exception=aretry_guard("gemini", 5),
+    )
+    @metrics.timed("gender")
+    async def generate_gender(
+        self, img_bytes: bytes, full_name: str, bio: str, country: str
+    ):
+        logger.info("Using LLM to generate gender")
+        async with self.limit:
+            response = await get_client().aio.models.generate_content(
+                model=GENDER_MODEL,
+                contents=gender_content(img_bytes, full_name, bio, country),
+                config=gender_config(),
+            )
+        metrics.record_llm_usage(response)
+        if response.parsed:
+            return response.parsed.is_male
+
+    @cached("last_post", key=lambda self, username: username)
+    @retry(attempts=5, backoff=5, expected_exception=async_exceptions)
+    @metrics.timed("posts")
+    async def get_username_last_post_date(self, username: str):
+        logger.info("Getting the date of user last post date")
+        json_data = await self.rapidapi_get(
+            "/v1/posts", {"username_or_id_or_url": username}
+        )
+        return parse_last_post_date(json_data)
+
+    async def last_post_date(self, user_info: dict, posts) -> str | None:
+        try:
+            if posts is None:
+                self.progress.add("api_calls")
+                return await self.get_username_last_post_date(user_info["username"])
+            return await posts
+        except Exception as e:
+            # only metadata, keep the accepted user
+            logger.info(f"Error while getting last post date: {e}")
+            return None
+
+    async def analyse_username(self, username: str, token: str, page) -> int:
+        # analyse_profile within the deadline of the profile, its requests
+        # get the time left and a profile out of budget is abandoned
+        deadline = Deadline()
+        try:
+            with within(deadline):
+                return await asyncio.wait_for(
+                    self.analyse_profile(username, token, page), deadline.remaining()
+                )
+        except (DeadlineExceeded, TimeoutError) as e:
+            if not isinstance(e, DeadlineExceeded):
+                metrics.inc("deadline_exceeded_total", stage="profile")
+            self.progress.reject("deadline")
+            logger.info(f"Abandoned {username} after its deadline")
+            return 0
+
+    async def analyse_profile(self, username: str, token: str, page) -> int:
+        # same steps as the threaded analyse_username, without blocking
+        try:
+            logger.info("Starting ------------------------------------ Analysis")
+            # the seed may have reached its own quota meanwhile
+            if self.scheduler.seed_full(page.seed_index):
+                return 0
+            # local rules first, a rejected account costs no API call
+            reason = self.prefilter.check_username(username)
+            if reason:
+                self.progress.reject(reason)
+                self.checkpoint.mark_processed(username, page)
+                return 0
+            self.progress.add("api_calls")
+            user = await self.get_user_infos(username)
+            if not user:
+                self.progress.reject("profile")
+                self.checkpoint.mark_processed(username, page)
+                return 0
+            reason = self.prefilter.check_profile(user["user_infos"])
+            if reason:
+                self.progress.reject(reason)
+                self.checkpoint.mark_processed(username, page)
+                return 0
+            if self.done():
+                return 0
+            user_info = user["user_infos"]
+            self.progress.add("api_calls")
+            img_bytes = await self.get_image_bytes(user["image_url"])
+            if not img_bytes:
+                # default avatar, or a failed download retried on resume
+                if img_bytes == DEFAULT_AVATAR:
+                    logger.info("Default avatar, skipping the LLM")
+                    self.progress.reject("default_avatar")
+                    self.checkpoint.mark_processed(username, page)
+                return 0
+            if self.done() or self.scheduler.seed_full(page.seed_index):
+                return 0
+            posts = None
+            if config.POSTS_PREFETCH:
+                # last post date fetched while the LLM call runs
+                self.progress.add("api_calls")
+                posts = asyncio.create_task(
+                    self.get_username_last_post_date(user_info["username"])
+                )
+            self.progress.add("llm_calls")
+            profile = (
+                img_bytes,
+                user_info["full_name"],
+                user_info["bio"],
+                user_info["country"],
+            )
+            try:
+                if self.classifier:
+                    gender = await asyncio.wrap_future(
+                        self.classifier.submit(username, *profile)
+                    )
+                else:
+                    gender = await self.generate_gender(*profile)
+            except BaseException:
+                if posts:
+                    posts.cancel()
+                raise
+            logger.info(f"Gender - {gender}")
+            if not gender or self.done():
+                if posts:
+                    posts.cancel()
+                if not gender:
+                    self.progress.reject("classifier")
+                    self.checkpoint.mark_processed(username, page)
+                return 0
+            last_post_date = await self.last_post_date(user_info, posts)
+            logger.info(f"Last post date: {last_post_date}")
+            # no await between acquire and the write, cancellation is safe
+            if not self.quota.acquire():
+                return 0
+            if not self.scheduler.accept(page.seed_index):
+                # the seed met its own quota while this user was classified
+                self.quota.release()
+                return 0
+            try:
+                save_user(
+                    self.file_name,
+                    user_info,
+                    token,
+                    last_post_date,
+                    on_written=partial(self.checkpoint.mark_accepted, username, page),
+                )
+            except Exception as e:
+                # the sink failed, rows already counted were lost: stop the job
+                self.quota.release()
+                self.error = e
+                self.cancel()
+                raise
+            self.progress.set("accepted", self.quota.count)
+            logger.info(
+                f"** Ok - Username added | Total: {self.quota.count}/{self.total_results}"
+            )
+            if self.done():
+                self.cancel()
+            return 1
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.info(f"Error analysing {username}: {e}")
+            return 0
+
+    async def fetch_usernames(self, username: str, cursor):
+        # same contract as the sources of insta_scrap.sources: followers use
+        # the async client, commenters run the sync source in a thread
+        if self.source.name != "followers":
+            return await asyncio.to_thread(self.source.fetch, username, cursor)
+        usernames, next_token = await self.get_followers(username, cursor)
+        self.source.count(api_calls=1)
+        if usernames is None:
+            return None, None
+        self.source.count(pages=1, usernames=len(usernames))
+        # an empty page ends the seed like a missing token
+        return usernames, next_token if usernames else None
+
+    async def fetch_page(self, seed: Seed, queue: asyncio.Queue):
+        # one follower page of a seed, its followers go to the bounded queue
+        page_token = seed.token
+        fetched = None
+        try:
+            (
+                follower_list,
+                token_next_for_follower,
+            ) = await self.fetch_usernames(seed.username, page_token)
+            if follower_list is None:
+                # failed page, a resumed run retries from its cursor
+                return
+            self.progress.add("followers_seen", len(follower_list))
+            # skip followers already met under another seed
+            new_followers = [f for f in follower_list if self.seen.add(f)]
+            page = self.checkpoint.start_page(
+                seed.index,
+                seed.username,
+                page_token,
+                token_next_for_follower,
+                len(new_followers),
+            )
+            fetched = (len(new_followers), token_next_for_follower)
+        except Exception as e:
+            logger.info(f"Error processing username {seed.username}: {e}")
+            return
+        finally:
+            if fetched is None:
+                self.scheduler.page_fetched(seed, None, None)
+            else:
+                self.scheduler.page_fetched(seed, *fetched)
+        for follower in new_followers:
+            await queue.put((follower, token_next_for_follower, page))
+
+    async def fetch_pages(self, queue: asyncio.Queue):
+        # one fetcher per concurrent seed, the scheduler picks the seed of
+        # every page (see insta_scrap.scheduler)
+        while not self.done():
+            seed = self.scheduler.next_seed()
+            if seed is not None:
+                await self.fetch_page(seed, queue)
+            elif self.scheduler.finished():
+                return
+            else:
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def produce(self, usernames, token: str, queue: asyncio.Queue):
+        # the bounded queue applies backpressure so pages are only fetched
+        # when workers need them
+        self.scheduler = SeedScheduler(
+            usernames, self.checkpoint, token, self.progress
+        )
+        await asyncio.gather(
+            *(self.fetch_pages(queue) for _ in range(self.scheduler.concurrency))
+        )
+        # one sentinel, passed on by every consumer: the producer never waits
+        # on room for one sentinel per worker
+        await queue.put(_STOP)
+
+    async def consume(self, queue: asyncio.Queue):
+        while not self.done() and self.error is None:
+            item = await queue.get()
+            if item is _STOP:
+                # room for it, this consumer just took it
+                queue.put_nowait(_STOP)
+                return
+            self.scheduler.dequeued(item[2].seed_index)
+            await self.analyse_username(*item)
+
+    async def run(self, usernames, token: str, workers: int):
+        queue = asyncio.Queue(maxsize=config.ASYNC_QUEUE_SIZE)
+        metrics.gauge("queue_depth", lambda: [({"stage": "async"}, queue.qsize())])
+        try:
+            if self.done():
+                # rerun or resume of a finished job, no consumer would read
+                # the queue
+                logger.info(
+                    f"Quota already met by the checkpoint of job "
+                    f"{self.checkpoint.job_id} "
+                    f"({self.quota.count}/{self.total_results}), nothing to do"
+                )
+            else:
+                self.tasks = [
+                    asyncio.create_task(self.consume(queue)) for _ in range(workers)
+                ]
+                self.tasks.append(
+                    asyncio.create_task(self.produce(usernames, token, queue))
+                )
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+        finally:
+            metrics.remove_gauge("queue_depth")
+            if self.classifier:
+                self.classifier.close()
+            self.source.close()
+            try:
+                # the rows still in the sink commit their checkpoint entries first
+                close_sink(self.file_name)
+            finally:
+                self.checkpoint.close()
+        if self.scheduler:
+            self.scheduler.report()
+        self.seen.report(
+            self.progress.counts["api_calls"], self.progress.counts["llm_calls"]
+        )
+        self.prefilter.report()
+        self.source.report(self.quota.count, self.progress.counts["api_calls"])
+
+
+async def process_input_async(
+    usernames,
+    file_name: str,
+    total_results: int,
+    token: str,
+    job_id: str,
+    workers: int = config.ASYNC_WORKERS,
+    progress: Progress | None = None,
+):
+    # usernames is any iterable, read as the seeds are paginated
+    open_sink(file_name)
+    async with build_async_client() as http:
+        scraper = AsyncScraper(
+            http, file_name, total_results, job_id, progress=progress
+        )
+        try:
+            await scraper.run(usernames, token, workers)
+        finally:
+            close_sink(file_name)
+
+    log_cache_stats()
+    log_image_stats()
+    logger.info("DONE!")
+    return file_name
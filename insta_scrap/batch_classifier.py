@@ -0,0 +1,228 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pydantic import BaseModel
+from the_retry import retry
+
+from config import config
+from insta_scrap import get_gender, metrics
+from insta_scrap.cache import content_key, get_cache
+from insta_scrap.deadline import current, retry_guard, within
+from insta_scrap.get_gender import (
+    GENDER_MODEL,
+    gender_config,
+    gender_content,
+    image_part,
+    system_prompt,
+)
+from insta_scrap.log_client import logger
+
+# Batched Gemini classification: profiles submitted by many workers are
+# grouped into one request (up to max_batch, or whatever arrived within
+# max_wait) that returns one verdict per username. Profiles missing from a
+# batch answer, or a batch that fails to parse, fall back to single requests,
+# each on its own executor thread, retried like generate_gender within the
+# deadline of the profile's submitter.
+
+
+class UserIsMale(BaseModel):
+    username: str
+    is_male: bool
+
+
+batch_system_prompt = (
+    system_prompt
+    + """
+You will receive several profiles in one request. Each profile starts with a line 'Profile: <username>' followed by its name, bio and profile image.
+Judge every profile independently and return one entry per profile with its exact username.
+"""
+)
+
+BATCH_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": list[UserIsMale],
+    "system_instruction": batch_system_prompt,
+}
+
+
+class Profile:
+    __slots__ = (
+        "username",
+        "img_bytes",
+        "full_name",
+        "bio",
+        "country",
+        "deadline",
+        "future",
+    )
+
+    def __init__(self, username, img_bytes, full_name, bio, country):
+        self.username = username
+        self.img_bytes = img_bytes
+        self.full_name = full_name
+        self.bio = bio
+        self.country = country
+        # deadline of the submitting profile, the fallback request runs on
+        # another thread
+        self.deadline = current()
+        self.future = Future()
+
+    def cache_key(self) -> str:
+        # same key as generate_gender, so both paths share the cache
+        return content_key(self.img_bytes, self.full_name, self.bio, self.country)
+
+
+def batch_content(profiles: list[Profile]):
+    content = []
+    for profile in profiles:
+        content.append(
+            f"""
+        Profile: {profile.username}
+        Name: {profile.full_name}
+        Bio: {profile.bio}
+        """
+        )
+        content.append(image_part(profile.img_bytes))
+    return content
+
+
+class BatchClassifier:
+    def __init__(
+        self,
+        client=None,
+        max_batch: int = config.GEMINI_BATCH_SIZE,
+        max_wait: float = config.GEMINI_BATCH_WAIT,
+        workers: int = config.LLM_WORKERS,
+    ):
+        # client defaults to the shared Gemini client, tests pass a fake one
+        self.client = client
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.fallbacks = 0
+        self._stats_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._collect, name="gemini-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def _client(self):
+        return self.client or get_gender.get_client()
+
+    def submit(
+        self, username: str, img_bytes: bytes, full_name: str, bio: str, country: str
+    ) -> Future:
+        # Future resolving to True/False, or None when the model gave nothing
+        profile = Profile(username, img_bytes, full_name, bio, country)
+        cache = get_cache()
+        if cache is not None:
+            hit = cache.get("gender", profile.cache_key(), None)
+            if hit is not None:
+                profile.future.set_result(hit)
+                return profile.future
+        self.queue.put(profile)
+        return profile.future
+
+    def classify(self, *args) -> bool | None:
+        return self.submit(*args).result()
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+        self.executor.shutdown(wait=True)
+        logger.info(
+            f"Gemini batches: {self.batches} | single fallbacks: {self.fallbacks}"
+        )
+
+    def _collect(self):
+        # gather profiles until the batch is full or max_wait has passed
+        while not (self._closed.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: list[Profile]):
+        results = {}
+        if len(batch) > 1:
+            try:
+                results = self._classify_batch(batch)
+                with self._stats_lock:
+                    self.batches += 1
+            except Exception as e:
+                logger.info(f"Batch classification failed, falling back: {e}")
+        for profile in batch:
+            is_male = results.get(profile.username.lower())
+            if is_male is not None:
+                self._resolve(profile, is_male)
+                continue
+            if len(batch) > 1:
+                with self._stats_lock:
+                    self.fallbacks += 1
+            try:
+                self.executor.submit(self._fallback, profile)
+            except RuntimeError:
+                # closing, the executor takes no new work
+                self._fallback(profile)
+
+    def _fallback(self, profile: Profile):
+        try:
+            with within(profile.deadline):
+                self._resolve(profile, self._classify_one(profile))
+        except Exception as e:
+            profile.future.set_exception(e)
+
+    def _resolve(self, profile: Profile, is_male: bool | None):
+        if is_male is not None:
+            cache = get_cache()
+            if cache is not None:
+                cache.set("gender", profile.cache_key(), is_male)
+        profile.future.set_result(is_male)
+
+    @metrics.timed("gender_batch")
+    def _classify_batch(self, batch: list[Profile]) -> dict:
+        logger.info(f"Using LLM to generate gender for {len(batch)} profiles")
+        response = self._client().models.generate_content(
+            model=GENDER_MODEL,
+            contents=batch_content(batch),
+            config=BATCH_CONFIG,
+        )
+        metrics.record_llm_usage(response, "batch")
+        # keyed by lowercased username, the model may change the case
+        usernames = {profile.username.lower() for profile in batch}
+        return {
+            item.username.lower(): item.is_male
+            for item in response.parsed or []
+            if item.username.lower() in usernames
+        }
+
+    # retried like generate_gender, not past the profile deadline
+    @retry(attempts=2, backoff=5, on_exception=retry_guard("gemini", 5))
+    @metrics.timed("gender")
+    def _classify_one(self, profile: Profile) -> bool | None:
+        logger.info("Using LLM to generate gender")
+        response = self._client().models.generate_content(
+            model=GENDER_MODEL,
+            contents=gender_content(
+                profile.img_bytes, profile.full_name, profile.bio, profile.country
+            ),
+            config=gender_config(),
+        )
+        metrics.record_llm_usage(response)
+        if response.parsed:
+            return response.parsed.is_male
@@ -0,0 +1,191 @@
+import asyncio
+import functools
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+
+from config import config
+from insta_scrap.log_client import logger
+
+# Persistent on-disk cache in front of the paid calls (user info, profile
+# image, LLM classification, last post date). Rejected users are cached too,
+# so a username already evaluated costs no API call within its TTL.
+
+_MISSING = object()
+
+
+class ProfileCache:
+    def __init__(self, path: str, ttls: dict, max_bytes: int):
+        self.path = path
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS cache (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_created_at ON cache (created_at)"
+        )
+        self._conn.commit()
+
+    def _count(self, counters: dict, kind: str):
+        counters[kind] = counters.get(kind, 0) + 1
+
+    def get(self, kind: str, key: str, default=_MISSING):
+        # return the cached value or default when absent or expired
+        ttl = self.ttls.get(kind, 0)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE kind = ? AND key = ?",
+                (kind, key),
+            ).fetchone()
+            if row is None or time.time() - row[1] > ttl:
+                self._count(self.misses, kind)
+                return default
+            self._count(self.hits, kind)
+        return pickle.loads(row[0])
+
+    def set(self, kind: str, key: str, value):
+        blob = pickle.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (kind, key, blob, len(blob), time.time()),
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict()
+
+    def _evict(self):
+        # drop expired rows, then the oldest ones until under max_bytes
+        now = time.time()
+        for kind, ttl in self.ttls.items():
+            self._conn.execute(
+                "DELETE FROM cache WHERE kind = ? AND created_at < ?",
+                (kind, now - ttl),
+            )
+        total = self._conn.execute("SELECT SUM(size) FROM cache").fetchone()[0]
+        total = total or 0
+        if total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT kind, key, size FROM cache ORDER BY created_at"
+            )
+            stale = []
+            for kind, key, size in rows:
+                if total <= self.max_bytes * 0.9:
+                    break
+                stale.append((kind, key))
+                total -= size
+            self._conn.executemany(
+                "DELETE FROM cache WHERE kind = ? AND key = ?", stale
+            )
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        kinds = set(self.hits) | set(self.misses)
+        return {
+            kind: {"hits": self.hits.get(kind, 0), "misses": self.misses.get(kind, 0)}
+            for kind in sorted(kinds)
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ProfileCache | None:
+    # shared cache, None when disabled in the config
+    global _cache
+    if not config.CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ProfileCache(
+                    config.CACHE_PATH,
+                    {
+                        "user_info": config.CACHE_TTL_USER_INFO,
+                        "image": config.CACHE_TTL_IMAGE,
+                        "gender": config.CACHE_TTL_GENDER,
+                        "last_post": config.CACHE_TTL_LAST_POST,
+                    },
+                    config.CACHE_MAX_BYTES,
+                )
+    return _cache
+
+
+def log_cache_stats():
+    cache = get_cache()
+    if cache is not None:
+        logger.info(f"Cache stats: {cache.stats()}")
+
+
+def content_key(*parts) -> str:
+    # stable key for calls that are not keyed by a username
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def cached(kind: str, key=None, cache_none: bool = True):
+    # cache the result of a sync or async function, keyed by its first
+    # argument unless a key function is given. None results are skipped
+    # when cache_none is False (e.g. a failed download).
+    def decorator(function):
+        def make_key(args, kwargs):
+            return str(key(*args, **kwargs) if key else args[0])
+
+        def store(cache, cache_key, value):
+            if value is not None or cache_none:
+                cache.set(kind, cache_key, value)
+            return value
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return function(*args, **kwargs)
+            cache_key = make_key(args, kwargs)
+            value = cache.get(kind, cache_key)
+            if value is not _MISSING:
+                return value
+            return store(cache, cache_key, function(*args, **kwargs))
+
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return await function(*args, **kwargs)
+            cache_key = make_key(args, kwargs)
+            value = cache.get(kind, cache_key)
+            if value is not _MISSING:
+                return value
+            return store(cache, cache_key, await function(*args, **kwargs))
+
+        if asyncio.iscoroutinefunction(function):
+            return async_wrapper
+        return wrapper
+
+    return decorator
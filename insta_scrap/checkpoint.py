@@ -0,0 +1,177 @@
+import sqlite3
+from collections import deque
+import threading
+import time
+
+from config import config
+from insta_scrap.log_client import logger
+
+# Durable crawl checkpoint for a job id: the follower cursor of each seed,
+# the usernames already analysed and the accepted count. A new run with the
+# same job id resumes from there instead of re-spending the API quota.
+#
+# The cursor saved for a seed is the token of its oldest follower page that
+# still has followers not analysed, so a crash never skips anyone: that page
+# is fetched again and the usernames already analysed are skipped.
+
+
+class Page:
+    __slots__ = ("seed_index", "username", "token", "next_token", "remaining")
+
+    def __init__(self, seed_index, username, token, next_token, remaining):
+        self.seed_index = seed_index
+        self.username = username
+        self.token = token
+        self.next_token = next_token
+        self.remaining = remaining
+
+
+class Checkpoint:
+    def __init__(self, path: str, job_id: str):
+        self.job_id = job_id
+        self.accepted = 0
+        self.seeds = {}
+        self.processed = set()
+        self._pending = []
+        self._pages = {}
+        self._exhausted = set()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                accepted INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS seeds (
+                job_id TEXT NOT NULL,
+                seed_index INTEGER NOT NULL,
+                username TEXT NOT NULL,
+                cursor TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (job_id, seed_index)
+            );
+            CREATE TABLE IF NOT EXISTS processed (
+                job_id TEXT NOT NULL,
+                username TEXT NOT NULL,
+                PRIMARY KEY (job_id, username)
+            );
+            """
+        )
+        self._load()
+
+    def _load(self):
+        row = self._conn.execute(
+            "SELECT accepted FROM jobs WHERE job_id = ?", (self.job_id,)
+        ).fetchone()
+        if row is None:
+            return
+        self.accepted = row[0]
+        for seed_index, cursor, done in self._conn.execute(
+            "SELECT seed_index, cursor, done FROM seeds WHERE job_id = ?",
+            (self.job_id,),
+        ):
+            self.seeds[seed_index] = (cursor, bool(done))
+        self.processed = {
+            username
+            for (username,) in self._conn.execute(
+                "SELECT username FROM processed WHERE job_id = ?", (self.job_id,)
+            )
+        }
+        logger.info(
+            f"Resuming job {self.job_id} | accepted: {self.accepted} | seeds: {len(self.seeds)} | processed: {len(self.processed)}"
+        )
+
+    def seed_state(self, seed_index: int) -> tuple[str | None, bool]:
+        # (cursor to restart from, whether the seed was fully paginated)
+        return self.seeds.get(seed_index, (None, False))
+
+    def start_page(
+        self, seed_index: int, username: str, token, next_token, count: int
+    ) -> Page:
+        # register a fetched page before its followers are queued
+        page = Page(seed_index, username, token, next_token, count)
+        with self._lock:
+            pages = self._pages.setdefault(seed_index, deque())
+            if not pages:
+                self._write_seed(seed_index, username, token, False)
+            pages.append(page)
+            self._advance(seed_index, username)
+        return page
+
+    def mark_processed(self, username: str, page: Page | None = None):
+        # the user was fully analysed (accepted or rejected)
+        with self._lock:
+            self._pending.append(username)
+            if page is not None:
+                page.remaining -= 1
+                self._advance(page.seed_index, page.username)
+
+    def end_seed(self, seed_index: int, username: str):
+        # every follower page of the seed was fetched
+        with self._lock:
+            self._exhausted.add(seed_index)
+            self._advance(seed_index, username)
+
+    def mark_accepted(self, username: str, page: Page | None = None):
+        # the accepted user's row was written by the sink: the count and the
+        # username are committed together, never ahead of the output
+        with self._lock:
+            self.accepted += 1
+            self._pending.append(username)
+            if page is not None:
+                page.remaining -= 1
+                self._advance(page.seed_index, page.username)
+
+    def _advance(self, seed_index: int, username: str):
+        # move the cursor past the pages whose followers are all analysed
+        pages = self._pages.get(seed_index) or deque()
+        last = None
+        while pages and pages[0].remaining <= 0:
+            last = pages.popleft()
+        if not pages and seed_index in self._exhausted:
+            self._exhausted.discard(seed_index)
+            self._write_seed(seed_index, username, None, True)
+        elif pages and last is not None:
+            self._write_seed(seed_index, username, pages[0].token, False)
+        elif last is not None:
+            self._write_seed(seed_index, username, last.next_token, False)
+
+    def _write_seed(self, seed_index, username, cursor, done):
+        self.seeds[seed_index] = (cursor, done)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO seeds VALUES (?, ?, ?, ?, ?)",
+            (self.job_id, seed_index, username, cursor, int(done)),
+        )
+        self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # one transaction per call, cheap enough to run on every page
+        pending, self._pending = self._pending, []
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO processed VALUES (?, ?)",
+            [(self.job_id, username) for username in pending],
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)",
+            (self.job_id, self.accepted, time.time()),
+        )
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+
+def open_checkpoint(job_id: str) -> Checkpoint:
+    # an in-memory database when checkpoints are disabled, same code path
+    path = config.CHECKPOINT_PATH if config.CHECKPOINT_ENABLED else ":memory:"
+    return Checkpoint(path, job_id)
@@ -0,0 +1,132 @@
+import contextvars
+import sys
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from config import config
+from insta_scrap import metrics
+
+# Per-stage timeouts and the per-profile deadline budget. The analysis of a
+# profile gets PROFILE_DEADLINE seconds: every request made for it uses the
+# smaller of its stage timeout and the time left, and once the budget is
+# spent the next step raises DeadlineExceeded, so the profile is abandoned
+# (counted in deadline_exceeded_total) instead of holding a worker. The
+# deadline is carried in a context variable set by the engines around the
+# steps of a profile, so the fetchers read it without an extra argument.
+# Seed pages have no deadline, only their stage timeout.
+
+STAGE_TIMEOUTS = {
+    "/v1/followers": config.FOLLOWERS_TIMEOUT,
+    "/v1/info": config.INFO_TIMEOUT,
+    "/v1/posts": config.POSTS_TIMEOUT,
+    "/v1/comments": config.COMMENTS_TIMEOUT,
+    "image": config.IMAGE_TIMEOUT,
+    "gemini": config.GEMINI_TIMEOUT,
+}
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    __slots__ = ("expires",)
+
+    def __init__(self, seconds: float | None = None):
+        if seconds is None:
+            seconds = config.PROFILE_DEADLINE
+        self.expires = time.monotonic() + seconds if seconds > 0 else None
+
+    def remaining(self) -> float | None:
+        if self.expires is None:
+            return None
+        return self.expires - time.monotonic()
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self, stage: str):
+        if self.expired():
+            metrics.inc("deadline_exceeded_total", stage=stage)
+            raise DeadlineExceeded(f"deadline exceeded before {stage}")
+
+
+@contextmanager
+def within(deadline: Deadline | None):
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current() -> Deadline | None:
+    return _current.get()
+
+
+def check(stage: str):
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def stage_timeout(stage: str) -> float:
+    # read timeout of a request of the stage, bounded by the current deadline
+    timeout = STAGE_TIMEOUTS.get(stage, config.HTTP_READ_TIMEOUT)
+    deadline = _current.get()
+    if deadline is None:
+        return timeout
+    deadline.check(stage)
+    remaining = deadline.remaining()
+    return timeout if remaining is None else min(timeout, remaining)
+
+
+def wait_result(future, stage: str):
+    # Future.result() within the current deadline
+    deadline = _current.get()
+    timeout = deadline.remaining() if deadline is not None else None
+    try:
+        return future.result(timeout=None if timeout is None else max(timeout, 0))
+    except FutureTimeout:
+        metrics.inc("deadline_exceeded_total", stage=stage)
+        raise DeadlineExceeded(f"deadline exceeded waiting for {stage}") from None
+
+
+def check_backoff(stage: str, backoff: float):
+    # before the pause of a retry: DeadlineExceeded when the deadline is
+    # spent, or would be by the end of the pause
+    deadline = _current.get()
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is not None and remaining <= backoff:
+        metrics.inc("deadline_exceeded_total", stage=stage)
+        raise DeadlineExceeded(f"deadline exceeded retrying {stage}")
+
+
+def retry_guard(stage: str, backoff: float = 0):
+    # on_exception of a retried request: the retry stops with DeadlineExceeded
+    # when the error was one, or when the deadline is spent (a timeout it cut)
+    # or would be by the end of the backoff
+    def guard():
+        error = sys.exc_info()[1]
+        if isinstance(error, DeadlineExceeded):
+            raise error
+        try:
+            check_backoff(stage, backoff)
+        except DeadlineExceeded as exceeded:
+            raise exceeded from error
+
+    return guard
+
+
+def aretry_guard(stage: str, backoff: float = 0):
+    # retry_guard for the async retried requests
+    guard = retry_guard(stage, backoff)
+
+    async def aguard():
+        guard()
+
+    return aguard
@@ -0,0 +1,173 @@
+import json
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Typed decoding of the RapidAPI payloads: responses are parsed with orjson
+# when installed (the json module otherwise) and turned into small slotted
+# records holding only the fields the scraper reads, instead of walking
+# nested dicts with .get() chains at every call site. Dates go through
+# parse_date, which handles epoch timestamps, ISO 8601 and "Month YYYY"
+# directly and only falls back to dateparser (slow import, slow parse) for
+# anything else.
+
+
+def loads(content: bytes | str):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _section(payload, key: str) -> dict:
+    # payload[key] as a dict, the API sends null for empty sections
+    value = payload.get(key) if isinstance(payload, dict) else None
+    return value if isinstance(value, dict) else {}
+
+
+def _items(payload) -> list:
+    return _section(payload, "data").get("items") or []
+
+
+@dataclass(slots=True)
+class Follower:
+    username: str
+    is_private: bool = False
+
+
+@dataclass(slots=True)
+class Post:
+    id: str | None
+    comment_count: int = 0
+    created_at: int | str | None = None
+
+
+@dataclass(slots=True)
+class Profile:
+    id: str | None
+    username: str = ""
+    full_name: str = ""
+    biography: str = ""
+    post_count: int | None = None
+    media_count: int | None = None
+    follower_count: int | str = ""
+    following_count: int | str = ""
+    is_private: bool = False
+    date_joined: str | None = None
+    country: str | None = None
+    image_url: str | None = None
+
+
+def decode_followers(payload) -> tuple[list[Follower], str | None]:
+    followers = [
+        Follower(item["username"], bool(item.get("is_private")))
+        for item in _items(payload)
+        if item and item.get("username")
+    ]
+    return followers, payload.get("pagination_token")
+
+
+def decode_commenters(payload) -> tuple[list[str], str | None]:
+    usernames = []
+    for item in _items(payload):
+        user = item.get("user") if item else None
+        username = user.get("username") if user else None
+        if username:
+            usernames.append(username)
+    return usernames, payload.get("pagination_token")
+
+
+def decode_posts(payload) -> tuple[list[Post], str | None, bool]:
+    # posts, next token and whether the account is private
+    data = _section(payload, "data")
+    is_private = bool(_section(data, "user").get("is_private"))
+    posts = []
+    for item in data.get("items") or []:
+        if not item:
+            continue
+        caption = item.get("caption")
+        posts.append(
+            Post(
+                item.get("id"),
+                item.get("comment_count") or 0,
+                caption.get("created_at_utc") if caption else None,
+            )
+        )
+    return posts, payload.get("pagination_token"), is_private
+
+
+def decode_profile(data) -> Profile | None:
+    # the "data" section of /v1/info
+    if not data:
+        return None
+    about = data.get("about") or {}
+    return Profile(
+        id=data.get("id"),
+        username=data.get("username", ""),
+        full_name=data.get("full_name", ""),
+        biography=data.get("biography", ""),
+        post_count=data.get("post_count", data.get("media_count")),
+        media_count=data.get("media_count"),
+        follower_count=data.get("follower_count", ""),
+        following_count=data.get("following_count", ""),
+        is_private=bool(data.get("is_private")),
+        date_joined=about.get("date_joined"),
+        country=about.get("country"),
+        image_url=data.get("profile_pic_url_hd", data.get("profile_pic_url")),
+    )
+
+
+MONTHS = {
+    name: number
+    for number, names in enumerate(
+        (
+            ("january", "jan"),
+            ("february", "feb"),
+            ("march", "mar"),
+            ("april", "apr"),
+            ("may",),
+            ("june", "jun"),
+            ("july", "jul"),
+            ("august", "aug"),
+            ("september", "sep", "sept"),
+            ("october", "oct"),
+            ("november", "nov"),
+            ("december", "dec"),
+        ),
+        start=1,
+    )
+    for name in names
+}
+MONTH_YEAR = re.compile(r"^([A-Za-z]+)\.?\s+(\d{4})$")
+EPOCH = re.compile(r"^\d{9,11}(\.\d+)?$")
+
+
+def parse_date(value) -> datetime | None:
+    if value is None or value == "":
+        return None
+    # epoch seconds, naive local time like dateparser
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    text = str(value).strip()
+    if EPOCH.match(text):
+        return datetime.fromtimestamp(float(text))
+    match = MONTH_YEAR.match(text)
+    if match and match.group(1).lower() in MONTHS:
+        return datetime(int(match.group(2)), MONTHS[match.group(1).lower()], 1)
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return _parse_date_slow(text)
+
+
+@lru_cache(maxsize=1024)
+def _parse_date_slow(text: str) -> datetime | None:
+    # import lazily (~0.5s), only formats the fast paths do not know get here
+    import dateparser
+
+    return dateparser.parse(text)
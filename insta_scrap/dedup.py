@@ -0,0 +1,88 @@
+import hashlib
+import math
+import threading
+
+from config import config
+from insta_scrap.log_client import logger
+
+# Run-scoped "already seen" filter placed before the analysis, so a follower
+# met under two seeds (or on an overlapping page) is only analysed once.
+
+
+class BloomFilter:
+    # Fixed memory for multi-million follower crawls, false positives (a new
+    # username reported as seen) happen at roughly error_rate.
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(
+            8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def add(self, value: str) -> bool:
+        # set the bits and return True when at least one was new
+        added = False
+        for position in self._positions(value):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                added = True
+        return added
+
+
+class SeenSet:
+    def __init__(
+        self,
+        mode: str = config.DEDUP_MODE,
+        capacity: int = config.DEDUP_CAPACITY,
+        error_rate: float = config.DEDUP_ERROR_RATE,
+    ):
+        self.mode = mode
+        self._seen = (
+            BloomFilter(capacity, error_rate) if mode == "bloom" else set()
+        )
+        self.unique = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def preload(self, usernames):
+        # usernames handled by a previous run of the same job, not counted
+        with self._lock:
+            for username in usernames:
+                self._seen.add(username.lower())
+
+    def add(self, username: str) -> bool:
+        # True the first time a username is seen during the run
+        username = username.lower()
+        with self._lock:
+            if self.mode == "bloom":
+                new = self._seen.add(username)
+            else:
+                new = username not in self._seen
+                if new:
+                    self._seen.add(username)
+            if new:
+                self.unique += 1
+            else:
+                self.duplicates += 1
+            return new
+
+    def report(self, api_calls: int, llm_calls: int) -> dict:
+        # estimate the calls saved from the average cost of a unique profile
+        per_profile = self.unique or 1
+        report = {
+            "mode": self.mode,
+            "unique": self.unique,
+            "duplicates": self.duplicates,
+            "api_calls_saved": round(self.duplicates * api_calls / per_profile),
+            "llm_calls_saved": round(self.duplicates * llm_calls / per_profile),
+        }
+        logger.info(f"Dedup: {report}")
+        return report
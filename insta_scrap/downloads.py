@@ -0,0 +1,92 @@
+import os
+import time
+import zlib
+
+from config import config
+from insta_scrap.log_client import logger
+from insta_scrap.sink import sink_format
+
+# Job outputs served straight from the sink's file: read in chunks, gzip
+# compressed on the fly if asked, never loaded whole. While a job runs only
+# the rows already flushed are served (up to the last complete line), and
+# outputs older than OUTPUT_RETENTION_HOURS are deleted.
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def output_path(name: str) -> str:
+    # only plain file names inside OUTPUT_DIR, no path from the client
+    if not name or name != os.path.basename(name) or name.startswith("."):
+        raise ValueError(f"invalid output name {name!r}")
+    return os.path.join(config.OUTPUT_DIR, name)
+
+
+def media_type(path: str) -> str:
+    return MEDIA_TYPES[sink_format(path)]
+
+
+def flushed_size(path: str) -> int:
+    # bytes up to the last newline, a batch being appended is left out
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        position = size
+        while position > 0:
+            start = max(position - config.DOWNLOAD_CHUNK_SIZE, 0)
+            file.seek(start)
+            block = file.read(position - start)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def iter_file(path: str, limit: int | None = None):
+    # the file is opened when the response starts streaming
+    remaining = os.path.getsize(path) if limit is None else limit
+    with open(path, "rb") as file:
+        while remaining > 0:
+            chunk = file.read(min(config.DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def cleanup_outputs(active=(), max_age: float | None = None) -> int:
+    # delete outputs (and their metrics summary) past the retention, the
+    # files of running jobs are kept
+    if max_age is None:
+        max_age = config.OUTPUT_RETENTION_HOURS * 3600
+    if max_age <= 0 or not os.path.isdir(config.OUTPUT_DIR):
+        return 0
+    active = {os.path.abspath(path) for path in active}
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(config.OUTPUT_DIR):
+        path = os.path.abspath(entry.path)
+        job_file = path.removesuffix(".metrics.json")
+        if not entry.is_file() or job_file in active:
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            logger.info(f"Could not remove {path}: {e}")
+    if removed:
+        logger.info(f"Removed {removed} expired output files")
+    return removed
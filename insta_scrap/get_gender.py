@@ -1,18 +1,37 @@
+import threading
 import config
-from google.genai import types
-from google import genai
 from pydantic import BaseModel
-from config.config import GEMINI_API_KEY, RAPID_API_KEY, RAPID_API_HOST
-import requests
-from dateparser import parse
-import pandas as pd
-import os
+from config.config import GEMINI_API_KEY, GEMINI_BASE_URL, GEMINI_TIMEOUT
+from insta_scrap import metrics
+from insta_scrap.cache import cached, content_key
+from insta_scrap.deadline import retry_guard, stage_timeout
+from insta_scrap.decoding import decode_posts, parse_date
+from insta_scrap.images import sniff_mime
+from insta_scrap.posts import get_posts_page
 from the_retry import retry
-from insta_scrap.exceptions_client import exceptions
 from insta_scrap.log_client import logger
-from supabase import create_client
+from insta_scrap.sink import open_sink
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+# google.genai takes about a second to import, it is imported on first use
+# so the CLI and the workers start fast without keys
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # shared Gemini client, built on the first LLM call
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+
+                # milliseconds, also bounds the batched requests
+                http_options = {"timeout": int(GEMINI_TIMEOUT * 1000)}
+                if GEMINI_BASE_URL:
+                    http_options["base_url"] = GEMINI_BASE_URL
+                _client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+    return _client
 
 
 # model
@@ -31,17 +50,6 @@ Return only 'True' if the person is a white male, or 'False' if not, with no add
 """
 
 
-def send_data_to_csv(file_name: str, df: pd.DataFrame, user_info: dict):
-    if os.path.exists(file_name):
-        df.to_csv(file_name, mode="a", header=False, index=False)
-    else:
-        df.to_csv(file_name, index=False)
-
-    # Send to supabase
-    # supabase = create_client(supabase_url=SUPABASE_URL, supabase_key=SUPABASE_KEY)
-    # supabase.table("scraped_users").upsert(user_info).execute()
-
-
 # Define user prompt
 def user_prompt(full_name: str, bio: str, country: str):
     return f"""
@@ -53,71 +61,81 @@ def user_prompt(full_name: str, bio: str, country: str):
     """
 
 
-@retry(attempts=2, backoff=5)
-def generate_gender(img_bytes: bytes, full_name: str, bio: str, country: str):
-    logger.info("Using LLM to generate gender")
-    # Prepare content
-    content = [
-        types.Part.from_bytes(
-            data=img_bytes,
-            mime_type="image/jpeg",
-        ),
+GENDER_MODEL = "gemini-2.0-flash"
+GENDER_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": IsMale,
+    "system_instruction": system_prompt,
+}
+
+
+def gender_config() -> dict:
+    # GENDER_CONFIG with the Gemini timeout bounded by the profile deadline
+    timeout = stage_timeout("gemini")
+    return {**GENDER_CONFIG, "http_options": {"timeout": int(timeout * 1000)}}
+
+
+def image_part(img_bytes: bytes):
+    # sniffed type, downloads are not always jpeg
+    from google.genai import types
+
+    return types.Part.from_bytes(
+        data=img_bytes,
+        mime_type=sniff_mime(img_bytes) or "image/jpeg",
+    )
+
+
+def gender_content(img_bytes: bytes, full_name: str, bio: str, country: str):
+    # Prepare content, shared by the sync and the async client
+    return [
+        image_part(img_bytes),
         user_prompt(full_name, bio, country),
     ]
 
+
+@cached("gender", key=content_key, cache_none=False)
+# not retried past the profile deadline, see retry_guard
+@retry(attempts=2, backoff=5, on_exception=retry_guard("gemini", 5))
+@metrics.timed("gender")
+def generate_gender(img_bytes: bytes, full_name: str, bio: str, country: str):
+    logger.info("Using LLM to generate gender")
+    content = gender_content(img_bytes, full_name, bio, country)
+
     # generate the gender
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
+    response = get_client().models.generate_content(
+        model=GENDER_MODEL,
         contents=content,
-        config={
-            "response_mime_type": "application/json",
-            "response_schema": IsMale,
-            "system_instruction": system_prompt,
-        },
+        config=gender_config(),
     )
+    metrics.record_llm_usage(response)
     if response.parsed:
         return response.parsed.is_male
 
 
-@retry(attempts=5, backoff=5, expected_exception=exceptions)
+def parse_last_post_date(json_data: dict):
+    # parse the /v1/posts response and return the last post date
+    posts, _, _ = decode_posts(json_data)
+    if not posts:
+        return None
+    # created_at_utc is an epoch timestamp, no dateparser needed
+    last_post_date = parse_date(posts[0].created_at)
+    return last_post_date.isoformat() if last_post_date else None
+
+
+@cached("last_post")
 def get_username_last_post_date(username: str):
     logger.info("Getting the date of user last post date")
-    # initialise the parameter and variables needed for the requests
-    url = f"https://{RAPID_API_HOST}/v1/posts"
-
-    querystring = {"username_or_id_or_url": username}
-
-    headers = {
-        "x-rapidapi-key": RAPID_API_KEY,
-        "x-rapidapi-host": f"{RAPID_API_HOST}",
-    }
-
-    # send the requests and parse the response
-    response = requests.get(url, headers=headers, params=querystring)
-    response.raise_for_status()
-    json_data = response.json()
-    post_data = json_data.get("data", {})
-    if post_data:
-        posts = post_data.get("items") if post_data else []
-        if posts:
-            try:
-                last_post_date = (
-                    posts[0]["caption"]["created_at_utc"] if posts else None
-                )
-            except Exception:
-                last_post_date = None
-            last_post_date = (
-                parse(str(last_post_date)).isoformat()
-                if last_post_date
-                else None
-            )
-            return last_post_date
+    # first page of /v1/posts, memoized and shared with get_posts
+    return parse_last_post_date(get_posts_page(username))
 
 
 def start_gender_service(
     user_info: dict, img_bytes: bytes, file_name: str, token: str
 ) -> int:
     logger.info("Starting Gender service")
+    # default avatar or failed download, nothing to classify
+    if not img_bytes:
+        return 0
     # get the gender
     gender = generate_gender(
         img_bytes,
@@ -133,10 +151,25 @@ def start_gender_service(
 
         logger.info(f"Last post date: {last_post_date}")
 
-        # send data to file
-        logger.info("Finally saving data")
-        df = pd.DataFrame(user_info, index=[0])
-        df["token"] = token
-        send_data_to_csv(file_name, df, user_info)
+        save_user(file_name, user_info, token, last_post_date)
         return 1
     return 0
+
+
+def save_user(
+    file_name: str,
+    user_info: dict,
+    token: str,
+    last_post_date: str | None = None,
+    on_written=None,
+):
+    # send data to the single writer of the output file, on_written() runs
+    # once the row is actually written
+    logger.info("Finally saving data")
+    open_sink(file_name).write(user_row(user_info, token, last_post_date), on_written)
+    metrics.inc("accepted_total")
+
+
+def user_row(user_info: dict, token: str, last_post_date: str | None = None) -> dict:
+    # output columns of an accepted user
+    return {**user_info, "last_post_date": last_post_date, "token": token}
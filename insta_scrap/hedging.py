@@ -0,0 +1,157 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import config
+from insta_scrap import metrics
+
+# Hedged requests for the idempotent RapidAPI GETs: the latency of recent
+# answers is kept per endpoint, and a request still running after the
+# HEDGE_QUANTILE of its endpoint is sent a second time, the first answer
+# wins. A hung connection then costs one p95 instead of a whole timeout.
+# At most HEDGE_BUDGET of the requests are hedged, so a slow endpoint is not
+# hit twice as hard, and nothing is hedged before HEDGE_MIN_SAMPLES answers.
+
+
+class LatencyWindow:
+    def __init__(self, size: int = config.HEDGE_WINDOW):
+        self.samples = deque(maxlen=size)
+        self.requests = 0
+        self.hedged = 0
+        self._delay = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            # the quantile is recomputed every few answers, not per request
+            if len(self.samples) % 10 == 0 or self._delay is None:
+                self._delay = self._quantile()
+
+    def _quantile(self) -> float | None:
+        if len(self.samples) < config.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        index = min(int(len(ordered) * config.HEDGE_QUANTILE), len(ordered) - 1)
+        return max(ordered[index], config.HEDGE_MIN_DELAY)
+
+    def delay(self) -> float | None:
+        # seconds before a hedge, None when this request is not hedged
+        with self._lock:
+            self.requests += 1
+            return self._delay
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.hedged + 1 > self.requests * config.HEDGE_BUDGET:
+                return False
+            self.hedged += 1
+            return True
+
+
+_windows = {}
+_windows_lock = threading.Lock()
+_executor = None
+
+
+def enabled(endpoint: str) -> bool:
+    return config.HEDGE_ENABLED and endpoint in config.HEDGE_ENDPOINTS
+
+
+def get_window(endpoint: str) -> LatencyWindow:
+    with _windows_lock:
+        window = _windows.get(endpoint)
+        if window is None:
+            window = _windows[endpoint] = LatencyWindow()
+        return window
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _windows_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=config.HEDGE_WORKERS, thread_name_prefix="hedge"
+                )
+    return _executor
+
+
+def _timed(window: LatencyWindow, fetch):
+    started = time.monotonic()
+    result = fetch()
+    window.record(time.monotonic() - started)
+    return result
+
+
+def _first(futures: list, primary):
+    # first successful result, the error of the primary if both failed
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future
+    return primary
+
+
+def hedged_call(endpoint: str, fetch):
+    # fetch() once, and a second time if the first is slower than usual
+    window = get_window(endpoint)
+    delay = window.delay()
+    if delay is None:
+        return _timed(window, fetch)
+    # the deadline of the profile follows the request into the pool
+    primary = get_executor().submit(
+        contextvars.copy_context().run, _timed, window, fetch
+    )
+    done, _ = wait([primary], timeout=delay)
+    if done or not window.allow():
+        return primary.result()
+    metrics.inc("hedged_requests_total", endpoint=endpoint)
+    backup = get_executor().submit(
+        contextvars.copy_context().run, _timed, window, fetch
+    )
+    winner = _first([primary, backup], primary)
+    if winner is backup:
+        metrics.inc("hedge_wins_total", endpoint=endpoint)
+    return winner.result()
+
+
+async def _atimed(window: LatencyWindow, fetch):
+    started = time.monotonic()
+    result = await fetch()
+    window.record(time.monotonic() - started)
+    return result
+
+
+async def hedged_acall(endpoint: str, fetch):
+    # same as hedged_call for a coroutine function, the loser is cancelled
+    window = get_window(endpoint)
+    delay = window.delay()
+    if delay is None:
+        return await _atimed(window, fetch)
+    primary = asyncio.ensure_future(_atimed(window, fetch))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and window.allow():
+            metrics.inc("hedged_requests_total", endpoint=endpoint)
+            tasks.add(asyncio.ensure_future(_atimed(window, fetch)))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        metrics.inc("hedge_wins_total", endpoint=endpoint)
+                    return task.result()
+        return primary.result()
+    finally:
+        for task in tasks:
+            task.cancel()
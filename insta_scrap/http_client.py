@@ -0,0 +1,128 @@
+import threading
+import time
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import config
+from insta_scrap import hedging, metrics
+from insta_scrap.deadline import check_backoff, stage_timeout
+from insta_scrap.log_client import logger
+from insta_scrap.rate_limit import get_limiter, is_throttled
+
+# One pooled session shared by every fetcher (RapidAPI and image downloads),
+# so keep-alive connections are reused instead of paying a new TCP+TLS
+# handshake on each call.
+_session = None
+_session_lock = threading.Lock()
+
+
+def rapidapi_url(path: str) -> str:
+    return f"{config.RAPID_API_BASE_URL}{path}"
+
+
+@lru_cache(maxsize=1)
+def rapidapi_headers() -> dict:
+    # Built once, requests merges it without mutating
+    return {
+        "x-rapidapi-key": config.RAPID_API_KEY,
+        "x-rapidapi-host": f"{config.RAPID_API_HOST}",
+    }
+
+
+def default_timeout() -> tuple[float, float]:
+    return (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=config.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=config.HTTP_POOL_SIZE,
+        pool_block=True,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    # Lazily build the shared session, the lock only matters on first use
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def http_get(url: str, params=None, headers=None, timeout=None, **kwargs):
+    # GET through the pooled session with the default timeouts
+    return get_session().get(
+        url,
+        params=params,
+        headers=headers,
+        timeout=timeout or default_timeout(),
+        **kwargs,
+    )
+
+
+def rapidapi_get(path: str, params=None, timeout=None, **kwargs):
+    # GET a RapidAPI endpoint (e.g. "/v1/followers") with the default headers.
+    # The read timeout is the stage timeout bounded by the profile deadline
+    # (see insta_scrap.deadline), slow requests are hedged if enabled.
+    if timeout is None:
+        timeout = (config.HTTP_CONNECT_TIMEOUT, stage_timeout(path))
+    if hedging.enabled(path) and not kwargs.get("stream"):
+        return hedging.hedged_call(
+            path, lambda: _rapidapi_get(path, params, timeout, **kwargs)
+        )
+    return _rapidapi_get(path, params, timeout, **kwargs)
+
+
+def _rapidapi_get(path: str, params, timeout, **kwargs):
+    # through the endpoint rate limiter, 429/5xx responses are retried after
+    # the limiter pause, the last one is returned for raise_for_status.
+    limiter = get_limiter(path)
+    for attempt in range(config.RATE_LIMIT_RETRIES + 1):
+        limiter.acquire()
+        try:
+            response = http_get(
+                rapidapi_url(path),
+                params=params,
+                headers=rapidapi_headers(),
+                timeout=timeout,
+                **kwargs,
+            )
+        except Exception:
+            limiter.release()
+            raise
+        limiter.release(response.status_code, response.headers)
+        metrics.inc("http_requests_total", endpoint=path, status=response.status_code)
+        metrics.inc("http_bytes_total", len(response.content), endpoint=path)
+        if not is_throttled(response.status_code):
+            return response
+        metrics.inc("http_retries_total", endpoint=path)
+        logger.info(
+            f"{path} answered {response.status_code}, attempt {attempt + 1}"
+        )
+        if attempt == config.RATE_LIMIT_RETRIES:
+            break
+        # no retry past the profile deadline, nor a pause running into it
+        backoff = (
+            0
+            if response.status_code == 429
+            else config.RATE_LIMIT_BACKOFF * 2**attempt
+        )
+        check_backoff(path, backoff)
+        time.sleep(backoff)
+    return response
@@ -0,0 +1,164 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+
+from config import config
+from insta_scrap import metrics
+from insta_scrap.deadline import stage_timeout
+from insta_scrap.log_client import logger
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Profile image processing shared by both engines: downloads are capped in
+# size and time, the real MIME type is sniffed from the first bytes, images
+# are downscaled to what the classifier needs (Pillow, optional) and
+# identical images are processed once, by content hash. Default avatars come
+# back as DEFAULT_AVATAR so the caller skips the LLM call.
+
+# falsy like a failed download, but cached and final for the user
+DEFAULT_AVATAR = b""
+
+
+class ImageDownloadError(Exception):
+    pass
+
+
+def check_download(size: int, deadline: float):
+    # called on every chunk, aborts oversized or slow downloads
+    if size > config.IMAGE_MAX_BYTES:
+        raise ImageDownloadError(f"image over {config.IMAGE_MAX_BYTES} bytes")
+    if time.monotonic() > deadline:
+        raise ImageDownloadError(f"image download over {config.IMAGE_TIMEOUT}s")
+
+
+def download_deadline() -> float:
+    # bounded by the deadline of the profile
+    return time.monotonic() + stage_timeout("image")
+
+
+def sniff_mime(data: bytes) -> str | None:
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"heic", b"heix", b"mif1"):
+        return "image/heic"
+    return None
+
+
+def is_default_avatar_url(image_url: str) -> bool:
+    return any(marker in image_url for marker in config.IMAGE_DEFAULT_AVATAR_URLS)
+
+
+def downscale(data: bytes, mime: str, max_side: int) -> bytes:
+    # longest side down to max_side as JPEG, untouched if already small
+    # enough or when Pillow is not installed
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_side:
+                return data
+            image.thumbnail((max_side, max_side))
+            output = io.BytesIO()
+            image.convert("RGB").save(
+                output, "JPEG", quality=config.IMAGE_JPEG_QUALITY
+            )
+    except Exception as e:
+        logger.info(f"Could not downscale {mime} image: {e}")
+        return data
+    return output.getvalue()
+
+
+class ImageStore:
+    # processed images by content hash, with the distinct image URLs (one
+    # per account) that had that content: the same picture on many accounts
+    # is a default avatar
+    def __init__(
+        self,
+        max_items: int = config.IMAGE_MEMO_SIZE,
+        shared_count: int = config.IMAGE_SHARED_AVATAR_COUNT,
+        default_hashes: list[str] = config.IMAGE_DEFAULT_AVATAR_HASHES,
+    ):
+        self.max_items = max_items
+        self.shared_count = shared_count
+        self.default_hashes = set(default_hashes)
+        self.images = OrderedDict()
+        self.defaults = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def process(self, data: bytes, image_url: str) -> bytes | None:
+        # downloaded bytes -> bytes for the LLM, DEFAULT_AVATAR or None
+        mime = sniff_mime(data)
+        if mime is None:
+            logger.info("Downloaded profile picture is not an image")
+            return None
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            self.bytes_in += len(data)
+            entry = self.images.get(digest)
+            if entry is not None:
+                # a URL downloaded again is still the same account
+                if len(entry[1]) < self.shared_count:
+                    entry[1].add(image_url)
+                self.images.move_to_end(digest)
+            if digest in self.default_hashes or (
+                entry and self.shared_count and len(entry[1]) >= self.shared_count
+            ):
+                self.defaults += 1
+                metrics.inc("image_default_avatars_total")
+                return DEFAULT_AVATAR
+            if entry is not None:
+                self.bytes_out += len(entry[0])
+                metrics.inc("image_bytes_total", len(data), direction="downloaded")
+                metrics.inc("image_bytes_total", len(entry[0]), direction="sent")
+                return entry[0]
+        image = downscale(data, mime, config.IMAGE_MAX_SIDE)
+        metrics.inc("image_bytes_total", len(data), direction="downloaded")
+        metrics.inc("image_bytes_total", len(image), direction="sent")
+        with self._lock:
+            self.bytes_out += len(image)
+            # [image, URLs with this content]
+            entry = self.images.setdefault(digest, [image, set()])
+            entry[1].add(image_url)
+            while len(self.images) > self.max_items:
+                self.images.popitem(last=False)
+        return image
+
+    def report(self) -> dict:
+        report = {
+            "default_avatars": self.defaults,
+            "bytes_downloaded": self.bytes_in,
+            "bytes_sent": self.bytes_out,
+        }
+        logger.info(f"Images: {report}")
+        return report
+
+
+_store = ImageStore()
+
+
+def open_image_store():
+    # a new store for each job: the shared avatar counts of a previous job
+    # run in the same process (NiceGUI's cpu_bound pool) do not carry over
+    global _store
+    _store = ImageStore()
+
+
+def process_image(data: bytes, image_url: str) -> bytes | None:
+    return _store.process(data, image_url)
+
+
+def log_image_stats():
+    _store.report()
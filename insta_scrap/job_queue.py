@@ -0,0 +1,229 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import config
+from insta_scrap.log_client import logger
+from insta_scrap.sink import close_sink, open_sink
+
+# SQLite broker for the queue engine. The app enqueues a job with its seed
+# usernames, worker processes on this machine or any machine sharing the
+# file claim tasks with a lease: a "page" task fetches one follower page and
+# enqueues its followers as "user" tasks plus the next page, a "user" task
+# analyses one follower. The job quota and the accepted rows live in the
+# broker, so total_results holds across all workers.
+
+
+class Task:
+    __slots__ = ("id", "job_id", "kind", "username", "token", "attempts")
+
+    def __init__(self, id, job_id, kind, username, token, attempts):
+        self.id = id
+        self.job_id = job_id
+        self.kind = kind
+        self.username = username
+        self.token = token
+        self.attempts = attempts
+
+
+class JobQueue:
+    def __init__(self, path: str = config.QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # autocommit, claims and accepts use explicit IMMEDIATE transactions
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                total_results INTEGER NOT NULL,
+                accepted INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                username TEXT NOT NULL,
+                token TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (job_id, kind, key)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, kind, id);
+            CREATE TABLE IF NOT EXISTS results (
+                job_id TEXT NOT NULL,
+                username TEXT NOT NULL,
+                row TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (job_id, username)
+            );
+            """
+        )
+
+    def create_job(self, job_id: str, file_name: str, total_results: int):
+        # a job id already in the broker is resumed as is
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, file_name, total_results, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, file_name, int(total_results), time.time()),
+            )
+
+    def _add_tasks(self, job_id: str, kind: str, rows: list[tuple]):
+        # rows of (key, username, token), duplicates are ignored so a
+        # follower met under two seeds is analysed once per job
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO tasks (job_id, kind, key, username, token) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, kind, *row) for row in rows],
+            )
+            self._conn.execute("COMMIT")
+
+    def add_pages(self, job_id: str, usernames, token: str | None):
+        self._add_tasks(
+            job_id,
+            "page",
+            [(f"{username}\n{token or ''}", username, token) for username in usernames],
+        )
+
+    def add_users(self, job_id: str, usernames, token: str | None):
+        self._add_tasks(
+            job_id,
+            "user",
+            [(username.lower(), username, token) for username in usernames],
+        )
+
+    def claim(self, worker: str, job_id: str | None = None) -> Task | None:
+        # next pending task of an unfinished job, or one whose lease expired
+        # with its worker. Users go before pages, so pagination only runs
+        # ahead when the analysis is starved.
+        now = time.time()
+        query = """
+            SELECT t.id, t.job_id, t.kind, t.username, t.token, t.attempts
+            FROM tasks t JOIN jobs j ON j.job_id = t.job_id
+            WHERE j.accepted < j.total_results
+            AND (t.state = 'pending' OR (t.state = 'running' AND t.lease_until < ?))
+        """
+        params = [now]
+        if job_id:
+            query += " AND t.job_id = ?"
+            params.append(job_id)
+        query += " ORDER BY t.kind = 'page', t.id LIMIT 1"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                while row := self._conn.execute(query, params).fetchone():
+                    task = Task(*row)
+                    if task.attempts < config.QUEUE_MAX_ATTEMPTS:
+                        break
+                    self._conn.execute(
+                        "UPDATE tasks SET state = 'failed' WHERE id = ?", (task.id,)
+                    )
+                else:
+                    return None
+                self._conn.execute(
+                    "UPDATE tasks SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    (worker, now + config.QUEUE_LEASE, task.id),
+                )
+                task.attempts += 1
+                return task
+            finally:
+                self._conn.execute("COMMIT")
+
+    def finish(self, task: Task, state: str = "done"):
+        # "pending" puts a failed task back for another attempt
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET state = ?, lease_until = NULL WHERE id = ?",
+                (state, task.id),
+            )
+
+    def accept(self, job_id: str, username: str, row: dict) -> int | None:
+        # take one slot of the job quota and store the row in the same
+        # transaction, returns the accepted count or None when full
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # already accepted by a worker that died before finishing
+                # the task, do not count it twice
+                if self._conn.execute(
+                    "SELECT 1 FROM results WHERE job_id = ? AND username = ?",
+                    (job_id, username.lower()),
+                ).fetchone():
+                    return self._conn.execute(
+                        "SELECT accepted FROM jobs WHERE job_id = ?", (job_id,)
+                    ).fetchone()[0]
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET accepted = accepted + 1 WHERE job_id = ? AND accepted < total_results",
+                    (job_id,),
+                )
+                if not cursor.rowcount:
+                    return None
+                self._conn.execute(
+                    "INSERT INTO results VALUES (?, ?, ?, ?)",
+                    (job_id, username.lower(), json.dumps(row, default=str), time.time()),
+                )
+                return self._conn.execute(
+                    "SELECT accepted FROM jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()[0]
+            finally:
+                self._conn.execute("COMMIT")
+
+    def job_status(self, job_id: str) -> dict:
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT total_results, accepted FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+            counts = self._conn.execute(
+                "SELECT kind, state, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY kind, state",
+                (job_id,),
+            ).fetchall()
+        total_results, accepted = job or (0, 0)
+        states = {}
+        kinds = {}
+        for kind, state, count in counts:
+            states[state] = states.get(state, 0) + count
+            kinds.setdefault(kind, {})[state] = count
+        active = states.get("pending", 0) + states.get("running", 0)
+        return {
+            "total_results": total_results,
+            "accepted": accepted,
+            "tasks": states,
+            "kinds": kinds,
+            # a job not enqueued yet is not finished, its workers wait
+            "finished": job is not None
+            and (accepted >= total_results or not active),
+        }
+
+    def export_results(self, job_id: str, file_name: str) -> int:
+        # write the accepted rows of a job to its output file, the broker
+        # holds the whole job so a resumed job rewrites it from scratch
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row FROM results WHERE job_id = ? ORDER BY created_at",
+                (job_id,),
+            ).fetchall()
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        sink = open_sink(file_name)
+        for (row,) in rows:
+            sink.write(json.loads(row))
+        close_sink(file_name)
+        logger.info(f"Exported {len(rows)} rows of job {job_id} to {file_name}")
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,3 +1,5 @@
 from loguru import logger
 
-logger.add("../logs.txt", level="INFO")
+# enqueue: records go through a queue to a writer thread, the scraping
+# threads never wait on the log file
+logger.add("../logs.txt", level="INFO", enqueue=True)
@@ -0,0 +1,357 @@
+import asyncio
+import bisect
+import functools
+import glob
+import json
+import os
+import threading
+import time
+
+from config import config
+from insta_scrap.log_client import logger
+
+# Per-stage metrics of the scrape: call and error counts, latency histograms,
+# HTTP bytes and retries, LLM tokens and queue depths. Every process keeps its
+# own registry and, while a job runs, writes a snapshot to METRICS_DIR so the
+# NiceGUI server can serve the merged view on /metrics (Prometheus text
+# format). A JSON summary of each job is written next to its output.
+#
+# With METRICS_ENABLED=false, timed() returns the function untouched and the
+# recording calls return immediately.
+
+ENABLED = config.METRICS_ENABLED
+
+# seconds, the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+class Registry:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [
+                    [0] * (len(LATENCY_BUCKETS) + 1),
+                    0.0,
+                ]
+            histogram[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[1] += value
+
+    def gauge(self, name: str, read):
+        # read() returns [(labels, value)], evaluated at snapshot time
+        with self._lock:
+            self.gauges[name] = read
+
+    def remove_gauge(self, name: str):
+        with self._lock:
+            self.gauges.pop(name, None)
+
+    def snapshot(self) -> dict:
+        # plain lists, JSON and pickle friendly
+        with self._lock:
+            counters = [[n, dict(l), v] for (n, l), v in self.counters.items()]
+            histograms = [
+                [n, dict(l), list(h[0]), h[1]] for (n, l), h in self.histograms.items()
+            ]
+            gauges = list(self.gauges.items())
+        values = []
+        for name, read in gauges:
+            try:
+                values.extend([name, labels, value] for labels, value in read())
+            except Exception:
+                continue
+        return {"counters": counters, "histograms": histograms, "gauges": values}
+
+
+_registry = Registry()
+
+
+def inc(name: str, value: float = 1, **labels):
+    if ENABLED:
+        _registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    if ENABLED:
+        _registry.observe(name, value, **labels)
+
+
+def gauge(name: str, read):
+    if ENABLED:
+        _registry.gauge(name, read)
+
+
+def remove_gauge(name: str):
+    if ENABLED:
+        _registry.remove_gauge(name)
+
+
+def snapshot() -> dict:
+    return _registry.snapshot()
+
+
+def timed(stage: str):
+    # count calls and errors of a stage and time them; placed under @retry
+    # so every attempt is recorded
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        def record(started: float, error: bool):
+            elapsed = time.perf_counter() - started
+            _registry.observe("stage_latency_seconds", elapsed, stage=stage)
+            _registry.inc("stage_calls_total", stage=stage)
+            if error:
+                _registry.inc("stage_errors_total", stage=stage)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = True
+            try:
+                result = function(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                record(started, error)
+
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await function(*args, **kwargs)
+            except asyncio.CancelledError:
+                # quota met or hedge lost: not a call, an error nor a latency
+                _registry.inc("stage_cancelled_total", stage=stage)
+                raise
+            except BaseException:
+                record(started, True)
+                raise
+            record(started, False)
+            return result
+
+        if asyncio.iscoroutinefunction(function):
+            return async_wrapper
+        return wrapper
+
+    return decorator
+
+
+def record_llm_usage(response, mode: str = "single"):
+    # token counts reported by Gemini, missing on cached or fake responses
+    usage = getattr(response, "usage_metadata", None)
+    if not ENABLED or usage is None:
+        return
+    for kind, attribute in (
+        ("prompt", "prompt_token_count"),
+        ("output", "candidates_token_count"),
+    ):
+        tokens = getattr(usage, attribute, None)
+        if tokens:
+            _registry.inc("llm_tokens_total", tokens, kind=kind, mode=mode)
+
+
+def merge(snapshots: list[dict]) -> dict:
+    counters = {}
+    histograms = {}
+    gauges = {}
+    for snap in snapshots:
+        for name, labels, value in snap["counters"]:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total in snap["histograms"]:
+            key = _key(name, labels)
+            if key in histograms:
+                merged = histograms[key]
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+            else:
+                histograms[key] = [list(buckets), total]
+        for name, labels, value in snap["gauges"]:
+            key = _key(name, labels)
+            gauges[key] = gauges.get(key, 0) + value
+    return {
+        "counters": [[n, dict(l), v] for (n, l), v in counters.items()],
+        "histograms": [[n, dict(l), b, t] for (n, l), (b, t) in histograms.items()],
+        "gauges": [[n, dict(l), v] for (n, l), v in gauges.items()],
+    }
+
+
+def diff(after: dict, before: dict) -> dict:
+    # what happened between two snapshots of the same process
+    negative = {
+        "counters": [[n, l, -v] for n, l, v in before["counters"]],
+        "histograms": [
+            [n, l, [-c for c in b], -t] for n, l, b, t in before["histograms"]
+        ],
+        "gauges": [],
+    }
+    return merge([after, negative])
+
+
+def _series(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{inner}}}"
+
+
+def render(snap: dict) -> str:
+    # Prometheus text exposition format
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for name, labels, value in sorted(snap["counters"], key=lambda c: c[0]):
+        declare(name, "counter")
+        lines.append(f"{_series(name, labels)} {value:g}")
+    for name, labels, value in sorted(snap["gauges"], key=lambda g: g[0]):
+        declare(name, "gauge")
+        lines.append(f"{_series(name, labels)} {value:g}")
+    for name, labels, buckets, total in sorted(snap["histograms"], key=lambda h: h[0]):
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), buckets):
+            cumulative += count
+            lines.append(f"{_series(name + '_bucket', {**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{_series(name + '_sum', labels)} {total:g}")
+        lines.append(f"{_series(name + '_count', labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def quantile(buckets: list[int], q: float) -> float | None:
+    # estimated from the buckets, linear inside the matching bucket
+    count = sum(buckets)
+    if not count:
+        return None
+    rank = q * count
+    seen = 0
+    lower = 0.0
+    for bound, bucket in zip((*LATENCY_BUCKETS, LATENCY_BUCKETS[-1]), buckets):
+        if bucket and seen + bucket >= rank:
+            return lower + (bound - lower) * (rank - seen) / bucket
+        seen += bucket
+        lower = bound
+    return LATENCY_BUCKETS[-1]
+
+
+def summary(snap: dict) -> dict:
+    # JSON view: counters by name and labels, latency per stage
+    stages = {}
+    for name, labels, buckets, total in snap["histograms"]:
+        if name != "stage_latency_seconds":
+            continue
+        count = sum(buckets)
+        stages[labels["stage"]] = {
+            "calls": count,
+            "mean": total / count if count else None,
+            "p50": quantile(buckets, 0.5),
+            "p99": quantile(buckets, 0.99),
+        }
+    counters = {}
+    for name, labels, value in snap["counters"]:
+        key = ",".join(f"{k}={v}" for k, v in sorted(labels.items())) or "total"
+        counters.setdefault(name, {})[key] = value
+    return {"stages": stages, "counters": counters}
+
+
+def snapshot_path(pid: int | None = None) -> str:
+    return os.path.join(config.METRICS_DIR, f"{pid or os.getpid()}.json")
+
+
+def write_snapshot():
+    os.makedirs(config.METRICS_DIR, exist_ok=True)
+    path = snapshot_path()
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(snapshot(), file)
+    os.replace(f"{path}.tmp", path)
+
+
+def collect() -> dict:
+    # this process plus the snapshots of the other running processes (engine
+    # process of the UI, queue workers); the snapshot of a process that
+    # stopped writing is removed, its counters leave the totals
+    snapshots = [snapshot()]
+    own = snapshot_path()
+    stale_after = config.METRICS_SNAPSHOT_INTERVAL * config.METRICS_STALE_INTERVALS
+    stale = time.time() - stale_after
+    for path in glob.glob(os.path.join(config.METRICS_DIR, "*.json")):
+        if path == own:
+            continue
+        try:
+            if os.path.getmtime(path) < stale:
+                os.remove(path)
+                continue
+            with open(path) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return merge(snapshots)
+
+
+class JobMetrics:
+    # snapshot writer for the duration of a job, and its summary at the end
+    def __init__(self, file_name: str | None):
+        self.file_name = file_name
+        self.before = snapshot()
+        self.started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        if ENABLED:
+            self._thread = threading.Thread(
+                target=self._run, name="metrics-snapshot", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(config.METRICS_SNAPSHOT_INTERVAL):
+            self._write()
+
+    def _write(self):
+        try:
+            write_snapshot()
+        except OSError as e:
+            logger.info(f"Could not write metrics snapshot: {e}")
+
+    def close(self, **extra) -> dict | None:
+        if not ENABLED:
+            return None
+        self._stop.set()
+        self._thread.join()
+        # the job is over, /metrics no longer adds this process
+        try:
+            os.remove(snapshot_path())
+        except OSError:
+            pass
+        if self.file_name is None:
+            return None
+        report = summary(diff(snapshot(), self.before))
+        report.update(elapsed=time.monotonic() - self.started, **extra)
+        path = f"{self.file_name}.metrics.json"
+        try:
+            with open(path, "w") as file:
+                json.dump(report, file, indent=2, default=str)
+        except OSError as e:
+            logger.info(f"Could not write {path}: {e}")
+        logger.info(f"Job metrics: {json.dumps(report, default=str)}")
+        return report
@@ -0,0 +1,118 @@
+import queue
+import threading
+
+from insta_scrap import metrics
+from insta_scrap.log_client import logger
+
+# Staged producer/consumer pipeline: every stage owns a bounded input queue
+# and a pool of worker threads, so follower pagination keeps prefetching
+# while the previous page is still being analysed.
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name: str, func, workers: int = 1, queue_size: int = 100):
+        # func(item, emit) processes one item and calls emit() for each
+        # output that goes to the next stage
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next = None
+        self._running = workers
+        self._lock = threading.Lock()
+
+
+class Pipeline:
+    def __init__(self, stages: list[Stage], poll_interval: float = 0.1):
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+
+    def stopped(self) -> bool:
+        return self.stop_event.is_set()
+
+    def stop(self):
+        # ask every worker to exit after its current item
+        self.stop_event.set()
+
+    def cancel(self):
+        # stop and drop every queued item that was not started yet
+        self.stop()
+        for stage in self.stages:
+            while True:
+                try:
+                    stage.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def put(self, stage: Stage, item) -> bool:
+        # blocking put that gives up as soon as the pipeline is stopped
+        while not self.stopped():
+            try:
+                stage.queue.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _emitter(self, stage: Stage):
+        if stage.next is None:
+            return lambda item: None
+        return lambda item: self.put(stage.next, item)
+
+    def _worker(self, stage: Stage):
+        emit = self._emitter(stage)
+        while not self.stopped():
+            try:
+                item = stage.queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                break
+            try:
+                stage.func(item, emit)
+            except Exception as e:
+                logger.info(f"Error in {stage.name} stage: {e}")
+
+        # the last worker of a stage closes the next one
+        with stage._lock:
+            stage._running -= 1
+            last = stage._running == 0
+        if last and stage.next is not None:
+            for _ in range(stage.next.workers):
+                self.put(stage.next, _DONE)
+
+    def run(self, items):
+        # feed items into the first stage and wait until every stage drained
+        threads = []
+        for stage in self.stages:
+            for index in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(stage,),
+                    name=f"{stage.name}-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        metrics.gauge(
+            "queue_depth",
+            lambda: [
+                ({"stage": stage.name}, stage.queue.qsize()) for stage in self.stages
+            ],
+        )
+        first = self.stages[0]
+        for item in items:
+            if not self.put(first, item):
+                break
+        for _ in range(first.workers):
+            self.put(first, _DONE)
+
+        for thread in threads:
+            thread.join()
+        metrics.remove_gauge("queue_depth")
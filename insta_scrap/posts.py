@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from the_retry import retry
+
+from config import config
+from insta_scrap import metrics
+from insta_scrap.decoding import loads
+from insta_scrap.exceptions_client import exceptions
+from insta_scrap.http_client import rapidapi_get
+from insta_scrap.log_client import logger
+
+# Memoized /v1/posts pages shared by get_posts and get_username_last_post_date:
+# a page is requested once per username and cursor, concurrent callers wait
+# on the same in-flight request instead of sending their own.
+
+_pages = OrderedDict()
+_pages_lock = threading.Lock()
+
+
+@retry(attempts=5, backoff=5, expected_exception=exceptions)
+@metrics.timed("posts")
+def _fetch_posts_page(username: str, token: str | None) -> dict:
+    querystring = {"username_or_id_or_url": username}
+    if token:
+        querystring["pagination_token"] = token
+    response = rapidapi_get("/v1/posts", params=querystring)
+    response.raise_for_status()
+    return loads(response.content)
+
+
+def get_posts_page(username: str, token: str | None = None) -> dict:
+    # raw /v1/posts json for a username and cursor
+    future, _ = posts_page(username, token)
+    return future.result()
+
+
+def posts_page(username: str, token: str | None = None) -> tuple[Future, bool]:
+    # the memoized page and whether this call sent its request (False when
+    # it was answered from the memo or by a request already in flight)
+    key = (username.lower(), token)
+    with _pages_lock:
+        future = _pages.get(key)
+        owner = future is None
+        if owner:
+            future = _pages[key] = Future()
+            # bounded memo, the oldest pages go first
+            while len(_pages) > config.POSTS_MEMO_SIZE:
+                _pages.popitem(last=False)
+        else:
+            _pages.move_to_end(key)
+    if not owner:
+        return future, False
+
+    try:
+        future.set_result(_fetch_posts_page(username, token))
+    except BaseException as e:
+        # do not memoize failures, the next caller tries again
+        with _pages_lock:
+            if _pages.get(key) is future:
+                del _pages[key]
+        logger.info(f"Error while getting posts of {username}: {e}")
+        future.set_exception(e)
+    return future, True
@@ -0,0 +1,96 @@
+import re
+import threading
+
+from config import config
+from insta_scrap import metrics
+from insta_scrap.log_client import logger
+
+# Local rules taken from the LLM system prompt (spam words, usernames with
+# lots of numbers, she/her pronouns, foreign text). They reject accounts
+# without any network call, only the remaining candidates go to the image
+# download and the LLM.
+
+PRONOUNS = re.compile(r"\b(she\s*/\s*her|she\s*/\s*they|her\s*/\s*hers)\b", re.I)
+FOREIGN_TEXT = re.compile(
+    "["
+    "\u0400-\u04ff"  # cyrillic
+    "\u0590-\u05ff"  # hebrew
+    "\u0600-\u06ff"  # arabic
+    "\u0900-\u097f"  # devanagari
+    "\u0e00-\u0e7f"  # thai
+    "\u3040-\u30ff"  # hiragana, katakana
+    "\u3400-\u9fff"  # cjk
+    "\uac00-\ud7af"  # hangul
+    "]"
+)
+DIGIT = re.compile(r"\d")
+
+
+def spam_regex(words: list[str]) -> re.Pattern | None:
+    words = [
+        re.escape(word.strip()).replace(r"\ ", r"\s+")
+        for word in words
+        if word.strip()
+    ]
+    if not words:
+        return None
+    return re.compile(r"\b(" + "|".join(words) + r")\b", re.I)
+
+
+class Prefilter:
+    def __init__(
+        self,
+        rules: list[str] = config.PREFILTER_RULES,
+        spam_words: list[str] = config.PREFILTER_SPAM_WORDS,
+        max_digits: int = config.PREFILTER_MAX_DIGITS,
+    ):
+        self.rules = set(rules)
+        self.spam = spam_regex(spam_words)
+        self.max_digits = max_digits
+        self.rejected = {}
+        self.username_rejections = 0
+        self.profile_rejections = 0
+        self._lock = threading.Lock()
+
+    def _reject(self, reason: str, before_info: bool) -> str:
+        metrics.inc("prefilter_rejections_total", reason=reason)
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+            if before_info:
+                self.username_rejections += 1
+            else:
+                self.profile_rejections += 1
+        return reason
+
+    def check_username(self, username: str) -> str | None:
+        # run before /v1/info, returns the rejection reason if any
+        if "digits" in self.rules and (
+            len(DIGIT.findall(username)) > self.max_digits
+        ):
+            return self._reject("digits", True)
+        if "foreign" in self.rules and FOREIGN_TEXT.search(username):
+            return self._reject("foreign", True)
+        return None
+
+    def check_profile(self, user_infos: dict) -> str | None:
+        # run on the validated profile, before the image and the LLM
+        text = f"{user_infos.get('full_name') or ''}\n{user_infos.get('bio') or ''}"
+        if "spam" in self.rules and self.spam and self.spam.search(text):
+            return self._reject("spam", False)
+        if "pronouns" in self.rules and PRONOUNS.search(text):
+            return self._reject("pronouns", False)
+        if "foreign" in self.rules and FOREIGN_TEXT.search(text):
+            return self._reject("foreign", False)
+        return None
+
+    def report(self) -> dict:
+        # a username rejection saves /v1/info, the image and the LLM call,
+        # a profile rejection saves the image and the LLM call
+        report = {
+            "rejected": dict(self.rejected),
+            "api_calls_avoided": 2 * self.username_rejections
+            + self.profile_rejections,
+            "llm_calls_avoided": self.username_rejections + self.profile_rejections,
+        }
+        logger.info(f"Prefilter: {report}")
+        return report
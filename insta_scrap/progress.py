@@ -0,0 +1,92 @@
+import threading
+import time
+
+from config import config
+from insta_scrap.log_client import logger
+
+# Live progress of a job, kept in memory by the engine: seeds done, followers
+# seen, accepted users, rejections by reason and API/LLM calls. A Reporter
+# thread puts a snapshot on a channel every PROGRESS_INTERVAL seconds, the
+# channel is anything with put() (queue.Queue in the same process, a
+# multiprocessing Manager queue across processes), so the UI follows a job
+# without reading its output file.
+
+COUNTERS = ("seeds_done", "followers_seen", "accepted", "api_calls", "llm_calls")
+
+
+class Progress:
+    def __init__(self, total_results: int = 0):
+        self.total_results = total_results
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.rejected = {}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: int = 1):
+        with self._lock:
+            self.counts[name] += value
+
+    def set(self, name: str, value: int):
+        with self._lock:
+            self.counts[name] = value
+
+    def reject(self, reason: str | None):
+        # takes the Prefilter verdict directly, None is not a rejection
+        if not reason:
+            return
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def snapshot(self, finished: bool = False) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+            rejected = dict(self.rejected)
+        elapsed = time.monotonic() - self.started
+        accepted = counts["accepted"]
+        # from the acceptance rate so far, None until the first user
+        eta = None
+        if accepted and not finished:
+            remaining = max(self.total_results - accepted, 0)
+            eta = elapsed / accepted * remaining
+        api_calls = counts["api_calls"]
+        return {
+            **counts,
+            "accepted_per_api_call": accepted / api_calls if api_calls else None,
+            "total_results": self.total_results,
+            "rejected": rejected,
+            "elapsed": elapsed,
+            "eta": eta,
+            "finished": finished,
+        }
+
+
+class Reporter:
+    # publishes snapshots of a Progress on a channel until stopped
+    def __init__(self, progress: Progress, channel, interval: float = None):
+        self.progress = progress
+        self.channel = channel
+        self.interval = interval or config.PROGRESS_INTERVAL
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="progress-reporter", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.publish()
+
+    def publish(self, finished: bool = False):
+        try:
+            self.channel.put(self.progress.snapshot(finished))
+        except Exception as e:
+            # a closed channel (UI gone) must not stop the job
+            logger.info(f"Could not publish progress: {e}")
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.publish(finished=True)
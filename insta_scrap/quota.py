@@ -0,0 +1,29 @@
+import threading
+
+
+class Quota:
+    # Shared accepted-results counter. Workers check reached() before every
+    # expensive step and the sink only writes a row after acquire() succeeded,
+    # so the output never goes past total_results.
+    def __init__(self, total: int, count: int = 0):
+        self.total = total
+        self.count = count
+        self._lock = threading.Lock()
+
+    def reached(self) -> bool:
+        return self.count >= self.total
+
+    def remaining(self) -> int:
+        return max(self.total - self.count, 0)
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.count >= self.total:
+                return False
+            self.count += 1
+            return True
+
+    def release(self):
+        # give the slot back when the write after acquire() failed
+        with self._lock:
+            self.count -= 1
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from config import config
+from insta_scrap.log_client import logger
+
+# Adaptive client-side rate limiting for RapidAPI: one limiter per host and
+# endpoint, each with a token bucket (requests per second) and an AIMD
+# concurrency limit that halves on 429 and grows back slowly on success.
+# Retry-After and the x-ratelimit-* headers pause the endpoint until reset.
+
+
+def retry_after_seconds(headers) -> float | None:
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(status: int | None) -> bool:
+    return status is not None and (status == 429 or status >= 500)
+
+
+class EndpointLimiter:
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # take a slot and a token, or return how long to wait before retrying
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.limit):
+                return 0.05
+            self.tokens = min(
+                self.burst, self.tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        while (wait := self._reserve()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while (wait := self._reserve()) > 0:
+            await asyncio.sleep(wait)
+
+    def release(self, status: int | None = None, headers=None):
+        # feed the response back: AIMD on the concurrency, pause on 429
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status == 429:
+                self.throttled += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                pause = retry_after_seconds(headers)
+                if pause is None:
+                    pause = config.RATE_LIMIT_BACKOFF
+                self.blocked_until = max(self.blocked_until, now + pause)
+                logger.info(
+                    f"Throttled on {self.name}, concurrency {self.limit:.1f}, pausing {pause:.1f}s"
+                )
+            elif status is not None and status < 500:
+                self.limit = min(
+                    self.max_concurrency, self.limit + 1 / max(self.limit, 1)
+                )
+            remaining = headers.get("x-ratelimit-requests-remaining") if headers else None
+            if remaining is not None and remaining.strip() == "0":
+                reset = headers.get("x-ratelimit-requests-reset")
+                try:
+                    pause = float(reset)
+                except (TypeError, ValueError):
+                    pause = config.RATE_LIMIT_BACKOFF
+                self.blocked_until = max(self.blocked_until, now + pause)
+
+
+# requests per second budget of each endpoint, the rest use the default
+ENDPOINT_RATES = {
+    "/v1/followers": lambda: config.RATE_LIMIT_FOLLOWERS_RPS,
+    "/v1/info": lambda: config.RATE_LIMIT_INFO_RPS,
+    "/v1/posts": lambda: config.RATE_LIMIT_POSTS_RPS,
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(path: str, host: str | None = None) -> EndpointLimiter:
+    host = host or config.RAPID_API_HOST
+    name = f"{host}{path}"
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                rate = ENDPOINT_RATES.get(path, lambda: config.RATE_LIMIT_DEFAULT_RPS)()
+                limiter = _limiters[name] = EndpointLimiter(
+                    name,
+                    rate,
+                    max(int(rate), 1),
+                    config.RATE_LIMIT_MAX_CONCURRENCY,
+                )
+    return limiter
@@ -0,0 +1,225 @@
+import threading
+
+from config import config
+from insta_scrap.log_client import logger
+
+# Fair scheduling of follower pages across seed accounts. Up to
+# SEED_CONCURRENCY seeds are crawled at once (read lazily from the seed
+# iterator), and each follower page goes to the eligible seed that is the
+# most behind:
+#   - "fair": fewest accepted users, then fewest pages (accepted results are
+#     spread across the seeds)
+#   - "round_robin": fewest pages fetched
+# A seed is not eligible while one of its pages is being fetched, while
+# SEED_MAX_QUEUED of its followers wait for analysis, or once it reached
+# SEED_QUOTA accepted users. A huge seed therefore never holds the whole
+# pipeline and small seeds get their turn.
+
+POLICIES = ("fair", "round_robin")
+
+# seconds between checks when no seed is eligible
+POLL_INTERVAL = 0.05
+
+
+class Seed:
+    __slots__ = (
+        "index",
+        "username",
+        "token",
+        "pages",
+        "followers",
+        "queued",
+        "accepted",
+        "fetching",
+        "state",
+    )
+
+    def __init__(self, index: int, username: str, token):
+        self.index = index
+        self.username = username
+        self.token = token
+        self.pages = 0
+        self.followers = 0
+        self.queued = 0
+        self.accepted = 0
+        self.fetching = False
+        # active, exhausted, failed, quota
+        self.state = "active"
+
+
+class SeedScheduler:
+    def __init__(
+        self,
+        seeds,
+        checkpoint,
+        token=None,
+        progress=None,
+        concurrency: int = config.SEED_CONCURRENCY,
+        max_queued: int = config.SEED_MAX_QUEUED,
+        quota: int = config.SEED_QUOTA,
+        policy: str = config.SEED_SCHEDULING,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown seed scheduling {policy!r}")
+        self._seeds = enumerate(seeds)
+        self.checkpoint = checkpoint
+        self.token = token
+        self.progress = progress
+        self.concurrency = max(concurrency, 1)
+        self.max_queued = max_queued
+        self.quota = quota
+        self.policy = policy
+        # every seed met, for the stats, and the ones still crawled
+        self.seeds = {}
+        self.active = {}
+        self._exhausted = False
+        self._closed = False
+        self._changed = threading.Condition()
+
+    def _fill(self):
+        # pull seeds from the iterator until enough are active, skipping the
+        # ones a resumed job already paginated
+        while not self._exhausted and len(self.active) < self.concurrency:
+            item = next(self._seeds, None)
+            if item is None:
+                self._exhausted = True
+                return
+            index, username = item
+            cursor, seed_done = self.checkpoint.seed_state(index)
+            if seed_done:
+                if self.progress:
+                    self.progress.add("seeds_done")
+                continue
+            logger.info(f"*** Processing Username n* {index} : {username}")
+            seed = Seed(index, username, cursor or self.token)
+            self.seeds[index] = self.active[index] = seed
+
+    def _eligible(self, seed: Seed) -> bool:
+        if seed.fetching:
+            return False
+        if self.max_queued and seed.queued >= self.max_queued:
+            return False
+        return True
+
+    def _full(self, seed: Seed) -> bool:
+        # also true for a seed already paginated whose followers are queued
+        return bool(self.quota) and seed.accepted >= self.quota
+
+    def _priority(self, seed: Seed) -> tuple:
+        if self.policy == "fair":
+            return (seed.accepted, seed.pages, seed.index)
+        return (seed.pages, seed.index)
+
+    def _retire(self, seed: Seed, state: str):
+        if seed.state != "active":
+            return
+        seed.state = state
+        self.active.pop(seed.index, None)
+        if state == "exhausted":
+            self.checkpoint.end_seed(seed.index, seed.username)
+            if self.progress:
+                self.progress.add("seeds_done")
+
+    def next_seed(self) -> Seed | None:
+        # the seed whose next page should be fetched now, None if none is
+        # eligible at the moment (see finished())
+        with self._changed:
+            if self._closed:
+                return None
+            self._fill()
+            candidates = [seed for seed in self.active.values() if self._eligible(seed)]
+            if not candidates:
+                return None
+            seed = min(candidates, key=self._priority)
+            seed.fetching = True
+            return seed
+
+    def finished(self) -> bool:
+        with self._changed:
+            if self._closed:
+                return True
+            self._fill()
+            return not self.active
+
+    def wait(self, timeout: float = POLL_INTERVAL):
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def __iter__(self):
+        # blocking stream of seeds to fetch a page for, ends once every seed
+        # is retired or the scheduler is closed
+        while True:
+            seed = self.next_seed()
+            if seed is not None:
+                yield seed
+            elif self.finished():
+                return
+            else:
+                self.wait()
+
+    def page_fetched(self, seed: Seed, followers: int | None, next_token):
+        # followers is the number of new followers queued from the page, None
+        # for a failed page (its cursor is kept for a resumed run)
+        with self._changed:
+            seed.fetching = False
+            if followers is None:
+                self._retire(seed, "failed")
+            else:
+                seed.pages += 1
+                seed.followers += followers
+                seed.queued += followers
+                seed.token = next_token
+                if not next_token:
+                    self._retire(seed, "exhausted")
+            self._changed.notify_all()
+
+    def release(self, seed: Seed):
+        # a fetch abandoned before the request (quota met, job stopping)
+        with self._changed:
+            seed.fetching = False
+            self._changed.notify_all()
+
+    def dequeued(self, seed_index: int):
+        # a follower of the seed left the queue for the analysis
+        with self._changed:
+            seed = self.active.get(seed_index)
+            if seed is not None and seed.queued > 0:
+                seed.queued -= 1
+                if self.max_queued and seed.queued == self.max_queued - 1:
+                    self._changed.notify_all()
+
+    def seed_full(self, seed_index: int) -> bool:
+        # the seed reached its quota, its queued followers can be dropped
+        seed = self.seeds.get(seed_index)
+        return seed is not None and self._full(seed)
+
+    def accept(self, seed_index: int) -> bool:
+        # count an accepted user of the seed, False once its quota is met
+        with self._changed:
+            seed = self.seeds.get(seed_index)
+            if seed is None:
+                return True
+            if self._full(seed):
+                return False
+            seed.accepted += 1
+            if self._full(seed):
+                self._retire(seed, "quota")
+            self._changed.notify_all()
+            return True
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def report(self) -> dict:
+        seeds = list(self.seeds.values())
+        report = {
+            "seeds": len(seeds),
+            "by_state": {},
+            "accepted": {seed.username: seed.accepted for seed in seeds if seed.accepted},
+        }
+        for seed in seeds:
+            report["by_state"][seed.state] = report["by_state"].get(seed.state, 0) + 1
+        logger.info(f"Seeds: {report}")
+        return report
@@ -0,0 +1,77 @@
+import csv
+import io
+import itertools
+import math
+import os
+import sys
+
+# Seed usernames as a lazy stream, so a seed file of any size is read in
+# constant memory. A source can be:
+#   - a path to a CSV file with a username_or_url column, "-" for stdin
+#   - an open text or binary file with the same CSV layout
+#   - a pandas DataFrame (the column is iterated, pandas is not imported)
+#   - any iterable of usernames, e.g. a list or a generator
+
+SEED_COLUMN = "username_or_url"
+
+
+def _csv_rows(lines, column: str):
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return
+    if column not in reader.fieldnames:
+        raise ValueError(f"seed CSV has no {column} column")
+    for row in reader:
+        yield row[column]
+
+
+def _read_path(path, column: str):
+    # opened on first iteration, closed once exhausted
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        yield from _csv_rows(file, column)
+
+
+def iter_seeds(source, column: str = SEED_COLUMN):
+    # usernames of a seed source, stripped, blanks skipped
+    if source is None:
+        return
+    if isinstance(source, (str, os.PathLike)):
+        if source == "-":
+            rows = _csv_rows(sys.stdin, column)
+        else:
+            rows = _read_path(source, column)
+    elif hasattr(source, "read"):
+        if isinstance(source, io.TextIOBase):
+            rows = _csv_rows(source, column)
+        else:
+            rows = _csv_rows(
+                io.TextIOWrapper(source, encoding="utf-8-sig", newline=""), column
+            )
+    elif hasattr(source, "columns"):
+        if column not in source.columns:
+            raise ValueError(f"seed DataFrame has no {column} column")
+        rows = source[column]
+    else:
+        rows = source
+    for username in rows:
+        # empty DataFrame cells come back as NaN
+        if username is None or (isinstance(username, float) and math.isnan(username)):
+            continue
+        username = str(username).strip()
+        if username:
+            yield username
+
+
+def open_seeds(source, column: str = SEED_COLUMN):
+    # lazy seed iterator, or None when the source has no seed at all
+    seeds = iter_seeds(source, column)
+    first = next(seeds, None)
+    if first is None:
+        return None
+    return itertools.chain((first,), seeds)
+
+
+def batched(items, size: int):
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
@@ -0,0 +1,451 @@
+import atexit
+import csv
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from the_retry import retry
+
+from config import config
+from insta_scrap import metrics
+from insta_scrap.log_client import logger
+
+# Single-writer output sinks: workers hand accepted records over a queue and
+# one thread owns the target, writing them in batches with a periodic flush.
+# An output has a sink per SINK_TARGETS entry: its file, and/or the Supabase
+# table where batches are upserted on user_id (retried, idempotent). A full
+# queue blocks the workers until the writer catches up.
+
+_CLOSE = object()
+
+
+class CsvWriter:
+    def __init__(self, file_name: str):
+        # append to an existing output (resumed job) without a second header
+        self.has_header = os.path.exists(file_name) and os.path.getsize(file_name)
+        self.file = open(file_name, "a", newline="", encoding="utf-8")
+        self.writer = None
+
+    def write(self, batch: list[dict]):
+        if self.writer is None:
+            self.writer = csv.DictWriter(
+                self.file, fieldnames=list(batch[0]), extrasaction="ignore"
+            )
+            if not self.has_header:
+                self.writer.writeheader()
+        self.writer.writerows(batch)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlWriter:
+    def __init__(self, file_name: str):
+        self.file = open(file_name, "a", encoding="utf-8")
+
+    def write(self, batch: list[dict]):
+        self.file.writelines(
+            json.dumps(record, default=str) + "\n" for record in batch
+        )
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# Parquet columns of an output row (see get_gender.user_row), fixed so a
+# first batch with only None in a column does not type it null. Other keys
+# are written as strings.
+COUNT_FIELDS = ("follower_count", "following_count", "post_count")
+ROW_FIELDS = (
+    "user_id",
+    "username",
+    "full_name",
+    "profile_link",
+    "bio",
+    *COUNT_FIELDS,
+    "country",
+    "last_post_date",
+    "token",
+)
+
+
+def parquet_value(name: str, value):
+    # "" is the API's missing count, counts are nullable int64
+    if value is None or value == "":
+        return None
+    if name in COUNT_FIELDS:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return value if isinstance(value, str) else str(value)
+
+
+class ParquetWriter:
+    def __init__(self, file_name: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output needs pyarrow installed") from e
+        self.pa = pa
+        self.pq = pq
+        self.file_name = file_name
+        self.schema = None
+        self.writer = None
+
+    def _schema(self, record: dict):
+        fields = list(ROW_FIELDS) + [name for name in record if name not in ROW_FIELDS]
+        return self.pa.schema(
+            [
+                (name, self.pa.int64() if name in COUNT_FIELDS else self.pa.string())
+                for name in fields
+            ]
+        )
+
+    def write(self, batch: list[dict]):
+        if self.writer is None:
+            self.schema = self._schema(batch[0])
+            self.writer = self.pq.ParquetWriter(self.file_name, self.schema)
+        rows = [
+            {name: parquet_value(name, record.get(name)) for name in self.schema.names}
+            for record in batch
+        ]
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+def sink_format(file_name: str) -> str:
+    extension = os.path.splitext(file_name)[1].lstrip(".").lower()
+    return extension if extension in WRITERS else "csv"
+
+
+TABLE_NAME = re.compile(r"^\w+$")
+
+
+class SupabaseTable:
+    def __init__(self, name: str, url: str, key: str):
+        from supabase import create_client
+
+        self.name = name
+        self.client = create_client(url, key)
+
+    def upsert(self, rows: list[dict]):
+        self.client.table(self.name).upsert(
+            rows, on_conflict="user_id", returning="minimal"
+        ).execute()
+
+    def close(self):
+        pass
+
+
+class SqliteTable:
+    # local stand-in for the Supabase table, same upsert on user_id
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} ("
+            "user_id TEXT PRIMARY KEY, row TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def upsert(self, rows: list[dict]):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO {self.name} (user_id, row, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET "
+                "row = excluded.row, updated_at = excluded.updated_at",
+                [(str(row["user_id"]), json.dumps(row), now) for row in rows],
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def open_table(name: str | None = None):
+    name = name or config.SUPABASE_TABLE
+    if not TABLE_NAME.match(name):
+        raise ValueError(f"invalid table name {name!r}")
+    url = config.SUPABASE_URL or ""
+    if url.startswith("sqlite:///"):
+        return SqliteTable(name, url.removeprefix("sqlite:///"))
+    if not url or not config.SUPABASE_KEY:
+        raise ValueError("The supabase sink needs SUPABASE_URL and SUPABASE_KEY")
+    return SupabaseTable(name, url, config.SUPABASE_KEY)
+
+
+def count_retry():
+    metrics.inc("upsert_retries_total")
+
+
+class SupabaseWriter:
+    def __init__(self, table: str | None = None):
+        self.table = open_table(table)
+
+    def write(self, batch: list[dict]):
+        # one row per user_id (the last one), a batch replayed after a failed
+        # attempt only overwrites the same rows
+        rows = {}
+        for record in batch:
+            rows[record["user_id"]] = json.loads(json.dumps(record, default=str))
+        self._upsert(list(rows.values()))
+
+    @retry(
+        attempts=config.SUPABASE_RETRIES,
+        backoff=1,
+        exponential_backoff=True,
+        maximum_backoff=30,
+        expected_exception=Exception,
+        on_exception=count_retry,
+    )
+    def _upsert(self, rows: list[dict]):
+        # the last failed attempt re-raises, the sink then fails the job
+        self.table.upsert(rows)
+
+    def close(self):
+        self.table.close()
+
+
+class Sink:
+    # the writer thread shared by every target, see FileSink and SupabaseSink
+    stage = "sink"
+
+    def __init__(
+        self,
+        target: str,
+        batch_size: int,
+        flush_interval: float,
+        queue_size: int,
+    ):
+        self.target = target
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        # opened here so a bad target fails the caller, not the thread
+        self._writer = self._open_writer()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{self.stage}-{target}", daemon=True
+        )
+        self._thread.start()
+
+    def _open_writer(self):
+        raise NotImplementedError
+
+    def write(self, record: dict, on_written=None):
+        # thread safe, blocks only when the writer is far behind. on_written()
+        # runs on the writer thread once the batch holding the record is written
+        self._put((record, on_written))
+
+    def close(self):
+        # flush what is left and wait for the writer thread
+        if self.error is None:
+            self._put(_CLOSE)
+        self._thread.join()
+        self._raise_error()
+
+    def _put(self, item):
+        # a writer thread stopped by a failed batch never drains the queue
+        while True:
+            self._raise_error()
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"{self.stage} to {self.target} failed") from self.error
+
+    def _flush(self, writer, items: list[tuple]):
+        batch = [record for record, _ in items]
+        started = time.perf_counter()
+        try:
+            writer.write(batch)
+            self.written += len(batch)
+            metrics.observe(
+                "stage_latency_seconds", time.perf_counter() - started, stage=self.stage
+            )
+            metrics.inc("stage_calls_total", stage=self.stage)
+            metrics.inc(f"{self.stage}_rows_total", len(batch))
+        except Exception as e:
+            # the rows are already counted in the quota, the job fails
+            # instead of finishing with a hole in the output
+            metrics.inc("stage_errors_total", stage=self.stage)
+            logger.info(f"Error while writing {len(batch)} rows to {self.target}: {e}")
+            self.error = e
+            return
+        for _, on_written in items:
+            if on_written is None:
+                continue
+            try:
+                on_written()
+            except Exception as e:
+                logger.info(f"Error after writing a row to {self.target}: {e}")
+
+    def _run(self):
+        writer = self._writer
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while True:
+                try:
+                    item = self.queue.get(
+                        timeout=max(deadline - time.monotonic(), 0)
+                    )
+                except queue.Empty:
+                    item = None
+                if item is _CLOSE:
+                    break
+                if item is not None:
+                    batch.append(item)
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    if batch:
+                        self._flush(writer, batch)
+                        batch = []
+                        if self.error is not None:
+                            break
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and self.error is None:
+                self._flush(writer, batch)
+        finally:
+            writer.close()
+
+
+class FileSink(Sink):
+    def __init__(
+        self,
+        file_name: str,
+        fmt: str | None = None,
+        batch_size: int = config.SINK_BATCH_SIZE,
+        flush_interval: float = config.SINK_FLUSH_INTERVAL,
+    ):
+        self.file_name = file_name
+        self.fmt = fmt or sink_format(file_name)
+        super().__init__(file_name, batch_size, flush_interval, config.SINK_QUEUE_SIZE)
+
+    def _open_writer(self):
+        return WRITERS[self.fmt](self.file_name)
+
+
+class SupabaseSink(Sink):
+    stage = "upsert"
+
+    def __init__(
+        self,
+        table: str | None = None,
+        batch_size: int = config.SUPABASE_BATCH_SIZE,
+        flush_interval: float = config.SUPABASE_FLUSH_INTERVAL,
+    ):
+        self.table = table or config.SUPABASE_TABLE
+        super().__init__(
+            f"supabase:{self.table}",
+            batch_size,
+            flush_interval,
+            config.SUPABASE_QUEUE_SIZE,
+        )
+
+    def _open_writer(self):
+        return SupabaseWriter(self.table)
+
+
+TARGETS = {
+    "file": FileSink,
+    "supabase": lambda file_name: SupabaseSink(),
+}
+
+
+def _when_all(count: int, callback):
+    # callback() once every sink of the output has written the record
+    lock = threading.Lock()
+    left = [count]
+
+    def written():
+        with lock:
+            left[0] -= 1
+            if left[0]:
+                return
+        callback()
+
+    return written
+
+
+class Output:
+    # the sinks of an output file, every record goes to each of them
+    def __init__(self, file_name: str, targets=None):
+        targets = targets or config.SINK_TARGETS
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise ValueError(f"unknown sink targets {sorted(unknown)}")
+        self.sinks = []
+        try:
+            for target in targets:
+                self.sinks.append(TARGETS[target](file_name))
+        except Exception:
+            self.close()
+            raise
+
+    def write(self, record: dict, on_written=None):
+        if on_written is not None and len(self.sinks) > 1:
+            on_written = _when_all(len(self.sinks), on_written)
+        for sink in self.sinks:
+            sink.write(record, on_written)
+
+    def close(self):
+        # every sink is closed, then the first failure is raised
+        error = None
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def open_sink(file_name: str) -> Output:
+    # one output per file name for the whole process
+    with _sinks_lock:
+        output = _sinks.get(file_name)
+        if output is None:
+            output = _sinks[file_name] = Output(file_name)
+        return output
+
+
+def close_sink(file_name: str):
+    with _sinks_lock:
+        output = _sinks.pop(file_name, None)
+    if output is not None:
+        output.close()
+        for sink in output.sinks:
+            logger.info(f"Sink closed - {sink.written} rows in {sink.target}")
+
+
+@atexit.register
+def close_all_sinks():
+    # flush sinks opened outside an engine run (e.g. analyse_username)
+    for file_name in list(_sinks):
+        try:
+            close_sink(file_name)
+        except Exception as e:
+            logger.info(f"Error while closing the sink of {file_name}: {e}")
@@ -0,0 +1,266 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from the_retry import retry
+
+from config import config
+from insta_scrap import metrics
+from insta_scrap.decoding import (
+    decode_commenters,
+    decode_followers,
+    decode_posts,
+    loads,
+)
+from insta_scrap.exceptions_client import exceptions
+from insta_scrap.http_client import rapidapi_get
+from insta_scrap.log_client import logger
+from insta_scrap.posts import posts_page
+
+# Where the usernames to analyse come from. A source returns one "page" of
+# usernames for a seed account and the cursor of the next one (None once the
+# seed is done), the same shape as get_followers, so every engine and the
+# seed scheduler work with either:
+#   - "followers": the follower list of the seed
+#   - "commenters": the people commenting the seed's posts, fetched for
+#     several posts at once. Active commenters are a denser source of
+#     qualifying users than raw follower lists.
+# Cursors are plain strings so checkpoints and the queue broker store them.
+
+
+@retry(attempts=5, expected_exception=exceptions)
+@metrics.timed("comments")
+def get_com_usernames(post_id, token):
+    # Get the usernames of the comments, use token in available
+    try:
+        querystring = {"code_or_id_or_url": post_id, "sort_by": "popular"}
+        if token:
+            querystring["pagination_token"] = token
+
+        # Analyse and parse the comments to get the usernames
+        response = rapidapi_get("/v1/comments", params=querystring)
+        response.raise_for_status()
+        return decode_commenters(loads(response.content))
+    except Exception as e:
+        metrics.inc("stage_errors_total", stage="comments")
+        logger.info(f"Error while getting comments: {e}")
+        return None, None
+
+
+def get_posts(username, token, min_comments=10):
+    # get the post ids and use token in available
+    return read_posts(username, token, min_comments)[0]
+
+
+def read_posts(username, token, min_comments=10):
+    # get_posts and whether a /v1/posts request was sent for it
+    requested = False
+    try:
+        # memoized page, shared with get_username_last_post_date
+        future, requested = posts_page(username, token)
+        posts, new_token, is_private = decode_posts(future.result())
+        if is_private:
+            return None, requested
+        id_list = [
+            post.id for post in posts if post.comment_count > min_comments and post.id
+        ]
+        return (id_list, new_token), requested
+    except Exception as e:
+        logger.info(f"Error while getting posts: {e}")
+        return (None, None), requested
+
+
+@retry(attempts=5, expected_exception=exceptions)
+@metrics.timed("followers")
+def get_followers(username: str, token):
+    # get the followers username and use token if available
+    try:
+        # Initialise the parameters needed to send the requests
+        querystring = {"username_or_id_or_url": username}
+
+        if token:
+            querystring["pagination_token"] = token
+
+        # Analyse and parse the response
+        response = rapidapi_get("/v1/followers", params=querystring)
+        response.raise_for_status()
+        followers, new_token = decode_followers(loads(response.content))
+        id_list = [
+            follower.username for follower in followers if not follower.is_private
+        ]
+        return id_list, new_token
+    except Exception as e:
+        metrics.inc("stage_errors_total", stage="followers")
+        logger.info(f"Error while getting posts: {e}")
+        return None, None
+
+
+class FollowerSource:
+    name = "followers"
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.stats = {"pages": 0, "usernames": 0}
+        self._lock = threading.Lock()
+
+    def count(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                self.stats[key] = self.stats.get(key, 0) + value
+        if self.progress and values.get("api_calls"):
+            self.progress.add("api_calls", values["api_calls"])
+
+    def fetch(self, username: str, cursor: str | None):
+        usernames, next_token = get_followers(username, cursor)
+        self.count(api_calls=1)
+        if usernames is None:
+            return None, None
+        self.count(pages=1, usernames=len(usernames))
+        # an empty page ends the seed like a missing token
+        return usernames, next_token if usernames else None
+
+    def report(self, accepted: int, api_calls: int) -> dict:
+        # accepted users per API call of the whole job, to compare the modes
+        report = {
+            "source": self.name,
+            **self.stats,
+            "accepted": accepted,
+            "accepted_per_api_call": round(accepted / api_calls, 4)
+            if api_calls
+            else None,
+        }
+        logger.info(f"Source: {report}")
+        return report
+
+    def close(self):
+        pass
+
+
+class CommenterSource(FollowerSource):
+    # cursor: JSON with the next /v1/posts token and the posts whose
+    # comments are still paginated, as [post_id, comment token, pages read]
+    name = "commenters"
+
+    def __init__(
+        self,
+        progress=None,
+        posts_at_once: int = config.COMMENT_POSTS_AT_ONCE,
+        max_pages: int = config.COMMENT_MAX_PAGES,
+        min_comments: int = config.COMMENT_MIN_COMMENTS,
+    ):
+        super().__init__(progress)
+        self.stats.update(posts=0, comment_pages=0)
+        self.posts_at_once = posts_at_once
+        self.max_pages = max_pages
+        self.min_comments = min_comments
+        # a full batch for each seed crawled at once, a request still
+        # running past its timeout keeps its thread until it answers
+        self.capacity = posts_at_once * config.SEED_CONCURRENCY
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.capacity, thread_name_prefix="comments"
+        )
+        # (post_id, comment token) -> comment page request not read yet
+        self._inflight = {}
+
+    def _comment_page(self, post_id: str, token: str | None):
+        # the request of a comment page, the one already running if a
+        # previous page gave up waiting for it, None when every thread is busy
+        key = (post_id, token)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            running = [f for f in self._inflight.values() if not f.done()]
+            if len(running) >= self.capacity:
+                return None, False
+            # answers of seeds that stopped are never read, oldest go first
+            for old_key in list(self._inflight):
+                if len(self._inflight) < self.capacity * 2:
+                    break
+                if self._inflight[old_key].done():
+                    del self._inflight[old_key]
+            future = self._inflight[key] = self.executor.submit(
+                get_com_usernames, post_id, token
+            )
+            return future, True
+
+    def _forget(self, post_id: str, token: str | None):
+        with self._lock:
+            self._inflight.pop((post_id, token), None)
+
+    def fetch(self, username: str, cursor: str | None):
+        state = json.loads(cursor) if cursor else {"posts_token": None, "posts": []}
+        if not state["posts"] and state["posts_token"] is not False:
+            # next page of posts, memoized and shared with the last post date
+            posts, requested = read_posts(
+                username, state["posts_token"], self.min_comments
+            )
+            self.count(api_calls=int(requested))
+            if posts is None:
+                # private account, nothing to read
+                return [], None
+            post_ids, posts_token = posts
+            if post_ids is None:
+                return None, None
+            self.count(posts=len(post_ids))
+            state["posts"] = [[post_id, None, 0] for post_id in post_ids]
+            # False once every page of posts was read
+            state["posts_token"] = posts_token or False
+
+        # one comment page for each of the first posts, concurrently
+        batch = []
+        pending = []
+        requests = 0
+        for post in state["posts"]:
+            future = None
+            if len(batch) < self.posts_at_once:
+                future, requested = self._comment_page(*post[:2])
+                requests += requested
+            if future is None:
+                pending.append(post)
+            else:
+                batch.append((post, future))
+        # a post slower than its stage timeout does not hold the page, its
+        # request keeps running and a later page reads the answer
+        wait([future for _, future in batch], timeout=config.COMMENTS_TIMEOUT)
+        usernames = []
+        for (post_id, token, read), future in batch:
+            if not future.done():
+                metrics.inc("abandoned_total", stage="comments")
+                self.count(abandoned=1)
+                if read + 1 < self.max_pages:
+                    pending.append([post_id, token, read + 1])
+                else:
+                    # given up, its thread is counted until the request ends
+                    future.add_done_callback(
+                        lambda _, key=(post_id, token): self._forget(*key)
+                    )
+                continue
+            self._forget(post_id, token)
+            commenters, token = future.result()
+            if commenters is None:
+                # failed post, skipped
+                continue
+            self.count(comment_pages=1, usernames=len(commenters))
+            # a commenter can show up several times in a page
+            usernames.extend(dict.fromkeys(commenters))
+            if token and commenters and read + 1 < self.max_pages:
+                pending.append([post_id, token, read + 1])
+        self.count(api_calls=requests, pages=1)
+        state["posts"] = pending
+        if not pending and state["posts_token"] is False:
+            return usernames, None
+        return usernames, json.dumps(state)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+SOURCES = {"followers": FollowerSource, "commenters": CommenterSource}
+
+
+def open_source(mode: str | None = None, progress=None) -> FollowerSource:
+    mode = mode or config.SOURCE_MODE
+    if mode not in SOURCES:
+        raise ValueError(f"unknown source mode {mode!r}")
+    return SOURCES[mode](progress)
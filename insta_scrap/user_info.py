@@ -1,20 +1,30 @@
 from datetime import datetime
-import dateparser
 import requests
 from the_retry import retry
 from config import config
+from insta_scrap import metrics
+from insta_scrap.cache import cached
+from insta_scrap.decoding import decode_profile, loads, parse_date
+from insta_scrap.deadline import stage_timeout
+from insta_scrap.http_client import http_get, rapidapi_get
 from insta_scrap.exceptions_client import exceptions
+from insta_scrap.images import (
+    DEFAULT_AVATAR,
+    ImageDownloadError,
+    check_download,
+    download_deadline,
+    is_default_avatar_url,
+    process_image,
+)
 from insta_scrap.log_client import logger
 
 
 # Décorateur pour gérer les tentatives multiples avec un délai croissant en cas d'échec
 # Fonction pour effectuer une requête HTTP GET avec gestion des erreurs.
-def check_uri(url, querystring, headers, timeout=30):
-    response = requests.get(
-        url=url, headers=headers, params=querystring, timeout=timeout
-    )
+def check_uri(path, querystring, timeout=None):
+    response = rapidapi_get(path, params=querystring, timeout=timeout)
     response.raise_for_status()
-    return response.json().get("data", None)
+    return loads(response.content).get("data", None)
 
 
 # Vérifie si la valeur est supérieure ou égale à la valeur minimale.
@@ -37,19 +47,103 @@ def is_equal(value1, value2) -> bool:
     return value1 == value2
 
 
-# Récupère l'image à partir de son URL et renvoie son contenu sous forme de bytes.
+# Récupère l'image à partir de son URL et renvoie les bytes à envoyer au LLM
+# (réduite, voir insta_scrap/images.py), DEFAULT_AVATAR pour un avatar par
+# défaut, ou None si le téléchargement échoue.
+# Le téléchargement est lu par morceaux, avec une taille et une durée maximales.
+@cached("image", cache_none=False)
+@metrics.timed("image")
 def get_image_bytes(image_url) -> bytes | None:
     logger.info("Getting Image bytes")
-    image_bytes = None
+    if not image_url:
+        return None
+    if is_default_avatar_url(image_url):
+        return DEFAULT_AVATAR
     try:
-        image_response = requests.get(image_url)
-        image_response.raise_for_status()
-        image_bytes = image_response.content
-        return image_bytes
-    except requests.exceptions.RequestException as e:
+        deadline = download_deadline()
+        with http_get(
+            image_url,
+            timeout=(config.HTTP_CONNECT_TIMEOUT, stage_timeout("image")),
+            stream=True,
+        ) as image_response:
+            image_response.raise_for_status()
+            check_download(
+                int(image_response.headers.get("Content-Length") or 0), deadline
+            )
+            image_bytes = bytearray()
+            for chunk in image_response.iter_content(config.IMAGE_CHUNK_SIZE):
+                image_bytes += chunk
+                check_download(len(image_bytes), deadline)
+        return process_image(bytes(image_bytes), image_url)
+    except (requests.exceptions.RequestException, ImageDownloadError) as e:
+        metrics.inc("stage_errors_total", stage="image")
         logger.info(f"Erreur lors du téléchargement de l'image : {e}")
 
 
+# Valide les données brutes de /v1/info et renvoie les informations de
+# l'utilisateur avec l'URL de sa photo de profil, sinon None.
+# Partagée par le moteur synchrone et le moteur asyncio.
+def validate_user_data(username, data) -> dict | None:
+    profile = decode_profile(data)
+    if not profile:
+        return None
+    logger.info(f"Validating user - {username} info")
+    # Validation des critères de l'utilisateur
+    if not profile.id:
+        return None
+    post_count = profile.post_count
+    if not post_count or not is_at_least(post_count, 3):
+        return None
+    # following_count = data.get("following_count", 0)
+    # if not is_at_least(following_count, 300):
+    #     return None
+    # follower_count = data.get("follower_count", 0)
+    # if not is_between(follower_count, 50, 5000):
+    #     return None
+    if profile.is_private:
+        return None
+    # if following_count >= follower_count:
+    #     return None
+    # "Month YYYY" en général, dateparser seulement pour un autre format
+    formatted_date_joined = parse_date(profile.date_joined)
+    if formatted_date_joined is None:
+        return None
+    today = datetime.today()
+    months = (today.year - formatted_date_joined.year) * 12 + (
+        today.month - formatted_date_joined.month
+    )
+    if months < 6:
+        return None
+    country = profile.country
+    # if not is_equal(country, "United States"):
+    #     return None
+
+    user = {
+        "user_infos": {
+            "user_id": profile.id,
+            "username": profile.username,
+            "full_name": profile.full_name,
+            "profile_link": f"https://instagram.com/{profile.username}",
+            "bio": profile.biography,
+            "follower_count": profile.follower_count,
+            "following_count": profile.following_count,
+            "post_count": profile.media_count,
+            "country": country,
+        },
+        "image_url": profile.image_url,
+    }
+    logger.info(f"User is valid - {username}")
+    return user
+
+
+def user_info_querystring(username) -> dict:
+    return {
+        "username_or_id_or_url": username,
+        "include_about": True,
+        "url_embed_safe": True,
+    }
+
+
 """
     Récupère les informations publiques d'un utilisateur Instagram via une API externe.
 
@@ -62,71 +156,25 @@ def get_image_bytes(image_url) -> bytes | None:
 """
 
 
+# Récupère et valide les informations sans télécharger la photo de profil.
+# Les utilisateurs rejetés (None) sont aussi mis en cache.
+@cached("user_info")
 @retry(attempts=2, expected_exception=exceptions)
-def get_user_infos(username):
+@metrics.timed("user_info")
+def get_user_data(username) -> dict | None:
     logger.info(f"Getting user - {username} info")
-    url = f"https://{config.RAPID_API_HOST}/v1/info"
-    querystring = {
-        "username_or_id_or_url": username,
-        "include_about": True,
-        "url_embed_safe": True,
-    }
-    headers = {
-        "X-RapidAPI-Key": config.RAPID_API_KEY,
-        "X-RapidAPI-Host": f"{config.RAPID_API_HOST}",
-    }
-    data = check_uri(url, querystring, headers)
-
-    if data:
-        logger.info(f"Validating user - {username} info")
-        # Validation des critères de l'utilisateur
-        if not data.get("id"):
-            return None
-        post_count = data.get("post_count", data.get("media_count"))
-        if not post_count or not is_at_least(post_count, 3):
-            return None
-        # following_count = data.get("following_count", 0)
-        # if not is_at_least(following_count, 300):
-        #     return None
-        # follower_count = data.get("follower_count", 0)
-        # if not is_between(follower_count, 50, 5000):
-        #     return None
-        if data.get("is_private"):
-            return None
-        # if following_count >= follower_count:
-        #     return None
-        date_joined = data.get("about", {}).get("date_joined")
-        formatted_date_joined = dateparser.parse(date_joined)
-        today = datetime.today()
-        months = (today.year - formatted_date_joined.year) * 12 + (
-            today.month - formatted_date_joined.month
-        )
-        if months < 6:
-            return None
-        country = data.get("about", {}).get("country")
-        # if not is_equal(country, "United States"):
-        #     return None
-
-        user = {
-            "user_infos": {
-                "user_id": data["id"],
-                "username": data.get("username", ""),
-                "full_name": data.get("full_name", ""),
-                "profile_link": f"https://instagram.com/{data.get('username')}",
-                "bio": data.get("biography", ""),
-                "follower_count": data.get("follower_count", ""),
-                "following_count": data.get("following_count", ""),
-                "post_count": data.get("media_count"),
-                "country": country,
-            },
-            "image_bytes": get_image_bytes(
-                data.get("profile_pic_url_hd", data.get("profile_pic_url"))
-            ),
-        }
-        logger.info(f"User is valid - {username}")
-        return user
-    else:
+    data = check_uri("/v1/info", user_info_querystring(username))
+    return validate_user_data(username, data)
+
+
+def get_user_infos(username):
+    user = get_user_data(username)
+    if not user:
         return None
+    return {
+        "user_infos": user["user_infos"],
+        "image_bytes": get_image_bytes(user["image_url"]),
+    }
 
 
 # # Appel de la fonction avec un exemple d'utilisateur
@@ -0,0 +1,205 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from config import config
+from insta_scrap import metrics
+from insta_scrap.app import analyse_profile
+from insta_scrap.deadline import Deadline, within
+from insta_scrap.get_gender import user_row
+from insta_scrap.job_queue import JobQueue, Task
+from insta_scrap.log_client import logger
+from insta_scrap.prefilter import Prefilter
+from insta_scrap.progress import Progress
+from insta_scrap.seeds import batched
+from insta_scrap.sources import open_source
+
+# Queue engine worker: run as many of these as needed, on one or several
+# machines sharing the broker file:
+#
+#     python -m insta_scrap.worker --threads 8
+#
+# Each thread claims a task, runs it and marks it done. A task that raises
+# is put back for another attempt, a crashed worker's task is picked up again
+# once its lease expires.
+
+
+class QueueWorker:
+    def __init__(
+        self,
+        path: str = config.QUEUE_PATH,
+        threads: int = config.QUEUE_WORKER_THREADS,
+        job_id: str | None = None,
+    ):
+        # job_id limits the worker to one job and stops it once finished
+        self.queue = JobQueue(path)
+        self.threads = threads
+        self.job_id = job_id
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self.prefilter = Prefilter()
+        # calls and rejection reasons of this worker, the broker only knows
+        # accepted users
+        self.progress = Progress()
+        self.source = open_source(progress=self.progress)
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def handle(self, task: Task):
+        if task.kind == "page":
+            # followers or commenters, the cursor is stored as the task token
+            followers, next_token = self.source.fetch(task.username, task.token)
+            if followers is None:
+                raise RuntimeError(f"{self.source.name} page of {task.username} failed")
+            self.queue.add_users(task.job_id, followers, next_token)
+            if next_token:
+                self.queue.add_pages(task.job_id, [task.username], next_token)
+            return
+        logger.info("Starting ------------------------------------ Analysis")
+        # a profile out of its deadline raises, the task is tried again
+        with within(Deadline()):
+            user = analyse_profile(
+                task.username, task.token, self.prefilter, self.progress
+            )
+        if user is None:
+            return
+        user_info, last_post_date = user
+        row = user_row(user_info, task.token, last_post_date)
+        accepted = self.queue.accept(task.job_id, task.username, row)
+        if accepted is not None:
+            metrics.inc("accepted_total")
+            logger.info(f"** Ok - Username added | Total: {accepted} ({task.job_id})")
+
+    def work(self):
+        while not self._stop.is_set():
+            task = self.queue.claim(self.name, self.job_id)
+            if task is None:
+                if self.job_id and self.queue.job_status(self.job_id)["finished"]:
+                    return
+                self._stop.wait(config.QUEUE_POLL_INTERVAL)
+                continue
+            try:
+                self.handle(task)
+                self.queue.finish(task)
+            except Exception as e:
+                logger.info(f"Error in {task.kind} task {task.id}: {e}")
+                self.queue.finish(task, "pending")
+
+    def run(self):
+        logger.info(f"Worker {self.name} started with {self.threads} threads")
+        workers = [
+            threading.Thread(target=self.work, name=f"queue-worker-{i}", daemon=True)
+            for i in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            self.stop()
+        progress = self.progress.snapshot(finished=True)
+        logger.info(
+            f"Worker {self.name} | calls: {progress['api_calls']} API, {progress['llm_calls']} LLM | rejected: {progress['rejected']}"
+        )
+        self.prefilter.report()
+        self.source.close()
+        self.queue.close()
+
+
+def start_worker_process(path: str, job_id: str) -> subprocess.Popen:
+    # a local worker process for one job, used when the app runs the queue
+    # engine without external workers
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "insta_scrap.worker",
+            "--broker",
+            path,
+            "--job",
+            job_id,
+        ]
+    )
+
+
+def update_progress(progress: Progress, status: dict):
+    # the broker only knows tasks: followers seen are the user tasks, the
+    # rejection reasons and call counts stay in the worker processes (see
+    # /metrics)
+    users = status["kinds"].get("user", {})
+    progress.set("accepted", status["accepted"])
+    progress.set("followers_seen", sum(users.values()))
+
+
+def process_input_queue(
+    usernames,
+    file_name: str,
+    total_results: int,
+    token: str,
+    job_id: str,
+    workers: int = config.QUEUE_LOCAL_WORKERS,
+    progress: Progress | None = None,
+):
+    # enqueue the job, wait for the workers and export the accepted rows
+    progress = progress or Progress(total_results)
+    queue = JobQueue()
+    queue.create_job(job_id, file_name, total_results)
+    status = queue.job_status(job_id)
+    # a new job has no task yet, which also reads as finished
+    if status["tasks"] and status["finished"]:
+        logger.info(
+            f"Job {job_id} already finished ({status['accepted']}/{status['total_results']}), exporting its results"
+        )
+    else:
+        # enqueued in chunks, the seed file is never held in memory
+        for seeds in batched(usernames, config.QUEUE_SEED_BATCH):
+            queue.add_pages(job_id, seeds, token)
+    processes = [start_worker_process(queue.path, job_id) for _ in range(workers)]
+    try:
+        while not (status := queue.job_status(job_id))["finished"]:
+            logger.info(
+                f"Job {job_id}: {status['accepted']}/{status['total_results']} | tasks {status['tasks']}"
+            )
+            update_progress(progress, status)
+            # the workers only exit once the job is finished, or on a crash:
+            # status is read again, they may have finished it since
+            codes = [process.poll() for process in processes]
+            if None not in codes and not queue.job_status(job_id)["finished"]:
+                raise RuntimeError(
+                    f"All the workers of job {job_id} exited (codes {codes}) before it finished"
+                )
+            time.sleep(config.QUEUE_POLL_INTERVAL)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    update_progress(progress, queue.job_status(job_id))
+    queue.export_results(job_id, file_name)
+    queue.close()
+    logger.info("DONE!")
+    return file_name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue engine worker")
+    parser.add_argument("--broker", default=config.QUEUE_PATH)
+    parser.add_argument("--threads", type=int, default=config.QUEUE_WORKER_THREADS)
+    parser.add_argument("--job", default=None, help="only run this job, then exit")
+    args = parser.parse_args()
+    # snapshots for the /metrics endpoint of the app, no job summary here
+    job_metrics = metrics.JobMetrics(None)
+    try:
+        QueueWorker(args.broker, args.threads, args.job).run()
+    finally:
+        job_metrics.close()
+
+
+if __name__ == "__main__":
+    main()